@@ -118,7 +118,12 @@ class CATVSettings():
         self.checkSection(UDID)
         dprint(__name__, 1, "getsetting {0}", self.cfg.get(UDID, option))
         return self.cfg.get(UDID, option)
-    
+
+    def getSettings(self, UDID):
+        # all options of this aTV: {option: value}
+        self.checkSection(UDID)
+        return dict(self.cfg.items(UDID))
+
     def setSetting(self, UDID, option, val):
         self.checkSection(UDID)
         self.cfg.set(UDID, option, val)
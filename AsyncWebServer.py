@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+
+"""
+AsyncWebServer
+
+Alternative front end to the threaded WebServer - selected by 'webserver_frontend' in Settings.cfg.
+One asyncore loop owns all aTV connections, idle keep-alive connections don't hold a thread.
+Requests are routed through WebServer.handleRequest() - blocking work (PMS requests,
+XML rendering) is done in the worker pool, the result is handed back to the loop.
+
+Sources:
+http://docs.python.org/2/library/asyncore.html
+http://docs.python.org/2/library/asynchat.html
+medusa's "select_trigger" for waking up the loop from worker threads
+"""
+
+
+import sys
+import time
+import socket, errno
+import asyncore, asynchat
+import mimetools
+from StringIO import StringIO
+from email.utils import formatdate
+from BaseHTTPServer import BaseHTTPRequestHandler
+import threading
+import traceback
+
+import Registry
+from Debug import *  # dprint()
+
+
+
+g_StreamWindow = 2  # chunks of a streamed response handed to the loop, not sent yet - rendering waits for the aTV
+
+
+
+"""
+CTrigger - wake up the asyncore loop, run callbacks queued by worker threads in the loop thread
+socket pair via loopback, works on all platforms (no socketpair(), no select() on pipes under Windows)
+"""
+class CTrigger(asyncore.dispatcher):
+    def __init__(self, map):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.wsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.wsock.connect(listener.getsockname())
+        rsock, addr = listener.accept()
+        listener.close()
+        self.wsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        asyncore.dispatcher.__init__(self, rsock, map=map)
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    def pull(self, callback):
+        # called from any thread
+        self.lock.acquire()
+        try:
+            self.callbacks.append(callback)
+        finally:
+            self.lock.release()
+        try:
+            self.wsock.send('x')
+        except socket.error:
+            pass  # loop is awake anyway or shutting down
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self.recv(8192)
+        except socket.error:
+            pass
+        self.lock.acquire()
+        try:
+            callbacks = self.callbacks
+            self.callbacks = []
+        finally:
+            self.lock.release()
+        for callback in callbacks:
+            try:
+                callback()
+            except:
+                self.handle_error()
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self.wsock.close()
+
+
+
+"""
+CCommandPipe - wake up the asyncore loop when PlexConnect sends a command
+the pipe is only watched, never read here - the loop checks cmdPipe.poll() after every wakeup
+"""
+class CCommandPipe(asyncore.dispatcher):
+    def __init__(self, cmdPipe, map):
+        asyncore.dispatcher.__init__(self, map=map)
+        self._fileno = cmdPipe.fileno()
+        self.connected = True
+        self.add_channel(map)
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        pass
+
+    def close(self):
+        self.del_channel()
+
+
+
+"""
+CListener - listening socket of a threaded server, watched by the asyncore loop
+used for HTTPS in the single process WebServer - the TLS connections stay with the threaded handler
+
+parameters:
+    sock - non-blocking listening socket
+    accept - function(), called when connections are pending
+    map - asyncore channel map of the loop
+"""
+class CListener(asyncore.dispatcher):
+    def __init__(self, sock, accept, map):
+        asyncore.dispatcher.__init__(self, map=map)
+        self._fileno = sock.fileno()
+        self.connected = True
+        self.onAccept = accept
+        self.add_channel(map)
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.onAccept()
+
+    def handle_error(self):
+        dprint(__name__, 0, "Error in listener: {0}", sys.exc_info()[1])
+
+    def close(self):
+        self.del_channel()  # socket is owned by the threaded server
+
+
+
+"""
+CSentMarker - producer without data, in the channel's output queue behind a chunk
+more() is called by asynchat when everything pushed before it is sent
+"""
+class CSentMarker():
+    def __init__(self, callback):
+        self.callback = callback
+
+    def more(self):
+        self.callback()
+        return ''
+
+
+
+"""
+CAsyncHTTPServer - listening socket, creates a CAsyncHTTPChannel for every aTV connection
+
+parameters:
+    server_address - (IP, port)
+    handleRequest - function(path, headers, client_address) -> (code, headers, data)
+    pool - CThreadPool, for the blocking part of each request
+    timeout - idle time on a persistent connection [s]
+    max_requests - requests served on one connection
+    map - asyncore channel map, shared by all servers of one loop
+    sockopts - list of (level, option, value), set before bind
+"""
+class CAsyncHTTPServer(asyncore.dispatcher):
+    def __init__(self, server_address, handleRequest, pool, timeout, max_requests, map=None, sockopts=[]):
+        if map is None:
+            map = {}
+        self.map = map
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        for (level, option, value) in sockopts:
+            self.socket.setsockopt(level, option, value)
+        self.bind(server_address)
+        self.listen(64)
+
+        self.handleRequest = handleRequest
+        self.pool = pool
+        self.timeout = timeout
+        self.max_requests = max_requests
+        self.trigger = CTrigger(self.map)
+
+    def handle_accept(self):
+        # drain the listen queue
+        while True:
+            try:
+                pair = self.accept()
+            except socket.error as e:
+                dprint(__name__, 0, "Failed to accept connection: {0}", e)
+                break
+            if pair is None:
+                break  # EWOULDBLOCK
+            (sock, client_address) = pair
+            CAsyncHTTPChannel(self, sock, client_address)
+
+    def channels(self):
+        return [obj for obj in self.map.values() if isinstance(obj, CAsyncHTTPChannel)]
+
+    def closeIdle(self):
+        now = time.time()
+        for channel in self.channels():
+            if (not channel.busy or channel.unsent) and now-channel.last_activity > self.timeout:
+                if channel.busy:
+                    dprint(__name__, 0, "Stalled response to {0}, dropping connection", channel.client_address[0])
+                channel.close()
+
+    def handle_error(self):
+        dprint(__name__, 0, "Error in listener: {0}", sys.exc_info()[1])
+
+    def close(self):
+        for obj in self.map.values():
+            if not obj is self:
+                obj.close()
+        asyncore.dispatcher.close(self)
+
+
+
+class CAsyncHTTPChannel(asynchat.async_chat):
+    max_header = 65536  # bytes
+    ac_out_buffer_size = 65536  # send header and body in one go
+
+    def __init__(self, server, sock, client_address):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server = server
+        self.client_address = client_address
+        self.set_terminator('\r\n\r\n')
+        self.ibuffer = []
+        self.ibuffer_len = 0
+        self.requests = []  # pipelined requests, waiting to be worked on
+        self.requests_served = 0
+        self.busy = False
+        self.closing = False
+        self.last_activity = time.time()
+        self.sent = threading.Condition()  # streamed chunks - worker waits for the loop to send them
+        self.unsent = 0
+
+    def collect_incoming_data(self, data):
+        self.last_activity = time.time()
+        self.ibuffer.append(data)
+        self.ibuffer_len += len(data)
+        if self.ibuffer_len > self.max_header:
+            dprint(__name__, 0, "Request header too long from {0}", self.client_address[0])
+            self.close()
+
+    def found_terminator(self):
+        request = ''.join(self.ibuffer).lstrip('\r\n')
+        self.ibuffer = []
+        self.ibuffer_len = 0
+
+        self.requests.append(request)
+        if not self.busy:
+            self.nextRequest()
+
+    def nextRequest(self):
+        if not self.requests or not self.connected:
+            return
+
+        request = self.requests.pop(0)
+        lines = request.split('\r\n', 1)
+        words = lines[0].split()
+        if len(words)!=3 or not words[2].startswith('HTTP/'):
+            self.sendError(400, "Bad request syntax (%r)" % lines[0])
+            return
+        (command, path, version) = words
+
+        headers = mimetools.Message(StringIO(lines[1] if len(lines)>1 else ''), 0)
+
+        # persistent connection?
+        conntype = headers.get('Connection', '').lower()
+        if version>='HTTP/1.1':
+            close = conntype=='close'
+        else:
+            close = conntype!='keep-alive'
+
+        if command!='GET':
+            self.sendError(501, "Unsupported method (%r)" % command)
+            return
+
+        self.busy = True
+        if not self.server.pool.submit(self.work, path, headers, version, close):
+            dprint(__name__, 0, "Overload - worker queue full, rejecting {0}", self.client_address[0])
+            self.sendError(503, "PlexConnect busy - please retry", [('Retry-After', '1')])
+
+    def work(self, path, headers, version, close):
+        # worker thread
+        try:
+            (code, hdrs, data) = self.server.handleRequest(path, headers, self.client_address)
+            if code<400 and not isinstance(data, basestring):  # streamed
+                if version>='HTTP/1.1':
+                    self.streamResponse(code, hdrs, data, close)
+                    return
+                data = ''.join(data)  # no chunked transfer coding in HTTP/1.0
+        except:
+            dprint(__name__, 0, "Error in request {0}\n{1}", path, traceback.format_exc())
+            self.server.trigger.pull(self.close)
+            return
+        self.server.trigger.pull(lambda: self.sendResponse(code, hdrs, data, close))
+
+    def streamResponse(self, code, headers, chunks, close):
+        # worker thread - render chunk by chunk, hand every chunk to the loop as soon as it is done
+        # at most g_StreamWindow chunks wait in the channel - a slow aTV slows down rendering, not memory
+        pull = self.server.trigger.pull
+        pull(lambda: self.push(self.header(code, self.connectionHeaders(headers + [('Transfer-Encoding', 'chunked')], close))))
+        try:
+            for chunk in chunks:
+                if not self.waitSent(g_StreamWindow):
+                    return  # aTV gone or stalled, stop rendering
+                if chunk:
+                    self.sent.acquire()
+                    self.unsent += 1
+                    self.sent.release()
+                    pull(lambda chunk=chunk: self.pushChunk('%x\r\n%s\r\n' % (len(chunk), chunk)))
+        except:
+            dprint(__name__, 0, "Error while streaming response\n{0}", traceback.format_exc())
+            pull(self.close)  # response incomplete, status already sent - drop connection
+            return
+        pull(lambda: self.push('0\r\n\r\n'))
+        pull(lambda: self.done(self.closing))
+
+    def pushChunk(self, data):
+        # loop thread - aTV has 'timeout' seconds to take it, see CAsyncHTTPServer.closeIdle()
+        self.last_activity = time.time()
+        self.push(data)
+        self.push_with_producer(CSentMarker(self.chunkSent))
+
+    def chunkSent(self):
+        # loop thread
+        self.last_activity = time.time()
+        self.sent.acquire()
+        try:
+            self.unsent -= 1
+            self.sent.notify()
+        finally:
+            self.sent.release()
+
+    def waitSent(self, limit):
+        # worker thread - result: False if the aTV is gone, see close() and CAsyncHTTPServer.closeIdle()
+        self.sent.acquire()
+        try:
+            while self.unsent>=limit and self.connected:
+                self.sent.wait()  # no timeout - python 2 polls then
+        finally:
+            self.sent.release()
+        return self.connected
+
+    def sendResponse(self, code, headers, data, close):
+        # loop thread
+        if code>=400:
+            self.sendError(code, data)
+            return
+
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        if code!=304:  # Not Modified: no body
+            headers = headers + [('Content-Length', str(len(data)))]
+        headers = self.connectionHeaders(headers, close)
+        self.push(self.header(code, headers) + data)
+        self.done(self.closing)
+
+    def connectionHeaders(self, headers, close):
+        # loop thread - count response, keep connection or not
+        self.requests_served += 1
+        self.closing = close or self.requests_served>=self.server.max_requests
+        if self.closing:
+            return headers + [('Connection', 'close')]
+        else:
+            return headers + [('Keep-Alive', 'timeout=%d, max=%d' % (self.server.timeout, self.server.max_requests-self.requests_served))]
+
+    def sendError(self, code, message, headers=[]):
+        try:
+            short, explain = BaseHTTPRequestHandler.responses[code]
+        except KeyError:
+            short, explain = '???', '???'
+        data = BaseHTTPRequestHandler.error_message_format % {'code': code, 'message': message, 'explain': explain}
+        headers = headers + [('Content-Type', BaseHTTPRequestHandler.error_content_type),
+                             ('Content-Length', str(len(data))),
+                             ('Connection', 'close')]
+        self.push(self.header(code, headers) + data)
+        self.done(True)
+
+    def header(self, code, headers):
+        try:
+            short = BaseHTTPRequestHandler.responses[code][0]
+        except KeyError:
+            short = ''
+        lines = ['HTTP/1.1 %d %s' % (code, short),
+                 'Date: ' + formatdate(usegmt=True)]
+        for (keyword, value) in headers:
+            lines.append(keyword + ': ' + value)
+        return '\r\n'.join(lines) + '\r\n\r\n'
+
+    def done(self, close):
+        self.last_activity = time.time()
+        self.busy = False
+        if close:
+            self.requests = []
+            self.close_when_done()
+        else:
+            self.nextRequest()
+
+    def handle_error(self):
+        dprint(__name__, 0, "Error on connection {0}: {1}", self.client_address[0], sys.exc_info()[1])
+        self.close()
+
+    def close(self):
+        asynchat.async_chat.close(self)
+        self.sent.acquire()
+        try:
+            self.sent.notify()  # worker waiting in waitSent()
+        finally:
+            self.sent.release()
+
+
+
+"""
+serve - asyncore loop of the WebServer process, see WebServer.serve()
+
+parameters:
+    servers - list of CAsyncHTTPServer, created with a common map
+    cmdPipe - connection to PlexConnect main process
+"""
+def serve(servers, cmdPipe):
+    map = servers[0].map
+
+    if not sys.platform=='win32':
+        CCommandPipe(cmdPipe, map)  # wake up on command, select() doesn't work on pipes under Windows
+
+    while True:
+        # check commands - all of them, registry updates come in bursts
+        shutdown = False
+        while cmdPipe.poll():
+            cmd = cmdPipe.recv()
+            if cmd=='shutdown':
+                shutdown = True
+                break
+            Registry.receive(cmd)  # replica update
+        if shutdown:
+            break
+
+        asyncore.loop(timeout=1.0, map=map, count=1)
+
+        for server in servers:
+            server.closeIdle()
+
+    for server in servers:
+        server.close()
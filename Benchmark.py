@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""
+Benchmark
+
+Compare the WebServer front ends - threaded (worker pool, parked keep-alive connections) vs. async (asyncore loop).
+Both are started in this process on free ports, with the settings from Settings.cfg.
+Clients use persistent connections like the aTV does, idle keep-alive connections
+can be held open during the run to see how each front end copes with them.
+
+usage:
+python Benchmark.py [--clients 8] [--requests 200] [--idle 0] [--path /js/utils.js ...]
+"""
+
+
+import sys
+import time
+import threading
+import httplib
+import socket
+import argparse
+from multiprocessing import Pipe
+
+import Settings, ATVSettings
+import WebServer, AsyncWebServer
+import XMLConverter
+import Debug
+from Debug import *  # dprint()
+
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    ix = int(round(p/100.0 * (len(values)-1)))
+    return values[ix]
+
+
+
+def runClient(port, paths, requests, latencies, errors):
+    conn = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+    for i in range(requests):
+        path = paths[i % len(paths)]
+        start = time.time()
+        try:
+            conn.request('GET', path, headers={'User-Agent': 'AppleTV/6.0 Benchmark'})
+            response = conn.getresponse()
+            response.read()
+            if response.status>=400:
+                errors.append(response.status)
+        except (socket.error, httplib.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        latencies.append(time.time()-start)
+    conn.close()
+
+
+
+def runBenchmark(frontend, param, args):
+    if frontend=='async':
+        server = WebServer.createAsyncServer(param, 0)
+        serve = AsyncWebServer.serve
+    else:
+        server = WebServer.createServer(param, 0)
+        serve = WebServer.serve
+    port = server.socket.getsockname()[1]
+
+    master, slave = Pipe()
+    loop = threading.Thread(target=serve, args=([server], slave))
+    loop.start()
+
+    # idle keep-alive connections, like aTVs sitting in a menu - one request, then silence
+    idle = []
+    for i in range(args.idle):
+        conn = socket.create_connection(('127.0.0.1', port))
+        conn.sendall('GET ' + args.path[0] + ' HTTP/1.1\r\nUser-Agent: AppleTV/6.0 Benchmark\r\n\r\n')
+        idle.append(conn)
+    time.sleep(0.5)
+
+    latencies = []
+    errors = []
+    clients = [threading.Thread(target=runClient, args=(port, args.path, args.requests, latencies, errors)) \
+               for i in range(args.clients)]
+    start = time.time()
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    duration = time.time()-start
+
+    for conn in idle:
+        conn.close()
+    master.send('shutdown')
+    loop.join()
+    if frontend=='threaded':
+        server.socket.close()
+
+    return { 'frontend': frontend,
+             'requests': len(latencies),
+             'errors': len(errors),
+             'duration': duration,
+             'rps': len(latencies)/duration if duration else 0.0,
+             'p50': percentile(latencies, 50)*1000,
+             'p95': percentile(latencies, 95)*1000,
+             'p99': percentile(latencies, 99)*1000 }
+
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='PlexConnect WebServer front end benchmark.')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='requests per client')
+    parser.add_argument('--idle', type=int, default=0, help='idle keep-alive connections held open')
+    parser.add_argument('--frontend', choices=['threaded', 'async', 'both'], default='both')
+    parser.add_argument('--path', action='append', help='request path, repeat for several (default: /js/utils.js)')
+    args = parser.parse_args()
+    if not args.path:
+        args.path = ['/js/utils.js']
+
+    Debug.dlevels['WebServer'] = 0  # no "serving..." line per request
+
+    cfg = Settings.CSettings()
+    param = {}
+    param['CSettings'] = cfg
+    param['CATVSettings'] = ATVSettings.CATVSettings()
+    param['IP_self'] = '127.0.0.1'
+    param['baseURL'] = 'http://127.0.0.1'
+    param['HostToIntercept'] = cfg.getSetting('hosttointercept')
+
+    WebServer.setParams(param)
+    XMLConverter.setParams(param)
+    XMLConverter.setATVSettings(param['CATVSettings'])
+
+    if args.frontend=='both':
+        frontends = ['threaded', 'async']
+    else:
+        frontends = [args.frontend]
+
+    results = [runBenchmark(frontend, param, args) for frontend in frontends]
+
+    print
+    print "clients: %d, requests/client: %d, idle connections: %d, paths: %s" % \
+          (args.clients, args.requests, args.idle, ' '.join(args.path))
+    print "%-10s %8s %7s %9s %9s %9s %9s" % ('frontend', 'requests', 'errors', 'req/s', 'p50[ms]', 'p95[ms]', 'p99[ms]')
+    for res in results:
+        print "%-10s %8d %7d %9.1f %9.2f %9.2f %9.2f" % \
+              (res['frontend'], res['requests'], res['errors'], res['rps'], res['p50'], res['p95'], res['p99'])
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""
+Cache
+
+In-memory LRU cache with memory budget and optional time-to-live,
+thread safe, counts hits/misses for the stats.
+All caches register in g_Caches - for reporting.
+"""
+
+
+import time
+import threading
+from collections import OrderedDict
+
+import Stats
+from Debug import *  # dprint()
+
+
+
+g_Caches = []
+
+def getCacheStats():
+    return [cache.getStats() for cache in g_Caches]
+
+def getCacheMetrics():
+    # Stats provider - current values
+    metrics = []
+    for stats in getCacheStats():
+        labels = {'cache': stats['name']}
+        lookups = stats['hits']+stats['misses']
+        metrics.extend([('cache_entries', labels, stats['entries']),
+                        ('cache_size_bytes', labels, stats['size']),
+                        ('cache_hit_ratio', labels, float(stats['hits'])/lookups if lookups else 0.0)])
+    return metrics
+
+def getCacheCounters():
+    # Stats provider - totals since start
+    metrics = []
+    for stats in getCacheStats():
+        labels = {'cache': stats['name']}
+        metrics.extend([('cache_hits', labels, stats['hits']),
+                        ('cache_misses', labels, stats['misses']),
+                        ('cache_evictions', labels, stats['evictions'])])
+    return metrics
+
+Stats.registerProvider(getCacheMetrics)
+Stats.registerProvider(getCacheCounters, 'counter')
+
+
+
+"""
+CCache
+
+parameters:
+    name - for stats and log output
+    maxsize - memory budget [bytes], 0: unlimited
+    ttl - default time-to-live [s], 0: no expiration
+"""
+class CCache():
+    def __init__(self, name, maxsize=0, ttl=0):
+        dprint(__name__, 1, "init class CCache {0}: maxsize {1}, ttl {2}", name, maxsize, ttl)
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, size, expires) - oldest first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        g_Caches.append(self)
+
+    def get(self, key, check=None):
+        # return value or None. check(value): optional validation, entry dropped if False.
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            (value, size, expires) = entry
+            if (expires and expires<time.time()) or \
+               (check and not check(value)):
+                self.size -= size
+                self.misses += 1
+                return None
+
+            self.entries[key] = entry  # most recently used
+            self.hits += 1
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, size=0, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if self.maxsize and size>self.maxsize:
+            return  # too big to hold
+
+        self.lock.acquire()
+        try:
+            old = self.entries.pop(key, None)
+            if old:
+                self.size -= old[1]
+
+            expires = time.time()+ttl if ttl else 0
+            self.entries[key] = (value, size, expires)
+            self.size += size
+
+            # evict least recently used
+            while self.maxsize and self.size>self.maxsize:
+                (k, (v, s, e)) = self.entries.popitem(last=False)
+                self.size -= s
+                self.evictions += 1
+        finally:
+            self.lock.release()
+
+    def remove(self, key):
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.size -= entry[1]
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.size = 0
+        finally:
+            self.lock.release()
+
+    def getStats(self):
+        self.lock.acquire()
+        try:
+            return { 'name': self.name,
+                     'entries': len(self.entries),
+                     'size': self.size,
+                     'maxsize': self.maxsize,
+                     'hits': self.hits,
+                     'misses': self.misses,
+                     'evictions': self.evictions }
+        finally:
+            self.lock.release()
+
+
+
+if __name__=="__main__":
+    cache = CCache('test', maxsize=10)
+    cache.set('a', 'AAAA', 4)
+    cache.set('b', 'BBBB', 4)
+    cache.get('a')
+    cache.set('c', 'CCCC', 4)  # evicts 'b'
+    dprint('Cache', 0, "a: {0}, b: {1}, c: {2}", cache.get('a'), cache.get('b'), cache.get('c'))
+    dprint('Cache', 0, "stats: {0}", cache.getStats())
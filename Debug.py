@@ -19,6 +19,17 @@ dlevels = { "PlexConnect": 0, \
             "Localize"   : 0, \
             "ATVLogger"  : 0, \
             "PILBackgrounds" : 0, \
+            "ThreadPool" : 0, \
+            "AsyncWebServer" : 0, \
+            "Cache" : 0, \
+            "Stats" : 0, \
+            "Router" : 0, \
+            "Registry" : 0, \
+            "Trace" : 0, \
+            "FakePMS" : 0, \
+            "SingleFlight" : 0, \
+            "HTTPPool" : 0, \
+            "Discovery" : 0, \
           }
 
 
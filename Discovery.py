@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Discovery
+
+Looks for PMS in the background - local PMS (PlexGDM or manual, once for all aTVs) and each aTV's
+MyPlex servers, every discovery_interval seconds and whenever an aTV asks (Discover command).
+Each aTV's list goes to the Registry in one piece, requests always see the last complete list.
+The Discover command doesn't wait for it - unless the aTV has no list yet or signed in/out of MyPlex.
+"""
+
+
+import time
+import threading
+import traceback
+
+import PlexAPI
+import Registry
+import Stats
+from Debug import *  # dprint()
+
+
+
+"""
+CDiscovery
+
+parameters:
+    interval - [s] between refreshes of all known aTVs, 0: on demand only
+"""
+class CDiscovery():
+    def __init__(self, interval=300):
+        dprint(__name__, 1, "init class CDiscovery: interval {0}", interval)
+        self.interval = interval
+        self.CSettings = None
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)  # notified when an aTV's list is published
+        self.wakeup = threading.Event()
+        self.ATV = {}  # UDID -> MyPlex token, aTVs that asked for discovery
+        self.requested = set()  # UDIDs to refresh with the next run
+        self.discovered = {}  # UDID -> MyPlex token of the last published list
+        self.thread = None
+
+    """
+    request - refresh the PMS list of an aTV
+
+    parameters:
+        ATV_udid
+        MyPlexToken
+        timeout - [s], wait up to this long for a list the aTV can use - none yet, or MyPlex account changed
+    result:
+        True if the aTV's list is up to date with its MyPlex account
+    """
+    def request(self, ATV_udid, MyPlexToken='', timeout=0):
+        self.lock.acquire()
+        try:
+            self.ATV[ATV_udid] = MyPlexToken
+            self.requested.add(ATV_udid)
+            if self.thread is None:
+                # first use in this process - WebServer workers may be forked, threads don't survive that
+                self.thread = threading.Thread(target=self.run, name='Discovery')
+                self.thread.daemon = True
+                self.thread.start()
+            self.wakeup.set()
+
+            if ATV_udid in self.discovered:
+                uptodate = self.discovered[ATV_udid]==MyPlexToken
+            else:
+                uptodate = Registry.g_Registry.getPMSCount(ATV_udid)>0  # other worker found them
+
+            end = time.time()+timeout
+            while not uptodate and time.time()<end:
+                self.done.wait(end-time.time())
+                uptodate = self.discovered.get(ATV_udid, None)==MyPlexToken
+            return uptodate
+        finally:
+            self.lock.release()
+
+    def run(self):
+        trigger = 'request'
+        while True:
+            self.lock.acquire()
+            try:
+                if trigger=='request':
+                    ATVs = [(udid, self.ATV[udid]) for udid in self.requested]
+                else:
+                    ATVs = self.ATV.items()
+                self.requested = set()
+            finally:
+                self.lock.release()
+
+            if ATVs:
+                self.discover(ATVs, trigger)
+
+            if self.wakeup.wait(self.interval or None):
+                trigger = 'request'
+            else:
+                trigger = 'interval'
+            self.wakeup.clear()
+
+    def discover(self, ATVs, trigger):
+        Stats.count('discovery_runs', trigger=trigger)
+        start = time.time()
+        try:
+            localPMS = PlexAPI.discoverLocalPMS(self.CSettings)
+        except:
+            dprint(__name__, 0, "Error in local discovery\n{0}", traceback.format_exc())
+            localPMS = []
+
+        for (udid, MyPlexToken) in ATVs:
+            self.lock.acquire()
+            try:
+                sameAccount = self.discovered.get(udid, MyPlexToken)==MyPlexToken  # not known: list from Registry.json
+            finally:
+                self.lock.release()
+            previous = Registry.g_Registry.getPMSList(udid) if sameAccount else {}
+
+            try:
+                PlexAPI.discoverPMS(udid, self.CSettings, MyPlexToken, localPMS, previous)
+            except:
+                dprint(__name__, 0, "Error in discovery for {0}\n{1}", udid, traceback.format_exc())
+                continue
+
+            self.lock.acquire()
+            try:
+                self.discovered[udid] = MyPlexToken
+                self.done.notifyAll()
+            finally:
+                self.lock.release()
+
+        Stats.addTiming('discovery', time.time()-start, phase='run')
+        dprint(__name__, 1, "{0} aTV(s) done in {1:.1f}s", len(ATVs), time.time()-start)
+
+
+
+g_Discovery = CDiscovery()
+
+def setParams(param):
+    g_Discovery.CSettings = param['CSettings']
+    g_Discovery.interval = int(param['CSettings'].getSetting('discovery_interval'))
+
+
+
+if __name__=="__main__":
+    import Settings
+    cfg = Settings.CSettings()
+    setParams({'CSettings': cfg})
+    start = time.time()
+    g_Discovery.request('007', '', timeout=5)
+    dprint('Discovery', 0, "{0:.1f}s: {1}", time.time()-start, Registry.g_Registry.getPMSList('007'))
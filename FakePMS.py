@@ -0,0 +1,705 @@
+#!/usr/bin/env python
+
+"""
+FakePMS
+
+Stand-in for a Plex Media Server - synthetic library of configurable size, no media, no network needed.
+Serves what PlexConnect asks PMS for: sections with their filters, metadata, children, posters/arts,
+on deck/recently added, playlists, search, images (all the same small PNG). Channels are empty.
+Answers PlexGDM discovery on port 32414, so discoverPMS() finds it like a real server.
+Latency and failures can be injected to see how PlexConnect copes with a slow or flaky PMS.
+The library never changes: responses carry a constant ETag (304 for If-None-Match) and library containers
+an updatedAt - --validators picks which of them are sent, like PMS versions differ.
+
+usage:
+python FakePMS.py [--port 32400] [--movies 1000] [--shows 50 --seasons 4 --episodes 12]
+                  [--artists 50 --albums 4 --tracks 12] [--photoalbums 10 --photos 50] [--homevideos 100]
+                  [--playlists 4] [--latency 0] [--jitter 0] [--failure-rate 0.0] [--failure-mode error]
+                  [--validators all] [--no-gdm]
+for a 50k item movie library: python FakePMS.py --movies 50000
+
+Sources:
+PMS XML as seen from a real server, http://<PMS>:32400/library/...
+"""
+
+
+import sys
+import re
+import time
+import random
+import socket
+import struct
+import zlib
+import threading
+import argparse
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+from Debug import *  # dprint()
+
+
+
+g_T0 = 1400000000  # addedAt of the first item - library is the same on every start
+
+g_Words = ['Amber', 'Bright', 'Crimson', 'Distant', 'Electric', 'Fallen', 'Golden', 'Hidden', 'Iron', 'Jade', \
+           'Kings', 'Lost', 'Midnight', 'Northern', 'Open', 'Paper', 'Quiet', 'Restless', 'Silver', 'Twisted', \
+           'Under', 'Velvet', 'Wild', 'Xenon', 'Young', 'Zero']
+g_Nouns = ['Road', 'River', 'City', 'Garden', 'Machine', 'Harbor', 'Winter', 'Signal', 'Kingdom', 'Mirror', 'Frontier', 'Echo']
+g_Genres = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Family', \
+            'Fantasy', 'Horror', 'Mystery', 'Romance', 'Science Fiction', 'Thriller', 'Western']
+g_People = ['Alex Moreno', 'Bea Lindqvist', 'Chen Wei', 'Dara Okafor', 'Emil Novak', 'Fiona Walsh', 'Gustavo Reyes', \
+            'Hana Sato', 'Ivan Petrov', 'Jonas Berg', 'Kira Das', 'Leo Marchetti', 'Maya Cohen', 'Nils Olsen']
+g_Countries = ['USA', 'United Kingdom', 'France', 'Germany', 'Japan', 'Canada', 'Spain', 'Italy']
+g_Ratings = ['G', 'PG', 'PG-13', 'R', 'TV-14', 'TV-MA']
+g_Resolutions = [('1080', 1920, 1080, 8000), ('720', 1280, 720, 4000), ('sd', 720, 480, 1500)]
+
+g_Summary = "A synthetic item, generated by FakePMS. Long enough to look like a real summary, " + \
+            "so the aTV XML has about the size it has with a real library behind it. " * 2
+
+g_Library = None
+g_Options = None
+
+
+
+def title(ix):
+    return g_Words[ix % len(g_Words)] + ' ' + g_Nouns[(ix // len(g_Words)) % len(g_Nouns)] + ' ' + str(ix // (len(g_Words)*len(g_Nouns)) + 1)
+
+def pick(values, ix, count=1):
+    return [values[(ix*7 + i*3) % len(values)] for i in range(count)]
+
+
+
+"""
+CLibrary - synthetic PMS library
+
+meta[ratingKey] - dict of one item: type, title, parent, children, section, ...
+sections - list of dict: id, type, title, agent, scanner, items (ratingKeys of the top level)
+playlists - list of dict: id, title, playlistType, items
+"""
+class CLibrary():
+    def __init__(self, args):
+        self.meta = {}
+        self.sections = []
+        self.playlists = []
+        self.nextKey = 1
+        self.elems = {}  # (ratingKey, detail) -> XML - the library doesn't change, serialize once
+
+        if args.movies:
+            self.addMovies('Movies', 'com.plexapp.agents.imdb', 'Plex Movie Scanner', args.movies)
+        if args.shows:
+            self.addShows('TV Shows', args.shows, args.seasons, args.episodes)
+        if args.artists:
+            self.addMusic('Music', args.artists, args.albums, args.tracks)
+        if args.photoalbums:
+            self.addPhotos('Photos', args.photoalbums, args.photos)
+        if args.homevideos:
+            self.addMovies('Home Videos', 'com.plexapp.agents.none', 'Plex Video Files Scanner', args.homevideos)
+        self.addPlaylists(args.playlists)
+
+    def add(self, type, section, parent=None, **attrib):
+        key = self.nextKey
+        self.nextKey += 1
+        item = { 'ratingKey': key, 'type': type, 'section': section, 'parent': parent, 'children': [], \
+                 'addedAt': g_T0 + key*600 }
+        item.update(attrib)
+        self.meta[key] = item
+        if parent:
+            self.meta[parent]['children'].append(key)
+        return key
+
+    def addSection(self, type, title, agent, scanner):
+        section = { 'id': len(self.sections)+1, 'type': type, 'title': title, 'agent': agent, 'scanner': scanner, 'items': [] }
+        self.sections.append(section)
+        return section
+
+    def addVideo(self, type, section, parent, ix, **attrib):
+        (resolution, width, height, bitrate) = g_Resolutions[ix % len(g_Resolutions)]
+        return self.add(type, section['id'], parent, year=1950 + ix%70, \
+                        genre=pick(g_Genres, ix, 2), director=pick(g_People, ix), actor=pick(g_People, ix+1, 4), \
+                        country=pick(g_Countries, ix), contentRating=g_Ratings[ix % len(g_Ratings)], \
+                        rating='%.1f' % (5 + ix%50/10.0), duration=(40 + ix%80)*60000, \
+                        resolution=resolution, width=width, height=height, bitrate=bitrate, \
+                        viewCount=1 if ix%3==0 else 0, viewOffset=(ix%40)*60000 if ix%11==0 else 0, **attrib)
+
+    def addMovies(self, name, agent, scanner, count):
+        section = self.addSection('movie', name, agent, scanner)
+        for ix in range(count):
+            section['items'].append(self.addVideo('movie', section, None, ix, title=title(ix), studio=pick(g_People, ix)[0] + ' Pictures'))
+
+    def addShows(self, name, shows, seasons, episodes):
+        section = self.addSection('show', name, 'com.plexapp.agents.thetvdb', 'Plex Series Scanner')
+        for ix in range(shows):
+            show = self.add('show', section['id'], None, title=title(ix), year=1980 + ix%40, genre=pick(g_Genres, ix, 2), \
+                            contentRating=g_Ratings[ix % len(g_Ratings)], studio='Network ' + str(ix%9), \
+                            country=pick(g_Countries, ix), rating='%.1f' % (5 + ix%50/10.0))
+            section['items'].append(show)
+            for s in range(seasons):
+                season = self.add('season', section['id'], show, title='Season %d' % (s+1), index=s+1)
+                for e in range(episodes):
+                    self.addVideo('episode', section, season, ix*1000 + s*100 + e, title='Episode %d' % (e+1), index=e+1)
+
+    def addMusic(self, name, artists, albums, tracks):
+        section = self.addSection('artist', name, 'com.plexapp.agents.lastfm', 'Plex Music Scanner')
+        for ix in range(artists):
+            artist = self.add('artist', section['id'], None, title=g_People[ix % len(g_People)] + ' ' + str(ix+1), genre=pick(g_Genres, ix))
+            section['items'].append(artist)
+            for a in range(albums):
+                album = self.add('album', section['id'], artist, title=title(ix*albums + a), year=1960 + (ix+a)%60, genre=pick(g_Genres, ix))
+                for t in range(tracks):
+                    self.add('track', section['id'], album, title='Track %d' % (t+1), index=t+1, duration=(150 + (ix+t)%200)*1000)
+
+    def addPhotos(self, name, albums, photos):
+        section = self.addSection('photo', name, 'com.plexapp.agents.none', 'Plex Photo Scanner')
+        for ix in range(albums):
+            album = self.add('photoalbum', section['id'], None, title=title(ix), year=2000 + ix%20)
+            section['items'].append(album)
+            for p in range(photos):
+                self.add('photo', section['id'], album, title='IMG_%04d' % (p+1), year=2000 + ix%20)
+
+    def addPlaylists(self, count):
+        videos = [key for key in sorted(self.meta) if self.meta[key]['type'] in ('movie', 'episode')]
+        tracks = [key for key in sorted(self.meta) if self.meta[key]['type']=='track']
+        for ix in range(count):
+            (type, items) = ('video', videos) if ix%2==0 else ('audio', tracks)
+            if items:
+                self.playlists.append({ 'id': 900000000 + ix, 'title': 'Playlist ' + title(ix), 'playlistType': type, \
+                                        'items': items[ix*7 % len(items):][:25] })
+
+    def getSection(self, id):
+        for section in self.sections:
+            if section['id']==int(id):
+                return section
+        return None
+
+    def leaves(self, key):
+        # episodes of a show, tracks of an artist...
+        item = self.meta[key]
+        if not item['children']:
+            return [key]
+        return [leaf for child in item['children'] for leaf in self.leaves(child)]
+
+    def values(self, key, filter):
+        # values of an item for a section filter
+        item = self.meta[key]
+        if filter=='decade':
+            return [str(item['year']//10*10)] if 'year' in item else []
+        if filter=='firstCharacter':
+            return [item['title'][0]]
+        value = item.get({'resolution': 'resolution', 'collection': 'genre'}.get(filter, filter))
+        if value is None:
+            return []
+        if not isinstance(value, list):
+            value = [value]
+        return [str(v) for v in value]
+
+
+
+"""
+XML of one item, as PMS has it in listings (detail=False) or in /library/metadata/<id> (detail=True)
+"""
+def elem(library, key, detail=False):
+    xml = library.elems.get((key, detail))
+    if xml is None:
+        xml = etree.tostring(buildElem(library, key, detail))
+        library.elems[(key, detail)] = xml
+    return xml
+
+def buildElem(library, key, detail):
+    item = library.meta[key]
+    type = item['type']
+    path = '/library/metadata/%d' % key
+    attrib = { 'ratingKey': str(key), 'title': item['title'], 'titleSort': item['title'], \
+               'addedAt': str(item['addedAt']), 'updatedAt': str(item['addedAt']), \
+               'thumb': path + '/thumb/%d' % item['addedAt'], 'art': path + '/art/%d' % item['addedAt'] }
+    for attr in ('year', 'index', 'contentRating', 'rating', 'studio', 'duration'):
+        if attr in item:
+            attrib[attr] = str(item[attr])
+
+    parent = library.meta.get(item['parent'])
+    if parent:
+        attrib.update({ 'parentKey': '/library/metadata/%d' % parent['ratingKey'], 'parentRatingKey': str(parent['ratingKey']), \
+                        'parentTitle': parent['title'], 'parentThumb': '/library/metadata/%d/thumb/%d' % (parent['ratingKey'], parent['addedAt']) })
+        if 'index' in parent:
+            attrib['parentIndex'] = str(parent['index'])
+        grandparent = library.meta.get(parent['parent'])
+        if grandparent:
+            attrib.update({ 'grandparentKey': '/library/metadata/%d' % grandparent['ratingKey'], \
+                            'grandparentRatingKey': str(grandparent['ratingKey']), 'grandparentTitle': grandparent['title'], \
+                            'grandparentThumb': '/library/metadata/%d/thumb/%d' % (grandparent['ratingKey'], grandparent['addedAt']), \
+                            'grandparentArt': '/library/metadata/%d/art/%d' % (grandparent['ratingKey'], grandparent['addedAt']) })
+
+    if type in ('movie', 'episode'):
+        tag = 'Video'
+        attrib.update({ 'key': path, 'type': type, 'summary': g_Summary, \
+                        'originallyAvailableAt': '%d-%02d-%02d' % (item['year'], key%12+1, key%28+1) })
+        if item['viewCount']:
+            attrib['viewCount'] = str(item['viewCount'])
+        if item['viewOffset']:
+            attrib['viewOffset'] = str(item['viewOffset'])
+    elif type in ('show', 'season', 'artist', 'album', 'photoalbum'):
+        tag = 'Directory'
+        attrib.update({ 'key': path + '/children', 'type': type if type!='photoalbum' else 'photo', 'summary': g_Summary })
+        leaves = library.leaves(key)
+        if type in ('show', 'season'):
+            attrib.update({ 'leafCount': str(len(leaves)), \
+                            'viewedLeafCount': str(len([leaf for leaf in leaves if library.meta[leaf].get('viewCount')])) })
+        if type=='show':
+            attrib.update({ 'childCount': str(len(item['children'])), \
+                            'banner': path + '/banner/%d' % item['addedAt'], 'theme': path + '/theme/%d' % item['addedAt'] })
+    elif type=='track':
+        tag = 'Track'
+        attrib.update({ 'key': path, 'type': type })
+    else:  # photo
+        tag = 'Photo'
+        attrib.update({ 'key': path, 'type': type, 'originallyAvailableAt': '%d-01-01' % item['year'] })
+
+    el = etree.Element(tag, attrib)
+
+    if type in ('movie', 'episode'):
+        media = etree.SubElement(el, 'Media', { 'id': str(key), 'duration': str(item['duration']), 'bitrate': str(item['bitrate']), \
+                                                'width': str(item['width']), 'height': str(item['height']), 'aspectRatio': '1.78', \
+                                                'audioChannels': '2', 'audioCodec': 'aac', 'videoCodec': 'h264', \
+                                                'videoResolution': item['resolution'], 'container': 'mp4', \
+                                                'videoFrameRate': '24p', 'optimizedForStreaming': '1' })
+        part = etree.SubElement(media, 'Part', { 'id': str(key), 'key': '/library/parts/%d/file.mp4' % key, \
+                                                 'duration': str(item['duration']), 'file': '/media/%d.mp4' % key, \
+                                                 'size': str(item['duration']*item['bitrate']//8), 'container': 'mp4' })
+        if detail:
+            etree.SubElement(part, 'Stream', { 'id': str(key*10+1), 'streamType': '1', 'codec': 'h264', 'index': '0', \
+                                               'bitrate': str(item['bitrate']), 'height': str(item['height']), 'width': str(item['width']) })
+            etree.SubElement(part, 'Stream', { 'id': str(key*10+2), 'streamType': '2', 'codec': 'aac', 'index': '1', 'channels': '2', \
+                                               'language': 'English', 'languageCode': 'eng', 'selected': '1' })
+            etree.SubElement(part, 'Stream', { 'id': str(key*10+3), 'streamType': '3', 'codec': 'srt', 'key': '/library/streams/%d' % (key*10+3), \
+                                               'language': 'English', 'languageCode': 'eng' })
+    elif type=='track':
+        media = etree.SubElement(el, 'Media', { 'id': str(key), 'duration': str(item['duration']), 'bitrate': '320', \
+                                                'audioChannels': '2', 'audioCodec': 'mp3', 'container': 'mp3' })
+        etree.SubElement(media, 'Part', { 'id': str(key), 'key': '/library/parts/%d/file.mp3' % key, 'duration': str(item['duration']), \
+                                          'file': '/music/%d.mp3' % key, 'container': 'mp3' })
+    elif type=='photo':
+        media = etree.SubElement(el, 'Media', { 'id': str(key), 'width': '4000', 'height': '3000', 'aspectRatio': '1.33', 'container': 'jpeg' })
+        etree.SubElement(media, 'Part', { 'id': str(key), 'key': '/library/parts/%d/file.jpg' % key, 'file': '/photos/%d.jpg' % key, 'container': 'jpeg' })
+
+    if type in ('movie', 'episode', 'show') or (detail and type in ('artist', 'album')):
+        for (filter, tag) in (('genre', 'Genre'), ('director', 'Director'), ('country', 'Country'), ('actor', 'Role')):
+            for (ix, value) in enumerate(item.get(filter, [])[:None if detail else 3]):
+                sub = etree.SubElement(el, tag, { 'tag': value, 'id': str(g_People.index(value) if value in g_People else ix) })
+                if tag=='Role' and detail:
+                    sub.set('role', 'Character %d' % (ix+1))
+    return el
+
+
+
+"""
+containers - (attrib, list of item keys) for a PMS path
+"""
+def libraryAttrib(section, **attrib):
+    res = { 'identifier': 'com.plexapp.plugins.library', 'mediaTagPrefix': '/system/bundle/media/flags/', \
+            'mediaTagVersion': '1400000000', 'allowSync': '1' }
+    if section and g_Options.validators in ('all', 'updatedAt'):
+        res['updatedAt'] = str(g_T0)
+    if section:
+        res.update({ 'librarySectionID': str(section['id']), 'librarySectionTitle': section['title'], \
+                     'title1': section['title'], 'art': '/:/resources/%s-fanart.jpg' % section['type'] })
+        if section['type']=='movie':
+            res['thumb'] = '/:/resources/%s.png' % ('video' if section['agent']=='com.plexapp.agents.none' else 'movie')
+        else:
+            res['thumb'] = '/:/resources/%s.png' % section['type']
+    res.update(attrib)
+    return res
+
+g_ViewGroups = { 'movie': 'movie', 'episode': 'episode', 'show': 'show', 'season': 'season', \
+                 'artist': 'artist', 'album': 'album', 'track': 'track', 'photoalbum': 'photo', 'photo': 'photo' }
+
+def items(library, section, keys, title2, **attrib):
+    viewGroup = g_ViewGroups[library.meta[keys[0]]['type']] if keys else section['type']
+    return (libraryAttrib(section, title2=title2, viewGroup=viewGroup, **attrib), keys)
+
+g_Filters = { 'movie': [('all', 'All Movies'), ('unwatched', 'Unwatched'), ('newest', 'Recently Released'), \
+                        ('recentlyAdded', 'Recently Added'), ('recentlyViewed', 'Recently Viewed'), ('onDeck', 'On Deck'), \
+                        ('collection', 'By Collection'), ('genre', 'By Genre'), ('year', 'By Year'), ('decade', 'By Decade'), \
+                        ('director', 'By Director'), ('actor', 'By Starring Actor'), ('country', 'By Country'), \
+                        ('contentRating', 'By Content Rating'), ('resolution', 'By Resolution'), \
+                        ('firstCharacter', 'By First Letter'), ('folder', 'By Folder'), ('search?type=1', 'Search...')],
+              'show':  [('all', 'All Shows'), ('unwatched', 'Unwatched'), ('newest', 'Recently Aired'), \
+                        ('recentlyAdded', 'Recently Added'), ('recentlyViewed', 'Recently Viewed Episodes'), \
+                        ('recentlyViewedShows', 'Recently Viewed Shows'), ('onDeck', 'On Deck'), ('collection', 'By Collection'), \
+                        ('genre', 'By Genre'), ('year', 'By Year'), ('contentRating', 'By Content Rating'), \
+                        ('firstCharacter', 'By First Letter'), ('folder', 'By Folder'), ('search?type=4', 'Search Episodes...')],
+              'artist':[('all', 'All Artists'), ('albums', 'By Album'), ('genre', 'By Genre'), ('decade', 'By Decade'), \
+                        ('year', 'By Year'), ('recentlyAdded', 'Recently Added'), ('folder', 'By Folder'), ('search?type=8', 'Search Artists...')],
+              'photo': [('all', 'All Photos'), ('year', 'By Year'), ('recentlyAdded', 'Recently Added'), ('folder', 'By Folder')] }
+
+g_Lists = { 'onDeck': 'On Deck', 'recentlyAdded': 'Recently Added', 'newest': 'Recently Aired', \
+            'recentlyViewed': 'Recently Viewed Episodes', 'recentlyViewedShows': 'Recently Viewed Shows', \
+            'unwatched': 'Unwatched', 'folder': 'By Folder', 'all': 'All', 'albums': 'By Album' }
+
+def sectionList(library, section, list):
+    # items of a section, as listed by /library/sections/<id>/<list>
+    top = section['items']
+    if section['type']=='show':
+        videos = [leaf for show in top for leaf in library.leaves(show)]  # episodes
+    elif section['type']=='photo':
+        videos = [photo for album in top for photo in library.meta[album]['children']]
+    elif section['type']=='artist':
+        videos = [album for artist in top for album in library.meta[artist]['children']]
+    else:
+        videos = top
+    title2 = g_Lists.get(list, list)
+    if section['type']=='movie' and list=='newest':
+        title2 = 'Recently Released'
+
+    if list in ('all', 'folder'):
+        return items(library, section, top, title2)
+    if list=='albums':
+        return items(library, section, videos, title2)
+    if list=='onDeck':
+        return items(library, section, [key for key in videos if library.meta[key].get('viewOffset')][:50], title2, mixedParents='1')
+    if list=='recentlyAdded':
+        return items(library, section, videos[::-1][:50], title2, mixedParents='1')
+    if list=='newest':
+        return items(library, section, sorted(videos, key=lambda key: -library.meta[key].get('year', 0))[:50], title2, mixedParents='1')
+    if list=='recentlyViewed':
+        return items(library, section, [key for key in videos if library.meta[key].get('viewCount')][:50], title2, mixedParents='1')
+    if list=='recentlyViewedShows':
+        return items(library, section, top[:20], title2)
+    if list=='unwatched':
+        return items(library, section, [key for key in top if not library.meta[key].get('viewCount')], title2)
+    return None
+
+def sectionFilter(library, section, filter, value=None):
+    # /library/sections/<id>/<filter>: values - /library/sections/<id>/<filter>/<value>: items
+    if value is None:
+        values = sorted(set(v for key in section['items'] for v in library.values(key, filter)))
+        return (libraryAttrib(section, title2=dict(g_Filters[section['type']]).get(filter, filter), viewGroup='secondary', content='secondary'), \
+                [('Directory', { 'key': v.replace(' ', '%20'), 'title': v, 'fastKey': '/library/sections/%d/%s/%s' % (section['id'], filter, v) }) \
+                 for v in values])
+    value = urlparse.unquote(value)
+    return items(library, section, [key for key in section['items'] if value in library.values(key, filter)], value)
+
+def search(library, query, section=None):
+    query = query.lower()
+    keys = []
+    for key in sorted(library.meta):
+        item = library.meta[key]
+        if item['type'] in ('movie', 'show', 'episode', 'artist', 'album', 'track') and \
+           (section is None or item['section']==section['id']) and query in item['title'].lower():
+            keys.append(key)
+            if len(keys)>=100:
+                break
+    return (libraryAttrib(section, title2='Search for \'%s\'' % query), keys)
+
+def children(library, key, leaves=False):
+    item = library.meta[key]
+    section = library.getSection(item['section'])
+    keys = library.leaves(key) if leaves else item['children']
+    attrib = { 'key': str(key), 'parentTitle': item['title'], 'title2': 'All Episodes' if leaves else item['title'], \
+               'summary': g_Summary, 'thumb': '/library/metadata/%d/thumb/%d' % (key, item['addedAt']), \
+               'art': '/library/metadata/%d/art/%d' % (key, item['addedAt']) }
+    if 'index' in item:
+        attrib['parentIndex'] = str(item['index'])
+    parent = library.meta.get(item['parent'])
+    if parent:
+        attrib.update({ 'grandparentTitle': parent['title'], 'title1': parent['title'] })
+    if item['type']=='show':
+        attrib.update({ 'banner': '/library/metadata/%d/banner/%d' % (key, item['addedAt']), \
+                        'theme': '/library/metadata/%d/theme/%d' % (key, item['addedAt']) })
+    (res, keys) = items(library, section, keys, attrib.pop('title2'), **attrib)
+    if parent:
+        res['title1'] = parent['title']
+    return (res, keys)
+
+def artwork(library, key, kind):
+    # /posters, /arts: alternatives to choose from
+    item = library.meta[key]
+    return ({ 'size': '3', 'identifier': 'com.plexapp.plugins.library', 'mediaTagPrefix': '/system/bundle/media/flags/' }, \
+            [('Photo', { 'key': '/library/metadata/%d/%s/%d' % (key, 'thumb' if kind=='posters' else 'art', item['addedAt']+i), \
+                         'ratingKey': 'fakepms://%s/%d/%d' % (kind, key, i), 'selected': '1' if i==0 else '0', \
+                         'thumb': '/library/metadata/%d/%s/%d' % (key, 'thumb' if kind=='posters' else 'art', item['addedAt']+i), \
+                         'provider': 'fakepms' }) \
+             for i in range(3)])
+
+def playlists(library):
+    return ({ 'size': str(len(library.playlists)), 'title1': 'Playlists' }, \
+            [('Playlist', { 'ratingKey': str(p['id']), 'key': '/playlists/%d/items' % p['id'], 'type': 'playlist', \
+                            'title': p['title'], 'summary': '', 'smart': '0', 'playlistType': p['playlistType'], \
+                            'composite': '/playlists/%d/composite/%d' % (p['id'], g_T0), 'leafCount': str(len(p['items'])), \
+                            'duration': str(sum(library.meta[key].get('duration', 0) for key in p['items'])), \
+                            'addedAt': str(g_T0), 'updatedAt': str(g_T0) }) \
+             for p in library.playlists])
+
+def playlistItems(library, id):
+    for p in library.playlists:
+        if p['id']==int(id):
+            return ({ 'ratingKey': str(p['id']), 'title': p['title'], 'playlistType': p['playlistType'], 'smart': '0', \
+                      'composite': '/playlists/%d/composite/%d' % (p['id'], g_T0), 'leafCount': str(len(p['items'])) }, \
+                    p['items'])
+    return None
+
+
+
+"""
+getContainer - (attrib, children) for a PMS path, None: not found
+children - list of ratingKeys (library items) or (tag, attrib) (anything else)
+"""
+def getContainer(library, path, query):
+    parts = [p for p in path.split('/') if p]
+
+    if parts==[]:
+        return ({ 'friendlyName': g_Options.name, 'machineIdentifier': g_Options.uuid, 'version': g_Options.version, \
+                  'myPlex': '0', 'transcoderVideo': '1', 'transcoderAudio': '1' }, \
+                [('Directory', { 'key': 'library', 'title': 'library' })])
+    if parts==['identity']:
+        return ({ 'machineIdentifier': g_Options.uuid, 'version': g_Options.version }, [])
+    if parts==['servers']:
+        return ({}, [('Server', { 'name': g_Options.name, 'host': '127.0.0.1', 'address': '127.0.0.1', 'port': str(g_Options.port), \
+                                  'machineIdentifier': g_Options.uuid, 'version': g_Options.version })])
+
+    if parts[:2]==['library', 'sections']:
+        if len(parts)==2:
+            return ({ 'title1': 'Plex Library', 'identifier': 'com.plexapp.plugins.library' }, \
+                    [('Directory', { 'key': str(s['id']), 'type': s['type'], 'title': s['title'], 'agent': s['agent'], 'scanner': s['scanner'], \
+                                     'art': '/:/resources/%s-fanart.jpg' % s['type'], 'thumb': '/:/resources/%s.png' % s['type'], \
+                                     'composite': '/library/sections/%d/composite/%d' % (s['id'], g_T0), \
+                                     'uuid': '%s-%d' % (g_Options.uuid, s['id']), 'updatedAt': str(g_T0), 'refreshing': '0' }) \
+                     for s in library.sections])
+        section = library.getSection(parts[2]) if parts[2].isdigit() else None
+        if section is None:
+            return None
+        if len(parts)==3:
+            return (libraryAttrib(section, viewGroup='secondary', content='secondary', viewMode='65592'), \
+                    [('Directory', dict([('key', key), ('title', title)] + \
+                                        ([('secondary', '1')] if key.startswith(('genre', 'year', 'decade', 'director', 'actor', 'country', 'contentRating', 'resolution', 'firstCharacter', 'collection')) else []) + \
+                                        ([('prompt', 'Search ' + section['title']), ('search', '1')] if key.startswith('search') else []))) \
+                     for (key, title) in g_Filters[section['type']]])
+        if len(parts)==4 and parts[3]=='search':
+            return search(library, query.get('query', [''])[0], section)
+        if len(parts)==4 and parts[3] in g_Lists:
+            return sectionList(library, section, parts[3])
+        if len(parts) in (4, 5) and parts[3] in dict(g_Filters[section['type']]):
+            return sectionFilter(library, section, parts[3], parts[4] if len(parts)==5 else None)
+        return None
+
+    if parts[:2]==['library', 'metadata'] and len(parts)>=3 and parts[2].isdigit():
+        key = int(parts[2])
+        if not key in library.meta:
+            return None
+        if len(parts)==3:
+            section = library.getSection(library.meta[key]['section'])
+            return (libraryAttrib(section), [(key, True)])
+        if parts[3]=='children':
+            return children(library, key)
+        if parts[3]=='allLeaves':
+            return children(library, key, leaves=True)
+        if parts[3] in ('posters', 'arts'):
+            return artwork(library, key, parts[3])
+        return None
+
+    if parts==['library', 'onDeck'] or parts==['library', 'recentlyAdded']:
+        keys = []
+        for section in library.sections:
+            if section['type'] in ('movie', 'show'):
+                keys.extend(sectionList(library, section, parts[1])[1])
+        return (libraryAttrib(None, title1='Plex Library', title2=g_Lists[parts[1]], mixedParents='1'), keys[:50])
+
+    if parts[0]=='playlists':
+        if len(parts)==1 or parts[1:]==['all']:
+            return playlists(library)
+        if len(parts)==3 and parts[2]=='items' and parts[1].isdigit():
+            return playlistItems(library, parts[1])
+        return None
+
+    if parts==['search']:
+        return search(library, query.get('query', [''])[0])
+
+    if parts[0] in ('video', 'music', 'photos', 'channels', 'system'):
+        return ({ 'title1': parts[0].capitalize() }, [])  # no channels, no plugins
+
+    return None
+
+
+
+"""
+PNG - one small image for all thumbs, arts, transcoder requests
+"""
+def createPNG(width=16, height=16, rgb=(0x40, 0x60, 0x80)):
+    def chunk(type, data):
+        return struct.pack('>I', len(data)) + type + data + struct.pack('>I', zlib.crc32(type + data) & 0xffffffff)
+    raw = ''.join('\x00' + struct.pack('BBB', *rgb)*width for y in range(height))
+    return '\x89PNG\r\n\x1a\n' + \
+           chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+           chunk('IDAT', zlib.compress(raw)) + \
+           chunk('IEND', '')
+
+g_PNG = createPNG()
+
+g_ImagePath = re.compile(r'/(library/metadata/\d+/(thumb|art|banner)(/\d+)?|photo/:/transcode|playlists/\d+/composite/\d+|library/sections/\d+/composite/\d+|:/resources/.*)$')
+
+
+
+class CFakePMSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # persistent connections, like a real PMS
+    server_version = 'FakePMS'
+    wbufsize = -1  # headers and body in one go - no Nagle/delayed ACK stalls on kept-alive connections
+
+    def do_GET(self):
+        (path, sep, querystring) = self.path.partition('?')
+        query = urlparse.parse_qs(querystring)
+
+        # injected latency, failures
+        delay = g_Options.latency + random.uniform(0, g_Options.jitter)
+        if delay:
+            time.sleep(delay/1000.0)
+        if random.random() < g_Options.failure_rate:
+            if g_Options.failure_mode=='drop':
+                self.close_connection = 1
+                return  # no response at all
+            if g_Options.failure_mode=='hang':
+                time.sleep(3600)
+            self.sendResponse(500, 'text/plain', 'FakePMS: injected failure')
+            return
+
+        if g_ImagePath.match(path):
+            self.sendResponse(200, 'image/png', g_PNG)
+            return
+        if path.startswith('/:/'):
+            self.sendResponse(200, 'text/plain', '')  # scrobble, timeline, progress...
+            return
+
+        container = getContainer(g_Library, path.rstrip('/') if path!='/' else path, query)
+        if container is None:
+            self.sendResponse(404, 'text/plain', 'FakePMS: not found: ' + path)
+            return
+
+        headers = {}
+        if g_Options.validators in ('all', 'etag'):
+            headers['ETag'] = '"%s-%d"' % (g_Options.uuid, g_T0)
+            if self.headers.get('If-None-Match')==headers['ETag']:
+                self.sendResponse(304, 'text/xml;charset=utf-8', '', headers)
+                return
+
+        start = query.get('X-Plex-Container-Start', [self.headers.get('X-Plex-Container-Start')])[0]
+        size = query.get('X-Plex-Container-Size', [self.headers.get('X-Plex-Container-Size')])[0]
+        self.sendResponse(200, 'text/xml;charset=utf-8', serialize(g_Library, container, start, size), headers)
+
+    def sendResponse(self, code, contenttype, data, headers={}):
+        self.send_response(code)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(data)))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        dprint('FakePMS', 1, "{0} {1}", self.client_address[0], format % args)
+
+def serialize(library, container, start=None, size=None):
+    (attrib, children) = container
+    total = len(children)
+    attrib = dict(attrib)
+    if start is not None or size is not None:
+        start = int(start or 0)
+        size = int(size) if size is not None else total
+        children = children[start:start+size]
+        attrib.update({ 'offset': str(start), 'totalSize': str(total) })
+    attrib['size'] = str(len(children))
+
+    xml = []
+    for child in children:
+        if isinstance(child, tuple) and isinstance(child[0], basestring):
+            xml.append(etree.tostring(etree.Element(child[0], child[1])))
+        elif isinstance(child, tuple):
+            xml.append(elem(library, child[0], child[1]))  # (key, detail)
+        else:
+            xml.append(elem(library, child))
+    head = etree.tostring(etree.Element('MediaContainer', attrib))
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + head[:-2].rstrip() + '>' + ''.join(xml) + '</MediaContainer>'
+
+
+
+class CFakePMSServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+
+"""
+PlexGDM responder - answer the M-SEARCH broadcast PlexAPI.PlexGDM() sends
+"""
+def runGDM(port):
+    GDM = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    GDM.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        GDM.bind(('', 32414))
+    except socket.error, e:
+        dprint('FakePMS', 0, "GDM: port 32414 not available ({0}) - discovery off", e)
+        return
+    dprint('FakePMS', 0, "GDM: answering discovery on port 32414")
+
+    response = 'HTTP/1.0 200 OK\r\n' + \
+               'Content-Type: plex/media-server\r\n' + \
+               'Resource-Identifier: ' + g_Options.uuid + '\r\n' + \
+               'Name: ' + g_Options.name + '\r\n' + \
+               'Port: ' + str(port) + '\r\n' + \
+               'Updated-At: ' + str(g_T0) + '\r\n' + \
+               'Version: ' + g_Options.version + '\r\n'
+    while True:
+        data, client = GDM.recvfrom(1024)
+        if data.startswith('M-SEARCH'):
+            dprint('FakePMS', 1, "GDM: discovery from {0}", client[0])
+            GDM.sendto(response, client)
+
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Synthetic Plex Media Server for PlexConnect load tests.')
+    parser.add_argument('--port', type=int, default=32400)
+    parser.add_argument('--name', default='FakePMS')
+    parser.add_argument('--uuid', default='fakepms0000000000000000000000000000000000')
+    parser.add_argument('--version', default='0.9.12.0')
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=50)
+    parser.add_argument('--seasons', type=int, default=4, help='per show')
+    parser.add_argument('--episodes', type=int, default=12, help='per season')
+    parser.add_argument('--artists', type=int, default=50)
+    parser.add_argument('--albums', type=int, default=4, help='per artist')
+    parser.add_argument('--tracks', type=int, default=12, help='per album')
+    parser.add_argument('--photoalbums', type=int, default=10)
+    parser.add_argument('--photos', type=int, default=50, help='per photo album')
+    parser.add_argument('--homevideos', type=int, default=100)
+    parser.add_argument('--playlists', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0, help='[ms] added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='[ms] random extra latency, 0..jitter')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests failing, 0.0-1.0')
+    parser.add_argument('--failure-mode', choices=['error', 'drop', 'hang'], default='error', \
+                        help='error: 500, drop: close without response, hang: never answer')
+    parser.add_argument('--validators', choices=['all', 'etag', 'updatedAt', 'none'], default='all', \
+                        help='etag: ETag header/304, updatedAt: on library containers')
+    parser.add_argument('--no-gdm', action='store_true', help='don\'t answer PlexGDM discovery')
+    g_Options = parser.parse_args()
+
+    start = time.time()
+    g_Library = CLibrary(g_Options)
+    dprint('FakePMS', 0, "Library: {0} items in {1} sections, {2} playlists - generated in {3:.1f}s", \
+           len(g_Library.meta), len(g_Library.sections), len(g_Library.playlists), time.time()-start)
+
+    if not g_Options.no_gdm:
+        gdm = threading.Thread(target=runGDM, args=(g_Options.port,))
+        gdm.daemon = True
+        gdm.start()
+
+    server = CFakePMSServer(('', g_Options.port), CFakePMSHandler)
+    dprint('FakePMS', 0, "Serving {0} on port {1}", g_Options.name, g_Options.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
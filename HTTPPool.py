@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+"""
+HTTPPool
+
+Keep-alive HTTP(S) connections to PMS and plex.tv, reused across requests and handler threads.
+urlopen() is a stand-in for urllib2.urlopen(): same Request in, response with read() out,
+same errors (urllib2.HTTPError for status>=400, urllib2.URLError for network trouble) -
+callers keep their error handling.
+A connection is used by one thread at a time: taken from the pool, put back when the response is read.
+"""
+
+
+import time
+import socket
+import threading
+import httplib
+import urllib2
+import urlparse
+import base64
+from StringIO import StringIO
+
+import Stats
+from Debug import *  # dprint()
+
+
+
+g_Redirects = (301, 302, 303, 307)
+g_MaxRedirects = 5
+
+g_Retry = ('GET', 'HEAD')  # sent again if an idle connection turns out closed - others might have reached the server
+
+
+
+"""
+CResponse - complete response, read from the connection
+
+code, msg - HTTP status
+headers - httplib.HTTPMessage, like urllib2's response.headers
+"""
+class CResponse():
+    def __init__(self, url, code, msg, headers, data):
+        self.url = url
+        self.code = code
+        self.msg = msg
+        self.headers = headers
+        self.data = data
+
+    def read(self):
+        return self.data
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def info(self):
+        return self.headers
+
+def getEmptyHeaders():
+    # for responses not read from a connection (trace replay)
+    return httplib.HTTPMessage(StringIO(''))
+
+
+
+"""
+CConnectionPool
+
+parameters:
+    maxsize - idle connections kept per host, 0: no keep-alive
+    idle - [s], idle connections older than this are closed
+"""
+class CConnectionPool():
+    def __init__(self, maxsize=4, idle=15):
+        dprint(__name__, 1, "init class CConnectionPool: maxsize {0}, idle {1}", maxsize, idle)
+        self.maxsize = maxsize
+        self.idle = idle
+        self.lock = threading.Lock()
+        self.connections = {}  # (scheme, host, port) -> list of (connection, last used) - most recent last
+
+    def get(self, key, timeout, reuse=True):
+        # result: (connection, reused). reuse=False: new connection
+        conn = None
+        self.lock.acquire()
+        try:
+            self.evict()
+            if reuse and self.connections.get(key):
+                (conn, lastused) = self.connections[key].pop()
+        finally:
+            self.lock.release()
+
+        if conn:
+            conn.timeout = timeout
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+            Stats.count('http_connections_reused', host=key[1])
+            return (conn, True)
+
+        (scheme, host, port) = key
+        if scheme=='https':
+            conn = httplib.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        Stats.count('http_connections_opened', host=host)
+        return (conn, False)
+
+    def put(self, key, conn):
+        # back for the next request - or closed, if enough are waiting
+        self.lock.acquire()
+        try:
+            idle = self.connections.setdefault(key, [])
+            if len(idle)<self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def evict(self):
+        # close idle connections - PMS would do it anyways. caller holds the lock.
+        now = time.time()
+        for key in self.connections.keys():
+            idle = self.connections[key]
+            while idle and idle[0][1]+self.idle<now:
+                (conn, lastused) = idle.pop(0)
+                conn.close()
+            if not idle:
+                del self.connections[key]
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            for idle in self.connections.values():
+                for (conn, lastused) in idle:
+                    conn.close()
+            self.connections = {}
+        finally:
+            self.lock.release()
+
+
+
+g_Pool = CConnectionPool()
+
+def setParams(param):
+    g_Pool.maxsize = int(param['CSettings'].getSetting('pms_connections'))
+    g_Pool.idle = int(param['CSettings'].getSetting('pms_connection_idle'))
+
+
+
+"""
+urlopen - send request over a pooled connection, read the complete response
+
+parameters:
+    request - urllib2.Request or URL
+    timeout - [s]
+result:
+    CResponse
+    raises urllib2.HTTPError (status>=400), urllib2.URLError (no connection, timeout, bad response)
+"""
+def urlopen(request, timeout=20):
+    if isinstance(request, basestring):
+        request = urllib2.Request(request)
+
+    url = request.get_full_url()
+    method = request.get_method()
+    body = request.get_data()
+    headers = dict(request.header_items())
+
+    for i in range(g_MaxRedirects+1):
+        response = sendRequest(url, method, body, headers, timeout)
+        if not response.code in g_Redirects or not response.headers.getheader('location'):
+            break
+        url = urlparse.urljoin(url, response.headers.getheader('location'))
+        if not (response.code==307 and method=='GET'):
+            method = 'GET'  # like urllib2: redirected POST turns into GET, without data
+            body = None
+        dprint(__name__, 1, "redirect {0}: {1}", response.code, url)
+
+    if response.code>=400:
+        raise urllib2.HTTPError(url, response.code, response.msg, response.headers, StringIO(response.data))
+    return response
+
+def sendRequest(url, method, body, headers, timeout):
+    parts = urlparse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    if not scheme in ('http', 'https'):
+        raise urllib2.URLError("unknown url type: " + scheme)
+    port = parts.port or (443 if scheme=='https' else 80)
+    key = (scheme, parts.hostname, port)
+    path = parts.path or '/'
+    if parts.query:
+        path = path + '?' + parts.query
+
+    headers = dict(headers)
+    if parts.username is not None and not 'Authorization' in headers:
+        # user:password@host - basic authentication, sent right away
+        headers['Authorization'] = 'Basic ' + base64.b64encode(urllib2.unquote(parts.username) + ':' + urllib2.unquote(parts.password or ''))
+
+    # POST, PUT...: new connection - can't be stale, no need to send it twice
+    retry = method in g_Retry
+    while True:
+        (conn, reused) = g_Pool.get(key, timeout, retry)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (socket.error, httplib.HTTPException), e:
+            conn.close()
+            if retry and reused and isinstance(e, (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error)) and \
+               not isinstance(e, socket.timeout):
+                # closed by server while idle - once more on a new connection
+                dprint(__name__, 1, "stale connection to {0}:{1} - {2}", key[1], key[2], repr(e))
+                continue
+            raise urllib2.URLError(e)
+
+        if response.will_close or g_Pool.maxsize==0:
+            conn.close()
+        else:
+            g_Pool.put(key, conn)
+        return CResponse(url, response.status, response.reason, response.msg, data)
+
+
+
+if __name__=="__main__":
+    import sys
+    url = sys.argv[1] if len(sys.argv)>1 else 'http://127.0.0.1:32400/identity'
+    for i in range(3):
+        start = time.time()
+        try:
+            response = urlopen(url)
+            dprint('HTTPPool', 0, "{0} {1} bytes in {2:.1f}ms", response.code, len(response.read()), (time.time()-start)*1000)
+        except urllib2.URLError, e:
+            dprint('HTTPPool', 0, "error: {0}", e)
+    dprint('HTTPPool', 0, "stats: {0}", Stats.getStats())
@@ -10,6 +10,7 @@ import posixpath
 
 import os.path
 from Debug import * 
+import HTTPPool
 
 try:
     from PIL import Image
@@ -47,7 +48,7 @@ def generate(PMS_uuid, url, authtoken, resolution):
         if authtoken:
             xargs['X-Plex-Token'] = authtoken
         request = urllib2.Request(url, None, xargs)
-        response = urllib2.urlopen(request).read()
+        response = HTTPPool.urlopen(request).read()
         background = Image.open(io.BytesIO(response))
     except urllib2.URLError as e:
         dprint(__name__, 1, 'URLError: {0} // url: {1}', e.reason, url)
@@ -11,7 +11,7 @@ https://github.com/hippojay/plugin.video.plexbmc
 
 Plex Media Server communication:
 source (somewhat): https://github.com/hippojay/plugin.video.plexbmc
-later converted from httplib to urllib2
+later converted from httplib to urllib2, keep-alive connections from HTTPPool
 
 
 Transcoder support:
@@ -33,8 +33,12 @@ import sys
 import struct
 import time
 import urllib2, socket
+import base64
+import copy
+from cStringIO import StringIO
 from threading import Thread
 import Queue
+import threading
 
 try:
     import xml.etree.cElementTree as etree
@@ -44,16 +48,24 @@ except ImportError:
 from urllib import urlencode, quote_plus
 
 from Version import __VERSION__
+import Stats
+import Registry
+import Trace
+import SingleFlight
+import HTTPPool
+import Cache
+import Router
+import ThreadPool
 from Debug import *  # dprint(), prettyXML()
 
 
 
 """
 storage for PMS addresses and additional information - now per aTV! (replaces global PMS_list)
+kept in Registry.g_Registry, shared by all WebServer workers
 syntax: PMS[<ATV_UDID>][PMS_UUID][<data>]
     data: name, ip, ...type (local, myplex)
 """
-g_PMS = {}
 
 
 """
@@ -65,65 +77,36 @@ parameters:
     name, scheme, ip, port, type, owned, token
 """
 def declarePMS(ATV_udid, uuid, name, scheme, ip, port):
-    # store PMS information in g_PMS database
-    global g_PMS
-    if not ATV_udid in g_PMS:
-        g_PMS[ATV_udid] = {}
-
-    address = ip + ':' + port
-    baseURL = scheme+'://'+ip+':'+port
-    g_PMS[ATV_udid][uuid] = { 'name': name,
-                              'scheme':scheme, 'ip': ip , 'port': port,
-                              'address': address,
-                              'baseURL': baseURL,
-                              'local': '1',
-                              'owned': '1',
-                              'accesstoken': ''
-                            }
+    # store PMS information in registry
+    Registry.g_Registry.declarePMS(ATV_udid, uuid, name, scheme, ip, port)
 
 def updatePMSProperty(ATV_udid, uuid, tag, value):
     # set property element of PMS by UUID
-    if not ATV_udid in g_PMS:
-        return ''  # no server known for this aTV
-    if not uuid in g_PMS[ATV_udid]:
-        return ''  # requested PMS not available
-
-    g_PMS[ATV_udid][uuid][tag] = value
+    Registry.g_Registry.updatePMSProperty(ATV_udid, uuid, tag, value)
 
 def getPMSProperty(ATV_udid, uuid, tag):
     # get name of PMS by UUID
-    if not ATV_udid in g_PMS:
-        return ''  # no server known for this aTV
-    if not uuid in g_PMS[ATV_udid]:
-        return ''  # requested PMS not available
+    return Registry.g_Registry.getPMSProperty(ATV_udid, uuid, tag)
 
-    return g_PMS[ATV_udid][uuid].get(tag, '')
+def getPMSProperties(ATV_udid, uuid):
+    # get all properties of PMS by UUID - copy, {} if not known
+    return Registry.g_Registry.getPMSProperties(ATV_udid, uuid)
 
 def getPMSFromAddress(ATV_udid, address):
     # find PMS by IP, return UUID
-    if not ATV_udid in g_PMS:
-        return ''  # no server known for this aTV
-
-    for uuid in g_PMS[ATV_udid]:
-        if address==g_PMS[ATV_udid][uuid].get('ip', None):
-            return uuid
-    return ''  # IP not found
+    return Registry.g_Registry.getPMSFromAddress(ATV_udid, address)
 
 def getPMSAddress(ATV_udid, uuid):
     # get address of PMS by UUID
-    if not ATV_udid in g_PMS:
-        return ''  # no server known for this aTV
-    if not uuid in g_PMS[ATV_udid]:
+    PMS = getPMSProperties(ATV_udid, uuid)
+    if not PMS:
         return ''  # requested PMS not available
 
-    return g_PMS[ATV_udid][uuid]['ip'] + ':' + g_PMS[ATV_udid][uuid]['port']
+    return PMS['ip'] + ':' + PMS['port']
 
 def getPMSCount(ATV_udid):
     # get count of discovered PMS by UUID
-    if not ATV_udid in g_PMS:
-        return 0  # no server known for this aTV
-
-    return len(g_PMS[ATV_udid])
+    return Registry.g_Registry.getPMSCount(ATV_udid)
 
 
 
@@ -213,25 +196,17 @@ def PlexGDM():
 
 
 """
-discoverPMS
+discoverLocalPMS - PMS in the local network, the same for all aTVs
 
 parameters:
-    ATV_udid
     CSettings - for manual PMS configuration. this one looks strange.
-    MyPlexToken
 result:
-    g_PMS database for ATV_udid
+    list of (uuid, name, scheme, ip, port)
 """
-def discoverPMS(ATV_udid, CSettings, MyPlexToken=''):
-    global g_PMS
-    g_PMS[ATV_udid] = {}
+def discoverLocalPMS(CSettings):
+    localPMS = []
+    start = time.time()
 
-    #debug
-    #declarePMS(ATV_udid, '2ndServer', '2ndServer', 'http', '192.168.178.22', '32400', 'local', '1', 'token')
-    #declarePMS(ATV_udid, 'remoteServer', 'remoteServer', 'http', '127.0.0.1', '1234', 'myplex', '1', 'token')
-    #debug
-
-    # local PMS
     if CSettings.getSetting('enable_plexgdm')=='False':
         # defined in setting.cfg
         ip = CSettings.getSetting('ip_pms')
@@ -245,24 +220,61 @@ def discoverPMS(ATV_udid, CSettings, MyPlexToken=''):
             uuid = Server.get('machineIdentifier')
             name = Server.get('name')
 
-            declarePMS(ATV_udid, uuid, name, 'http', ip, port)  # dflt: token='', local, owned
+            localPMS.append((uuid, name, 'http', ip, port))
 
     else:
         # PlexGDM
         PMS_list = PlexGDM()
         for uuid in PMS_list:
             PMS = PMS_list[uuid]
-            declarePMS(ATV_udid, PMS['uuid'], PMS['serverName'], 'http', PMS['ip'], PMS['port'])  # dflt: token='', local, owned
+            localPMS.append((PMS['uuid'], PMS['serverName'], 'http', PMS['ip'], PMS['port']))
+
+    Stats.addTiming('discovery', time.time()-start, phase='local')
+    return localPMS
+
+
+
+"""
+discoverPMS
+
+parameters:
+    ATV_udid
+    CSettings - for manual PMS configuration. this one looks strange.
+    MyPlexToken
+    localPMS - result of discoverLocalPMS(), None: look for local PMS now
+    previous - PMS list found before for this MyPlex account: servers in there are kept
+               if plex.tv or the server itself doesn't answer this time
+result:
+    registry entries for ATV_udid
+"""
+def discoverPMS(ATV_udid, CSettings, MyPlexToken='', localPMS=None, previous={}):
+    # collect in own registry, publish when complete - no empty list while discovering
+    registry = Registry.CRegistry()
+
+    #debug
+    #declarePMS(ATV_udid, '2ndServer', '2ndServer', 'http', '192.168.178.22', '32400', 'local', '1', 'token')
+    #declarePMS(ATV_udid, 'remoteServer', 'remoteServer', 'http', '127.0.0.1', '1234', 'myplex', '1', 'token')
+    #debug
+
+    # local PMS
+    if localPMS is None:
+        localPMS = discoverLocalPMS(CSettings)
+    for (uuid, name, scheme, ip, port) in localPMS:
+        registry.declarePMS(ATV_udid, uuid, name, scheme, ip, port)  # dflt: token='', local, owned
+    start = time.time()
 
     # MyPlex servers
     if not MyPlexToken=='':
         XML = getXMLFromPMS('https://plex.tv', '/pms/servers', None, MyPlexToken)
 
         if XML==False:
-            pass  # no data from MyPlex
+            # no data from MyPlex - keep what it said last time
+            known = registry.getPMSList(ATV_udid)
+            registry.update([('PMS', ATV_udid, uuid, previous[uuid]) for uuid in previous if not uuid in known])
         else:
             queue = Queue.Queue()
             threads = []
+            PMS_known = registry.getPMSList(ATV_udid)
 
             for Dir in XML.getiterator('Server'):
                 uuid = Dir.get('machineIdentifier')
@@ -275,10 +287,10 @@ def discoverPMS(ATV_udid, CSettings, MyPlexToken=''):
                 token = Dir.get('accessToken', '')
                 owned = Dir.get('owned', '0')
 
-                if uuid in g_PMS.get(ATV_udid, {}):
+                if uuid in PMS_known:
                     # server known: local, manually defined or PlexGDM
-                    updatePMSProperty(ATV_udid, uuid, 'accesstoken', token)
-                    updatePMSProperty(ATV_udid, uuid, 'owned', owned)
+                    registry.updatePMSProperty(ATV_udid, uuid, 'accesstoken', token)
+                    registry.updatePMSProperty(ATV_udid, uuid, 'owned', owned)
                 else:
                     # remote servers
                     # check MyPlex data age - skip if >2 days
@@ -304,6 +316,9 @@ def discoverPMS(ATV_udid, CSettings, MyPlexToken=''):
                     (Dir, PMS) = queue.get()
 
                     if PMS==False:
+                        uuid = Dir.get('machineIdentifier')
+                        if uuid in previous:
+                            registry.update([('PMS', ATV_udid, uuid, previous[uuid])])  # reachable before
                         continue
 
                     uuid = Dir.get('machineIdentifier')
@@ -316,19 +331,68 @@ def discoverPMS(ATV_udid, CSettings, MyPlexToken=''):
                     token = Dir.get('accessToken', '')
                     owned = Dir.get('owned', '0')
 
-                    declarePMS(ATV_udid, uuid, name, scheme, ip, port)  # dflt: token='', local, owned - updated later
+                    registry.declarePMS(ATV_udid, uuid, name, scheme, ip, port)  # dflt: token='', local, owned - updated later
                     # JRH CHANGE
                     # updatePMSProperty(ATV_udid, uuid, 'local', '0')  # todo - check IP?
-                    updatePMSProperty(ATV_udid, uuid, 'local', '1')
-                    updatePMSProperty(ATV_udid, uuid, 'accesstoken', token)
+                    registry.updatePMSProperty(ATV_udid, uuid, 'local', '1')
+                    registry.updatePMSProperty(ATV_udid, uuid, 'accesstoken', token)
                     # updatePMSProperty(ATV_udid, uuid, 'owned', owned)
                     # JRH CHANGE
-                    updatePMSProperty(ATV_udid, uuid, 'owned', '1')
+                    registry.updatePMSProperty(ATV_udid, uuid, 'owned', '1')
+
+    PMS_list = registry.getPMSList(ATV_udid)
+    Registry.g_Registry.setPMSList(ATV_udid, PMS_list)
+    if not MyPlexToken=='':
+        Stats.addTiming('discovery', time.time()-start, phase='myplex')
 
     # debug print all servers
-    dprint(__name__, 0, "Servers (local+MyPlex): {0}", len(g_PMS[ATV_udid]))
-    for uuid in g_PMS[ATV_udid]:
-        dprint(__name__, 1, str(g_PMS[ATV_udid][uuid]))
+    dprint(__name__, 0, "Servers (local+MyPlex): {0}", len(PMS_list))
+    for uuid in PMS_list:
+        dprint(__name__, 1, str(PMS_list[uuid]))
+
+
+
+"""
+CDeadline - time budget of one aTV request, shared by all PMS requests made for it
+stored in options['aTVDeadline'] by WebServer.handleRequest()
+
+parameters:
+    budget - [s]
+    start - time.time() the request came in, dflt: now
+"""
+class CDeadline():
+    def __init__(self, budget, start=None):
+        if start is None:
+            start = time.time()
+        self.end = start + budget
+
+    def remaining(self):
+        return max(0.0, self.end-time.time())
+
+    def expired(self):
+        return time.time()>=self.end
+
+class DeadlineExceeded(Exception):
+    pass
+
+"""
+getTimeout - timeout for one PMS request: limit, or what is left of the aTV request's deadline
+
+parameters:
+    options - PlexConnect-options, may hold 'aTVDeadline'. None: no deadline
+    limit - [s], upper bound for a single request
+result:
+    timeout [s]
+    raises DeadlineExceeded if nothing is left
+"""
+def getTimeout(options, limit=20):
+    deadline = options.get('aTVDeadline') if options else None
+    if deadline is None:
+        return limit
+    if deadline.expired():
+        Stats.count('deadline_exceeded')
+        raise DeadlineExceeded()
+    return min(limit, deadline.remaining())
 
 
 
@@ -341,7 +405,8 @@ parameters:
     options - dict() of PlexConnect-options as received from aTV, None for no std. X-Plex-Args
     authtoken - authentication answer from MyPlex Sign In
 result:
-    returned XML or 'False' in case of error
+    returned XML or 'False' in case of error - shared with other requests (cache), don't modify
+    raises DeadlineExceeded if the aTV request is out of time - no point in asking PMS (again)
 """
 def getXMLFromPMS(baseURL, path, options={}, authtoken=''):
     xargs = {}
@@ -353,35 +418,246 @@ def getXMLFromPMS(baseURL, path, options={}, authtoken=''):
     dprint(__name__, 1, "URL: {0}{1}", baseURL, path)
     dprint(__name__, 1, "xargs: {0}", xargs)
 
+    key = (baseURL, path, authtoken)
+    ttl = getCacheTTL(path)
+    cached = None
+    if ttl:
+        cached = g_PMSCache.get(key)
+        if cached is not None and cached.isFresh():
+            return cached.XML
+
+    # identical requests in flight (navbar preloads, retries, several aTVs): one HTTP call
+    timeout = getTimeout(options)
+    XML = g_PMSFlight.do(key, lambda: fetchXMLFromPMS(baseURL, path, xargs, getTimeout(options), key, ttl, cached), timeout)
+    if XML is None:
+        getTimeout(options)  # timed out for good?
+        return False
+
+    dprint(__name__, 1, "====== received PMS-XML ======")
+    dprint(__name__, 1, XML.getroot())
+    dprint(__name__, 1, "====== PMS-XML finished ======")
+
+    return XML
+
+def fetchXMLFromPMS(baseURL, path, xargs, timeout, key, ttl, cached=None):
+    # cached: stale CPMSResponse - ask PMS whether it changed
+    if cached:
+        xargs = dict(xargs)
+        xargs.update(cached.getConditionalHeaders())
+
+    response = fetchFromPMS(baseURL, path, xargs, timeout)
+    if response is None:
+        return None
+
+    if cached and response.code==304:
+        Stats.count('pms_revalidations', pms=baseURL, result='not_modified')
+        g_PMSCache.set(key, cached.renew(ttl), cached.size)
+        return cached.XML
+
+    data = response.read()
+    stamp = getContainerStamp(data)
+    if cached and stamp and stamp==cached.stamp:
+        # downloaded, but no need to parse it again
+        Stats.count('pms_revalidations', pms=baseURL, result='unchanged')
+        g_PMSCache.set(key, cached.renew(ttl), cached.size)
+        return cached.XML
+
+    # parse into etree
+    start = time.time()
+    XML = etree.ElementTree(etree.fromstring(data))
+    Stats.addTiming('pms_parse', time.time()-start, pms=baseURL)
+    if cached and cached.canRevalidate():
+        Stats.count('pms_revalidations', pms=baseURL, result='changed')
+
+    if ttl:
+        entry = CPMSResponse(XML, len(data), ttl, response.headers.getheader('ETag'), response.headers.getheader('Last-Modified'), stamp)
+        # stale entries are kept - if they can be revalidated
+        g_PMSCache.set(key, entry, entry.size, 0 if entry.canRevalidate() else ttl)
+    return XML
+
+
+
+"""
+fetchFromPMS - HTTP request to PMS, see getXMLFromPMS()
+
+parameters:
+    baseURL, path
+    xargs - X-Plex request headers
+    timeout - [s]
+result:
+    HTTPPool.CResponse - status 200, or 304 for a conditional request; None in case of error
+"""
+def fetchFromPMS(baseURL, path, xargs, timeout):
+    Stats.count('pms_requests', pms=baseURL)
+    start = time.time()
     request = urllib2.Request(baseURL+path , None, xargs)
     try:
-        response = urllib2.urlopen(request, timeout=20)
+        if Trace.isReplaying():
+            data = Trace.replayPMS(baseURL+path)  # TraceReplay.py - recorded response instead of PMS
+            response = HTTPPool.CResponse(baseURL+path, 200, 'OK', HTTPPool.getEmptyHeaders(), data)
+        else:
+            response = HTTPPool.urlopen(request, timeout=timeout)
+            if response.code==200:
+                Trace.recordPMS(baseURL+path, response.read())
     except urllib2.URLError as e:
         dprint(__name__, 0, 'No Response from Plex Media Server')
         if hasattr(e, 'reason'):
             dprint(__name__, 0, "We failed to reach a server. Reason: {0}", e.reason)
         elif hasattr(e, 'code'):
             dprint(__name__, 0, "The server couldn't fulfill the request. Error code: {0}", e.code)
-        return False
+        Stats.count('pms_errors', pms=baseURL)
+        return None
     except IOError:
         dprint(__name__, 0, 'Error loading response XML from Plex Media Server')
-        return False
+        Stats.count('pms_errors', pms=baseURL)
+        return None
+    Stats.addTiming('pms_request', time.time()-start, pms=baseURL)
+    return response
 
-    # parse into etree
-    XML = etree.parse(response)
+g_PMSFlight = SingleFlight.CSingleFlight('pms')
 
-    dprint(__name__, 1, "====== received PMS-XML ======")
-    dprint(__name__, 1, XML.getroot())
-    dprint(__name__, 1, "====== PMS-XML finished ======")
 
-    #XMLTree = etree.ElementTree(etree.fromstring(response))
 
-    return XML
+"""
+PMS XML cache - parsed responses by (PMS, path, token), shared read-only by all requests
+memory budget: pms_cache_size [MB], counted in response bytes. 0: off
+time-to-live by path class, first match wins, no match: not cached. pms_cache_ttl overrides by name,
+eg. "ondeck:0, artwork:86400"
+once the time-to-live is over, a response is revalidated: conditional request (ETag, Last-Modified),
+or same MediaContainer version stamp (updatedAt...) in the new response - the parsed XML is kept.
+"""
+g_PMSCache = Cache.CCache('pms', 16*1024*1024)
+
+"""
+CPMSResponse - cached PMS response: parsed XML plus what is needed to revalidate it
+
+parameters:
+    XML - etree, read-only
+    size - response bytes
+    ttl - [s], fresh for
+    etag, lastmodified - response headers, None if not sent
+    stamp - see getContainerStamp()
+"""
+class CPMSResponse():
+    def __init__(self, XML, size, ttl, etag=None, lastmodified=None, stamp=None):
+        self.XML = XML
+        self.size = size
+        self.expires = time.time()+ttl
+        self.etag = etag
+        self.lastmodified = lastmodified
+        self.stamp = stamp
+
+    def isFresh(self):
+        return time.time()<self.expires
+
+    def canRevalidate(self):
+        return bool(self.etag or self.lastmodified or self.stamp)
+
+    def getConditionalHeaders(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.lastmodified:
+            headers['If-Modified-Since'] = self.lastmodified
+        return headers
+
+    def renew(self, ttl):
+        # confirmed by PMS - same XML, fresh again
+        return CPMSResponse(self.XML, self.size, ttl, self.etag, self.lastmodified, self.stamp)
+
+"""
+getContainerStamp - version of a PMS response, from the MediaContainer start tag only
+
+parameters:
+    data - response body
+result:
+    tuple of g_StampAttribs values, None if the container has no updatedAt
+"""
+g_StampAttribs = ('updatedAt', 'librarySectionID', 'size', 'totalSize', 'offset')
+
+def getContainerStamp(data):
+    try:
+        for (event, elem) in etree.iterparse(StringIO(data), events=('start',)):
+            if elem.get('updatedAt') is None:
+                return None
+            return tuple(elem.get(attrib) for attrib in g_StampAttribs)
+    except SyntaxError:
+        pass  # not XML - fromstring() will complain
+    return None
+
+g_CacheTTLRouter = Router.CRouter('pms_cache', [
+    ('timeline'  , 'prefix'  , '/:/'                 , 0),  # scrobble, timeline, progress - never
+    ('ondeck'    , 'contains', '/onDeck'             , 10),
+    ('recent'    , 'contains', '/recently'           , 30),
+    ('recent'    , 'suffix'  , '/newest'             , 30),
+    ('sections'  , 'exact'   , '/library/sections'   , 300),
+    ('artwork'   , 'suffix'  , '/posters'            , 3600),
+    ('artwork'   , 'suffix'  , '/arts'               , 3600),
+    ('metadata'  , 'prefix'  , '/library/metadata/'  , 0),  # viewOffset, watched - set by the aTV at PMS directly
+    ('filters'   , 'suffix'  , '/genre'              , 600),
+    ('filters'   , 'suffix'  , '/year'               , 600),
+    ('filters'   , 'suffix'  , '/decade'             , 600),
+    ('filters'   , 'suffix'  , '/director'           , 600),
+    ('filters'   , 'suffix'  , '/actor'              , 600),
+    ('filters'   , 'suffix'  , '/collection'         , 600),
+    ('filters'   , 'suffix'  , '/contentRating'      , 600),
+    ('filters'   , 'suffix'  , '/firstCharacter'     , 600),
+    ('filters'   , 'suffix'  , '/country'            , 600),
+    ('filters'   , 'suffix'  , '/resolution'         , 600),
+    ('channels'  , 'exact'   , '/channels/all'       , 300),
+    ('listings'  , 'suffix'  , '/all'                , 10),  # big - revalidated rather than fetched again
+    ('listings'  , 'suffix'  , '/unwatched'          , 10),
+    ('listings'  , 'suffix'  , '/folder'             , 10),
+    ('listings'  , 'suffix'  , '/albums'             , 10),
+    ])
+g_CacheTTL = {}  # name -> ttl [s], from pms_cache_ttl
+
+def getCacheTTL(path):
+    if not g_PMSCache.maxsize:
+        return 0  # cache off
+    route = g_CacheTTLRouter.match(path.split('?',1)[0])
+    if route is None:
+        return 0
+    return g_CacheTTL.get(route.name, route.target)
+
+def setParams(param):
+    global g_CacheTTL, g_MultiPMSDeadline
+    g_MultiPMSDeadline = float(param['CSettings'].getSetting('multipms_deadline'))
+    g_PMSCache.maxsize = int(param['CSettings'].getSetting('pms_cache_size'))*1024*1024
+    g_CacheTTL = {}
+    for item in param['CSettings'].getSetting('pms_cache_ttl').split(','):
+        if ':' in item:
+            (name, ttl) = item.split(':',1)
+            g_CacheTTL[name.strip()] = int(ttl)
 
 
 
+"""
+fan-out to several PMS: worker threads shared by all requests of this process, created on first use
+(WebServer workers may be forked - threads don't survive that)
+multipms_deadline [s] - how long a page waits for all servers to answer
+"""
+g_FanOutThreads = 8
+g_FanOutQueueSize = 64
+g_FanOutPool = None
+g_FanOutLock = threading.Lock()
+g_MultiPMSDeadline = 5.0
+
+def getFanOutPool():
+    global g_FanOutPool
+    g_FanOutLock.acquire()
+    try:
+        if g_FanOutPool is None:
+            g_FanOutPool = ThreadPool.CThreadPool('PMSFanOut', g_FanOutThreads, g_FanOutQueueSize)
+        return g_FanOutPool
+    finally:
+        g_FanOutLock.release()
+
 def getXMLFromPMSToQueue(PMS, queue):
-    XML = getXMLFromPMS(PMS['baseURL'],PMS['path'],PMS['options'],PMS['token'])
+    try:
+        XML = getXMLFromPMS(PMS['baseURL'],PMS['path'],PMS['options'],PMS['token'])
+    except DeadlineExceeded:
+        XML = False
     queue.put( (PMS['data'], XML) )
 
 
@@ -407,97 +683,154 @@ def getXArgsDeviceInfo(options={}):
 
 
 """
-provide combined XML representation of local servers' XMLs, eg. /library/section
+getXMLFromMultiplePMS - same path from all (owned, shared...) PMS, merged into one MediaConverter tree
 
 parameters:
     ATV_udid
     path
-    type - owned <> shared (previously: local, myplex)
-    options
+    type - all, owned, shared, local, remote
+    options - PlexConnect-options, 'aTVDeadline' bounds the single PMS requests
 result:
-    XML
+    XML - one Server node per PMS, with what it answered within multipms_deadline.
+    Servers too late are marked late="1", size 0 - their answers still go to the PMS cache for the next visit.
+    shared with other requests (cache), don't modify
 """
 def getXMLFromMultiplePMS(ATV_udid, path, type, options={}):
     queue = Queue.Queue()
-    threads = []
+    servers = []  # uuid, in order of the Server nodes
+    pending = set()  # uuid, not answered yet
+    answers = {}  # uuid -> PMS XML or False
+    pool = getFanOutPool()
 
-    root = etree.Element("MediaConverter")
-    root.set('friendlyName', type+' Servers')
-
-    for uuid in g_PMS.get(ATV_udid, {}):
+    PMS_list = Registry.g_Registry.getPMSList(ATV_udid)  # one snapshot, not one lookup per property
+    for uuid in PMS_list:
         if (type=='all') or \
-           (type=='owned' and getPMSProperty(ATV_udid, uuid, 'owned')=='1') or \
-           (type=='shared' and getPMSProperty(ATV_udid, uuid, 'owned')=='0') or \
-           (type=='local' and getPMSProperty(ATV_udid, uuid, 'local')=='1') or \
-           (type=='remote' and getPMSProperty(ATV_udid, uuid, 'local')=='0'):
-            Server = etree.SubElement(root, 'Server')  # create "Server" node
-            Server.set('name',    getPMSProperty(ATV_udid, uuid, 'name'))
-            # Server.set('address', getPMSProperty(ATV_udid, uuid, 'ip'))
-            # JRH Change
-            Server.set('address', getPMSProperty(ATV_udid, uuid, 'localAddresses'))
-            Server.set('port',    getPMSProperty(ATV_udid, uuid, 'port'))
-            Server.set('baseURL', getPMSProperty(ATV_udid, uuid, 'baseURL'))
-            Server.set('local',   getPMSProperty(ATV_udid, uuid, 'local'))
-            Server.set('owned',   getPMSProperty(ATV_udid, uuid, 'owned'))
-
-            baseURL = getPMSProperty(ATV_udid, uuid, 'baseURL')
-            token = getPMSProperty(ATV_udid, uuid, 'accesstoken')
-            PMS_mark = 'PMS(' + getPMSProperty(ATV_udid, uuid, 'ip') + ')'
-
-            Server.set('searchKey', PMS_mark + getURL('', '', '/SearchForm.xml'))
-
-            # request XMLs, one thread for each
-            PMS = { 'baseURL':baseURL, 'path':path, 'options':options, 'token':token, \
-                    'data': {'uuid': uuid, 'Server': Server} }
-            t = Thread(target=getXMLFromPMSToQueue, args=(PMS, queue))
-            t.start()
-            threads.append(t)
-
-    # wait for requests being answered
-    for t in threads:
-        t.join()
-
-    # add new data to root XML, individual Server
-    while not queue.empty():
-            (data, XML) = queue.get()
-            uuid = data['uuid']
-            Server = data['Server']
-
-            baseURL = getPMSProperty(ATV_udid, uuid, 'baseURL')
-            token = getPMSProperty(ATV_udid, uuid, 'accesstoken')
-            PMS_mark = 'PMS(' + getPMSProperty(ATV_udid, uuid, 'ip') + ')'
-
-            if XML==False:
-                Server.set('size',    '0')
+           (type=='owned' and PMS_list[uuid].get('owned', '')=='1') or \
+           (type=='shared' and PMS_list[uuid].get('owned', '')=='0') or \
+           (type=='local' and PMS_list[uuid].get('local', '')=='1') or \
+           (type=='remote' and PMS_list[uuid].get('local', '')=='0'):
+            servers.append(uuid)
+
+            # request XMLs, shared worker threads
+            PMS = { 'baseURL':PMS_list[uuid].get('baseURL', ''), 'path':path, 'options':options, \
+                    'token':PMS_list[uuid].get('accesstoken', ''), 'data': {'uuid': uuid} }
+            if pool.submit(getXMLFromPMSToQueue, PMS, queue):
+                pending.add(uuid)
             else:
-                Server.set('size',    XML.getroot().get('size', '0'))
-
-                for Dir in XML.getiterator('Directory'):  # copy "Directory" content, add PMS to links
-                    key = Dir.get('key')  # absolute path
-                    Dir.set('key',    PMS_mark + getURL('', path, key))
-                    Dir.set('refreshKey', getURL(baseURL, path, key) + '/refresh')
-                    if 'thumb' in Dir.attrib:
-                        Dir.set('thumb',  PMS_mark + getURL('', path, Dir.get('thumb')))
-                    if 'art' in Dir.attrib:
-                        Dir.set('art',    PMS_mark + getURL('', path, Dir.get('art')))
-                    Server.append(Dir)
-
-                for Playlist in XML.getiterator('Playlist'):  # copy "Playlist" content, add PMS to links
-                    key = Playlist.get('key')  # absolute path
-                    Playlist.set('key',    PMS_mark + getURL('', path, key))
-                    if 'composite' in Playlist.attrib:
-                        Playlist.set('composite', PMS_mark + getURL('', path, Playlist.get('composite')))
-                    Server.append(Playlist)
-
-    root.set('size', str(len(root.findall('Server'))))
+                dprint(__name__, 0, "Fan-out queue full - skipping {0}", PMS_list[uuid].get('name', ''))
+
+    # wait for requests being answered - up to the page deadline
+    end = time.time() + g_MultiPMSDeadline
+    deadline = options.get('aTVDeadline') if options else None
+    if deadline:
+        end = min(end, deadline.end)
+
+    while pending:
+        try:
+            (data, XML) = queue.get(timeout=max(0.0, end-time.time()))
+        except Queue.Empty:
+            break
+        pending.discard(data['uuid'])
+        answers[data['uuid']] = XML
+
+    # one Server node per PMS - reused as long as the PMS XML is the same
+    parts = []
+    for uuid in servers:
+        if answers.get(uuid, False)==False:
+            if uuid in answers:
+                Server = createServerNode(PMS_list[uuid])
+            else:
+                dprint(__name__, 0, "No answer in time from {0}, {1}", PMS_list[uuid].get('name', ''), path)
+                Stats.count('multipms_late', pms=PMS_list[uuid].get('baseURL', ''))
+                Server = createServerNode(PMS_list[uuid])
+                Server.set('late', '1')
+            Server.set('size', '0')
+        else:
+            Server = getServerPart(PMS_list[uuid], path, answers[uuid])
+        parts.append(Server)
+
+    # merged tree - re-assembled only if one of the servers changed
+    key = (ATV_udid, type, path)
+    cached = g_MultiPMSCache.get(key)
+    if cached and len(cached[0])==len(parts) and \
+       all(old is new for (old, new) in zip(cached[0], parts)):
+        return cached[1]
+
+    root = etree.Element("MediaConverter")
+    root.set('friendlyName', type+' Servers')
+    for Server in parts:
+        root.append(Server)
+    root.set('size', str(len(parts)))
 
     XML = etree.ElementTree(root)
+    g_MultiPMSCache.set(key, (parts, XML), 1)
 
     dprint(__name__, 1, "====== Local Server/Sections XML ======")
     dprint(__name__, 1, XML.getroot())
     dprint(__name__, 1, "====== Local Server/Sections XML finished ======")
 
-    return XML  # XML representation - created "just in time". Do we need to cache it?
+    return XML
+
+
+
+"""
+multi-PMS cache - merged trees by (aTV, type, path) and the Server nodes they are made of, size counted in entries
+a Server node is rebuilt when its PMS sends a changed XML (a tree other than the one it was built from),
+a merged tree when one of its Server nodes changed. both shared read-only.
+"""
+g_MultiPMSCache = Cache.CCache('multipms', 512)
+
+g_ServerAttribs = ('name', 'localAddresses', 'port', 'baseURL', 'local', 'owned', 'ip', 'accesstoken')
+
+def createServerNode(PMS):
+    Server = etree.Element('Server')  # create "Server" node
+    Server.set('name',    PMS.get('name', ''))
+    # Server.set('address', getPMSProperty(ATV_udid, uuid, 'ip'))
+    # JRH Change
+    Server.set('address', PMS.get('localAddresses', ''))
+    Server.set('port',    PMS.get('port', ''))
+    Server.set('baseURL', PMS.get('baseURL', ''))
+    Server.set('local',   PMS.get('local', ''))
+    Server.set('owned',   PMS.get('owned', ''))
+
+    PMS_mark = 'PMS(' + PMS.get('ip', '') + ')'
+    Server.set('searchKey', PMS_mark + getURL('', '', '/SearchForm.xml'))
+    return Server
+
+def getServerPart(PMS, path, XML):
+    partKey = (path,) + tuple(PMS.get(attrib, '') for attrib in g_ServerAttribs)
+    cached = g_MultiPMSCache.get(partKey)
+    if cached and cached[0] is XML:
+        return cached[1]
+
+    Server = createServerNode(PMS)
+    baseURL = PMS.get('baseURL', '')
+    PMS_mark = 'PMS(' + PMS.get('ip', '') + ')'
+
+    # add new data to Server node
+    Server.set('size',    XML.getroot().get('size', '0'))
+
+    for Dir in XML.getiterator('Directory'):  # copy "Directory" content, add PMS to links
+        Dir = copy.deepcopy(Dir)  # PMS XML is shared (cache) - modify own copy
+        key = Dir.get('key')  # absolute path
+        Dir.set('key',    PMS_mark + getURL('', path, key))
+        Dir.set('refreshKey', getURL(baseURL, path, key) + '/refresh')
+        if 'thumb' in Dir.attrib:
+            Dir.set('thumb',  PMS_mark + getURL('', path, Dir.get('thumb')))
+        if 'art' in Dir.attrib:
+            Dir.set('art',    PMS_mark + getURL('', path, Dir.get('art')))
+        Server.append(Dir)
+
+    for Playlist in XML.getiterator('Playlist'):  # copy "Playlist" content, add PMS to links
+        Playlist = copy.deepcopy(Playlist)  # PMS XML is shared (cache) - modify own copy
+        key = Playlist.get('key')  # absolute path
+        Playlist.set('key',    PMS_mark + getURL('', path, key))
+        if 'composite' in Playlist.attrib:
+            Playlist.set('composite', PMS_mark + getURL('', path, Playlist.get('composite')))
+        Server.append(Playlist)
+
+    g_MultiPMSCache.set(partKey, (XML, Server), 1)
+    return Server
 
 
 
@@ -547,18 +880,12 @@ def MyPlexSignIn(username, password, options):
         print
     """
 
-    # provide credentials
-    ### optional... when 'realm' is unknown
-    ##passmanager = urllib2.HTTPPasswordMgrWithDefaultRealm()
-    ##passmanager.add_password(None, address, username, password)  # None: default "realm"
-    passmanager = urllib2.HTTPPasswordMgr()
-    passmanager.add_password(MyPlexHost, MyPlexURL, username, password)  # realm = 'plex.tv'
-    authhandler = urllib2.HTTPBasicAuthHandler(passmanager)
-    urlopener = urllib2.build_opener(authhandler)
+    # provide credentials - basic authentication, sent with the request (no 401 round trip)
+    request.add_header('Authorization', 'Basic ' + base64.b64encode(username + ':' + password))
 
     # sign in, get MyPlex response
     try:
-        response = urlopener.open(request).read()
+        response = HTTPPool.urlopen(request).read()
     except urllib2.HTTPError, e:
         if e.code==401:
             dprint(__name__, 0, 'Authentication failed')
@@ -600,7 +927,7 @@ def MyPlexSignOut(authtoken):
     request = urllib2.Request(MyPlexURL, None, xargs)
     request.get_method = lambda: 'POST'  # turn into 'POST' - done automatically with data!=None. But we don't have data.
 
-    response = urllib2.urlopen(request).read()
+    response = HTTPPool.urlopen(request).read()
 
     dprint(__name__, 1, "====== MyPlex sign out XML ======")
     dprint(__name__, 1, response)
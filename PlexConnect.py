@@ -17,7 +17,7 @@ import signal, errno
 
 from Version import __VERSION__
 import DNSServer, WebServer
-import Settings, ATVSettings
+import Settings, ATVSettings, Registry
 from PILBackgrounds import isPILinstalled
 from Debug import *  # dprint()
 
@@ -50,12 +50,74 @@ procs = {}
 pipes = {}
 param = {}
 running = False
+workers = []  # WebServer processes: (name, target) - restarted if they die
+started = {}  # name -> time of the last successful start
+restarts = {}  # name -> (failures in a row, time of the next start)
+restartDelay = (1, 60)  # [s] wait before the first restart, doubled with every failure in a row up to the second
+restartLimit = 10  # failures in a row - give up, shut down
+restartStable = 60  # [s] up for this long: the next failure is the first one again
+registryService = None  # Registry master copy, replicated to the WebServer processes
+
+def startProcess(name, target):
+    master, slave = Pipe()  # endpoint [0]-PlexConnect, [1]-WebServer
+    changes, publish = Pipe(duplex=False)  # registry changes, WebServer -> PlexConnect
+    param['RegistrySnapshot'] = registryService.addWorker(name, master, changes)  # changes from now on follow through the pipes
+    param['RegistryPipe'] = publish
+    proc = Process(target=target, args=(slave, param))
+    proc.start()
+    slave.close()  # WebServer's ends - pipes break when the process dies
+    publish.close()
+    del param['RegistryPipe']
+    
+    time.sleep(0.1)
+    if proc.is_alive():
+        procs[name] = proc
+        pipes[name] = master
+        started[name] = time.time()
+        return True
+    else:
+        dprint('PlexConnect', 0, "{0} not alive.", name)
+        registryService.removeWorker(name, master)
+        master.close()
+        return False
+
+def superviseWorkers():
+    # restart died WebServer processes - after a pause, growing with every failure in a row
+    for (name, target) in workers:
+        if not running:
+            return
+        if name in procs:
+            if procs[name].is_alive():
+                continue
+            dprint('PlexConnect', 0, "{0} died (exitcode {1}).", name, procs[name].exitcode)
+            procs.pop(name).join()
+            pipes.pop(name).close()
+            if not scheduleRestart(name, time.time()-started[name]):
+                cmdShutdown()
+        elif time.time()>=restarts[name][1]:
+            if not startProcess(name, target) and not scheduleRestart(name, 0):
+                cmdShutdown()
+
+def scheduleRestart(name, uptime):
+    # result: False if given up
+    (failures, retry) = restarts.get(name, (0, 0))
+    if uptime>=restartStable:
+        failures = 0
+    failures += 1
+    if failures>restartLimit:
+        dprint('PlexConnect', 0, "{0} failed {1} times in a row. Giving up.", name, restartLimit)
+        return False
+    delay = min(restartDelay[0] * 2**(failures-1), restartDelay[1])
+    dprint('PlexConnect', 0, "Restarting {0} in {1}s.", name, delay)
+    restarts[name] = (failures, time.time()+delay)
+    return True
 
 def startup():
     global procs
     global pipes
     global param
     global running
+    global registryService
     
     # Settings
     cfg = Settings.CSettings()
@@ -83,12 +145,35 @@ def startup():
     param['HostToIntercept'] = cfg.getSetting('hosttointercept')
     param['baseURL'] = 'http://'+ param['HostToIntercept']
     
+    # WebServer processes
+    cfg_workers = int(cfg.getSetting('webserver_workers'))
+    if cfg_workers>1 and WebServer.SO_REUSEPORT is None:
+        dprint('PlexConnect', 0, "SO_REUSEPORT not supported on {0} - one WebServer worker only", sys.platform)
+        cfg_workers = 1
+    param['WebServerWorkers'] = cfg_workers
+    
+    del workers[:]
+    for i in range(cfg_workers):
+        suffix = '' if cfg_workers==1 else '-'+str(i)
+        if cfg.getSetting('enable_webserver_singleprocess')=='True':
+            # HTTP and HTTPS listeners in one process
+            workers.append(('WebServer'+suffix, WebServer.Run_Multi))
+        else:
+            workers.append(('WebServer'+suffix, WebServer.Run))
+            if cfg.getSetting('enable_webserver_ssl')=='True':
+                workers.append(('WebServer_SSL'+suffix, WebServer.Run_SSL))
+    
     # proxy for ATVSettings
     proxy = BaseManager()
     proxy.register('ATVSettings', ATVSettings.CATVSettings)
     proxy.start(initProxy)
     param['CATVSettings'] = proxy.ATVSettings()
     
+    # known PMS/aTVs - one set for all WebServer processes, kept across restarts
+    registry = Registry.CRegistry()
+    registry.load(Registry.getRegistryFile())
+    registryService = Registry.CRegistryService(registry)
+    
     running = True
     
     # init DNSServer
@@ -105,34 +190,10 @@ def startup():
             dprint('PlexConnect', 0, "DNSServer not alive. Shutting down.")
             running = False
     
-    # init WebServer
-    if running:
-        master, slave = Pipe()  # endpoint [0]-PlexConnect, [1]-WebServer
-        proc = Process(target=WebServer.Run, args=(slave, param))
-        proc.start()
-        
-        time.sleep(0.1)
-        if proc.is_alive():
-            procs['WebServer'] = proc
-            pipes['WebServer'] = master
-        else:
-            dprint('PlexConnect', 0, "WebServer not alive. Shutting down.")
-            running = False
-    
-    # init WebServer_SSL
-    if running and \
-       cfg.getSetting('enable_webserver_ssl')=='True':
-        master, slave = Pipe()  # endpoint [0]-PlexConnect, [1]-WebServer
-        proc = Process(target=WebServer.Run_SSL, args=(slave, param))
-        proc.start()
-        
-        time.sleep(0.1)
-        if proc.is_alive():
-            procs['WebServer_SSL'] = proc
-            pipes['WebServer_SSL'] = master
-        else:
-            dprint('PlexConnect', 0, "WebServer_SSL not alive. Shutting down.")
-            running = False
+    # init WebServer, WebServer_SSL
+    for (name, target) in workers:
+        if running:
+            running = startProcess(name, target)
     
     # not started successful - clean up
     if not running:
@@ -142,14 +203,17 @@ def startup():
     return running
 
 def run(timeout=60):
-    # do something important
-    try:
-        time.sleep(timeout)
-    except IOError as e:
-        if e.errno == errno.EINTR and not running:
-            pass  # mask "IOError: [Errno 4] Interrupted function call"
-        else:
-            raise
+    # do something important - look after the WebServer workers every second
+    end = time.time() + timeout
+    while running and time.time()<end:
+        try:
+            time.sleep(min(1.0, max(0.0, end-time.time())))
+        except IOError as e:
+            if e.errno == errno.EINTR and not running:
+                pass  # mask "IOError: [Errno 4] Interrupted function call"
+            else:
+                raise
+        superviseWorkers()
     
     return running
 
@@ -165,7 +229,7 @@ def cmdShutdown():
     running = False
     # send shutdown to all pipes
     for slave in pipes:
-        pipes[slave].send('shutdown')
+        registryService.send(pipes[slave], 'shutdown')
     dprint('PlexConnect', 0, "Shutting down.")
 
 
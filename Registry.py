@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+
+"""
+Registry
+
+Known PMS per aTV and known aTVs by IP - formerly PlexAPI.g_PMS and XMLConverter.g_ATVList.
+Master copy in the PlexConnect main process (CRegistryService), kept in Registry.json across restarts.
+Every WebServer process holds a replica in g_Registry: lookups stay in the process, changes (one
+aTV/PMS entry each) go to the master copy and are pushed from there to all replicas.
+Access through g_Registry, PlexAPI and XMLConverter keep their functions on top of it.
+"""
+
+
+import sys
+import os
+import json
+import threading
+import Queue
+
+from Debug import *  # dprint()
+
+
+
+"""
+CRegistry
+
+PMS[<ATV_UDID>][PMS_UUID][<data>]
+    data: name, ip, ...type (local, myplex)
+ATV[<ATV_UDID>][<data>]
+    data: ip
+indexed by IP: PMSByIP[<ATV_UDID>][ip] -> PMS_UUID, ATVByIP[ip] -> ATV_UDID
+"""
+class CRegistry():
+    def __init__(self):
+        dprint(__name__, 1, "init class CRegistry")
+        self.lock = threading.Lock()
+        self.PMS = {}
+        self.ATV = {}
+        self.PMSByIP = {}
+        self.ATVByIP = {}
+        self.publish = None  # replica: function(msg), sends changes to the master copy
+        self.path = None  # file to save to on changes, None: not persistent
+        self.saved = None  # last saved content
+        self.saveLock = threading.Lock()
+
+    # PMS
+    def declarePMS(self, ATV_udid, uuid, name, scheme, ip, port):
+        address = ip + ':' + port
+        baseURL = scheme+'://'+ip+':'+port
+        self.update([('PMS', ATV_udid, uuid, { 'name': name,
+                                               'scheme':scheme, 'ip': ip , 'port': port,
+                                               'address': address,
+                                               'baseURL': baseURL,
+                                               'local': '1',
+                                               'owned': '1',
+                                               'accesstoken': ''
+                                             })])
+
+    def updatePMSProperty(self, ATV_udid, uuid, tag, value):
+        # unknown aTV or PMS: ignored
+        self.update([('PMSProperty', ATV_udid, uuid, tag, value)])
+
+    def getPMSProperty(self, ATV_udid, uuid, tag):
+        return self.getPMSProperties(ATV_udid, uuid).get(tag, '')
+
+    def getPMSProperties(self, ATV_udid, uuid):
+        # all properties of one PMS - copy, {} if not known
+        self.lock.acquire()
+        try:
+            return dict(self.PMS.get(ATV_udid, {}).get(uuid, {}))
+        finally:
+            self.lock.release()
+
+    def getPMSFromAddress(self, ATV_udid, address):
+        # find PMS by IP, return UUID
+        self.lock.acquire()
+        try:
+            return self.PMSByIP.get(ATV_udid, {}).get(address, '')  # '': IP not found
+        finally:
+            self.lock.release()
+
+    def getPMSCount(self, ATV_udid):
+        self.lock.acquire()
+        try:
+            return len(self.PMS.get(ATV_udid, {}))
+        finally:
+            self.lock.release()
+
+    def getPMSList(self, ATV_udid):
+        # copy of all PMS known to this aTV: {uuid: {properties}}
+        self.lock.acquire()
+        try:
+            return copyPMSList(self.PMS.get(ATV_udid, {}))
+        finally:
+            self.lock.release()
+
+    def setPMSList(self, ATV_udid, PMS_list):
+        # replace all PMS of this aTV at once - passed on as changes per PMS
+        self.lock.acquire()
+        try:
+            known = self.PMS.get(ATV_udid, {})
+            ops = [('PMS', ATV_udid, uuid, None) for uuid in known if not uuid in PMS_list]
+            ops.extend([('PMS', ATV_udid, uuid, PMS_list[uuid]) for uuid in PMS_list])
+            ops = self.applyOps(ops)
+        finally:
+            self.lock.release()
+        self.changed(ops)
+
+    def getATVs(self):
+        # UDIDs of all aTVs with PMS known
+        self.lock.acquire()
+        try:
+            return self.PMS.keys()
+        finally:
+            self.lock.release()
+
+    # aTV
+    def declareATV(self, udid, ip):
+        self.lock.acquire()
+        try:
+            if self.ATV.get(udid, {}).get('ip')==ip:
+                return  # every request - nothing new most of the time
+            ops = self.applyOps([('ATV', udid, dict(self.ATV.get(udid, {}), ip=ip))])
+        finally:
+            self.lock.release()
+        self.changed(ops)
+
+    def getATVFromIP(self, ip):
+        # find aTV by IP, return UDID
+        self.lock.acquire()
+        try:
+            return self.ATVByIP.get(ip, None)  # None: IP not found
+        finally:
+            self.lock.release()
+
+    """
+    changes - one aTV or PMS entry each, concurrent changes of other entries/properties don't get lost
+        ('PMS', ATV_udid, uuid, {properties}) - set, None: remove
+        ('PMSProperty', ATV_udid, uuid, tag, value) - set one property of a known PMS
+        ('ATV', udid, {data}) - set
+    passed on as message ('registry', [changes])
+    """
+    def update(self, ops):
+        self.lock.acquire()
+        try:
+            ops = self.applyOps(ops)
+        finally:
+            self.lock.release()
+        self.changed(ops)
+
+    def applyOps(self, ops):
+        # caller holds the lock. result: changes that changed something
+        return [op for op in ops if self.applyOp(op)]
+
+    def applyOp(self, op):
+        if op[0]=='PMS':
+            (kind, udid, uuid, data) = op
+            PMS_list = self.PMS.get(udid, {})
+            if data is None:
+                if not uuid in PMS_list:
+                    return False
+                del PMS_list[uuid]
+            else:
+                if PMS_list.get(uuid)==data:
+                    return False
+                self.PMS.setdefault(udid, {})[uuid] = dict(data)
+            self.indexPMS(udid)
+        elif op[0]=='PMSProperty':
+            (kind, udid, uuid, tag, value) = op
+            PMS = self.PMS.get(udid, {}).get(uuid)
+            if PMS is None or PMS.get(tag)==value:
+                return False
+            PMS[tag] = value
+            if tag=='ip':
+                self.indexPMS(udid)
+        elif op[0]=='ATV':
+            (kind, udid, data) = op
+            if self.ATV.get(udid)==data:
+                return False
+            self.ATV[udid] = dict(data)
+            self.indexATV(udid)
+        else:
+            return False
+        return True
+
+    # index. caller holds the lock
+    def indexPMS(self, ATV_udid):
+        PMS_list = self.PMS[ATV_udid]
+        index = {}
+        for uuid in PMS_list:
+            index.setdefault(PMS_list[uuid].get('ip', None), uuid)  # first one, like the search before
+        self.PMSByIP[ATV_udid] = index
+
+    def indexATV(self, udid):
+        for ip in [ip for ip in self.ATVByIP if self.ATVByIP[ip]==udid]:
+            del self.ATVByIP[ip]
+        if 'ip' in self.ATV[udid]:
+            self.ATVByIP[self.ATV[udid]['ip']] = udid  # latest aTV with this IP
+
+    def reindex(self):
+        self.PMSByIP = {}
+        self.ATVByIP = {}
+        for udid in self.PMS:
+            self.indexPMS(udid)
+        for udid in self.ATV:
+            if 'ip' in self.ATV[udid]:
+                self.ATVByIP.setdefault(self.ATV[udid]['ip'], udid)
+
+    def changed(self, ops):
+        # after the lock is released: tell the master copy, save if persistent
+        if not ops:
+            return
+        if self.publish:
+            self.publish(('registry', ops))
+        self.save()
+
+    def apply(self, msg):
+        # changes sent by a replica (master copy) or pushed by the master copy (replica)
+        (tag, ops) = msg
+        self.lock.acquire()
+        try:
+            ops = self.applyOps(ops)
+        finally:
+            self.lock.release()
+        if ops:
+            self.save()
+
+    def getSnapshot(self):
+        self.lock.acquire()
+        try:
+            return { 'PMS': dict((udid, copyPMSList(self.PMS[udid])) for udid in self.PMS),
+                     'ATV': dict((udid, dict(self.ATV[udid])) for udid in self.ATV) }
+        finally:
+            self.lock.release()
+
+    def setSnapshot(self, snapshot):
+        self.lock.acquire()
+        try:
+            self.PMS = snapshot['PMS']
+            self.ATV = snapshot['ATV']
+            self.reindex()
+        finally:
+            self.lock.release()
+
+    # persistence
+    def load(self, path, persist=True):
+        # PMS/aTVs known before the restart. persist: save changes to path from now on
+        self.path = path if persist else None
+        try:
+            f = open(path, 'rb')
+            try:
+                data = fromJSON(json.load(f))
+            finally:
+                f.close()
+            PMS = data['PMS']
+            ATV = data['ATV']
+            if not isinstance(PMS, dict) or not isinstance(ATV, dict):
+                raise ValueError('PMS, ATV: no dict')
+        except IOError:
+            return  # first start
+        except (ValueError, KeyError, TypeError), e:
+            dprint(__name__, 0, "Failed to load {0}, starting empty: {1}", path, e)
+            return
+
+        self.setSnapshot({'PMS': PMS, 'ATV': ATV})
+        dprint(__name__, 0, "Loaded {0} aTV(s), {1} PMS list(s) from {2}", len(ATV), len(PMS), path)
+
+    def save(self):
+        # snapshot to file, if persistent and changed - written to a temp file, renamed over the old one
+        if self.path is None:
+            return
+        self.saveLock.acquire()
+        try:
+            self.lock.acquire()
+            try:
+                data = json.dumps({'PMS': self.PMS, 'ATV': self.ATV}, indent=1, sort_keys=True)
+            finally:
+                self.lock.release()
+            if data==self.saved:
+                return
+
+            tmp = self.path + '.tmp'
+            f = os.fdopen(os.open(tmp, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0600), 'wb')  # holds access tokens
+            try:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            try:
+                os.rename(tmp, self.path)
+            except OSError:
+                os.remove(self.path)  # Windows: no rename over an existing file
+                os.rename(tmp, self.path)
+            self.saved = data
+            dprint(__name__, 1, "Saved to {0}", self.path)
+        except (IOError, OSError), e:
+            dprint(__name__, 0, "Failed to save {0}: {1}", self.path, e)
+        finally:
+            self.saveLock.release()
+
+
+
+def copyPMSList(PMS_list):
+    return dict((uuid, dict(PMS_list[uuid])) for uuid in PMS_list)
+
+def getRegistryFile():
+    return sys.path[0] + os.sep + "Registry.json"
+
+def fromJSON(obj):
+    # strings as ElementTree returns them: str if ASCII, unicode otherwise
+    if isinstance(obj, dict):
+        return dict((fromJSON(key), fromJSON(value)) for (key, value) in obj.items())
+    if isinstance(obj, list):
+        return [fromJSON(value) for value in obj]
+    if isinstance(obj, unicode):
+        try:
+            return obj.encode('ascii')
+        except UnicodeEncodeError:
+            return obj
+    return obj
+
+
+
+"""
+CRegistryService - master copy, in the PlexConnect main process
+
+every WebServer process has two pipes: its cmdPipe (PlexConnect -> WebServer) and a one way pipe
+for the changes of its replica (WebServer -> PlexConnect) - no pipe is read and written at the same time.
+changes are applied and pushed to all replicas - the sender included, so all of them see the same order.
+each cmdPipe has its own outbox and sender thread - a process slow to read doesn't hold up the others.
+
+parameters:
+    registry - CRegistry, the master copy
+"""
+class CRegistryService():
+    def __init__(self, registry):
+        dprint(__name__, 1, "init class CRegistryService")
+        self.registry = registry
+        self.lock = threading.Lock()  # order of changes
+        self.pipes = {}  # name -> cmdPipe, WebServer processes
+        self.outbox = {}  # cmdPipe -> Queue of messages to send
+
+    def addWorker(self, name, pipe, changes):
+        # before the WebServer process starts - result: snapshot to start its replica with
+        # pipe: cmdPipe, PlexConnect's end. changes: receiving end of the replica's pipe
+        outbox = Queue.Queue()
+        self.lock.acquire()
+        try:
+            if name in self.pipes:
+                self.outbox.pop(self.pipes[name]).put(None)  # restarted - done with the old pipe
+            self.pipes[name] = pipe
+            self.outbox[pipe] = outbox
+            snapshot = self.registry.getSnapshot()
+        finally:
+            self.lock.release()
+        for (target, args) in ((self.receive, (name, pipe, changes)), (self.sender, (name, pipe, outbox))):
+            t = threading.Thread(target=target, args=args, name='Registry-'+name)
+            t.daemon = True
+            t.start()
+        return snapshot
+
+    def send(self, pipe, msg):
+        # WebServer: queued behind the changes pushed before. other processes (DNSServer): right away
+        self.lock.acquire()
+        try:
+            if pipe in self.outbox:
+                self.outbox[pipe].put(msg)
+                return
+        finally:
+            self.lock.release()
+        try:
+            pipe.send(msg)
+        except (IOError, OSError, EOFError), e:
+            dprint(__name__, 1, "send failed: {0}", e)  # process gone
+
+    def sender(self, name, pipe, outbox):
+        while True:
+            msg = outbox.get()
+            if msg is None:
+                break
+            try:
+                pipe.send(msg)
+            except (IOError, OSError, EOFError), e:
+                dprint(__name__, 1, "send to {0} failed: {1}", name, e)  # process gone, restarted by PlexConnect
+                break
+
+    def receive(self, name, pipe, changes):
+        while True:
+            try:
+                msg = changes.recv()
+            except (IOError, OSError, EOFError):
+                break  # process gone
+
+            if isinstance(msg, tuple) and msg[0]=='registry':
+                self.lock.acquire()
+                try:
+                    self.registry.apply(msg)
+                    for outbox in self.outbox.values():
+                        outbox.put(msg)
+                finally:
+                    self.lock.release()
+        changes.close()
+        self.removeWorker(name, pipe)
+
+    def removeWorker(self, name, pipe):
+        # process gone or didn't start - stop pushing to it
+        self.lock.acquire()
+        try:
+            if self.pipes.get(name) is pipe:
+                del self.pipes[name]
+                self.outbox.pop(pipe).put(None)
+        finally:
+            self.lock.release()
+
+
+
+g_Registry = CRegistry()
+
+def setReplica(snapshot, pipe):
+    # WebServer process: start with the master's snapshot, send changes through pipe - one way, see CRegistryService
+    g_Registry.setSnapshot(snapshot)
+    lock = threading.Lock()
+    def publish(msg):
+        lock.acquire()
+        try:
+            pipe.send(msg)
+        finally:
+            lock.release()
+    g_Registry.publish = publish
+
+def receive(cmd):
+    # WebServer process: command from PlexConnect. result: True if it was a registry update
+    if isinstance(cmd, tuple) and cmd[0]=='registry':
+        g_Registry.apply(cmd)
+        return True
+    return False
+
+
+
+if __name__=="__main__":
+    registry = CRegistry()
+    registry.declarePMS('ATV1', 'PMS1', 'Server', 'http', '192.168.178.10', '32400')
+    registry.updatePMSProperty('ATV1', 'PMS1', 'accesstoken', 'token')
+    registry.declareATV('ATV1', '192.168.178.20')
+    print registry.getPMSFromAddress('ATV1', '192.168.178.10'), registry.getPMSProperty('ATV1', 'PMS1', 'baseURL')
+    print registry.getATVFromIP('192.168.178.20'), registry.getPMSList('ATV1')
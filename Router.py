@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+Router
+
+Request dispatch by route table - compiled once into
+- exact: dict lookup
+- prefix, suffix: character trie, walked once along the key
+- contains: short list, scanned
+If several routes match, the first one in the table wins - same as the if/elif chain it replaced.
+Latency per route is kept in Stats ("request", label route), see record().
+"""
+
+
+import Stats
+from Debug import *  # dprint()
+
+
+
+class CRoute():
+    def __init__(self, order, name, kind, key, target, check=None):
+        self.order = order
+        self.name = name
+        self.kind = kind
+        self.key = key
+        self.target = target
+        self.check = check  # optional - function(key): route applies only if True
+
+
+
+"""
+CRouter
+
+parameters:
+    name - for log output
+    routes - list of (name, kind, key, target) or (name, kind, key, target, check)
+        kind - 'exact', 'prefix', 'suffix', 'contains'
+        target - whatever the caller dispatches on: template, function, ...
+"""
+class CRouter():
+    def __init__(self, name, routes):
+        self.name = name
+        self.exact = {}
+        self.prefixes = {}  # trie: char -> node, '' -> list of routes ending here
+        self.suffixes = {}  # trie over the reversed key
+        self.contains = []
+
+        for (order, route) in enumerate(routes):
+            route = CRoute(order, *route)
+            if route.kind=='exact':
+                self.exact.setdefault(route.key, []).append(route)
+            elif route.kind=='prefix':
+                self.addToTrie(self.prefixes, route.key, route)
+            elif route.kind=='suffix':
+                self.addToTrie(self.suffixes, route.key[::-1], route)
+            elif route.kind=='contains':
+                self.contains.append(route)
+            else:
+                raise ValueError("unknown route kind " + route.kind)
+        dprint(__name__, 1, "init class CRouter {0}: {1} routes", name, len(routes))
+
+    def addToTrie(self, trie, key, route):
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault('', []).append(route)
+
+    def walkTrie(self, trie, key, candidates):
+        node = trie
+        candidates.extend(node.get('', []))
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                break
+            candidates.extend(node.get('', []))
+
+    def match(self, key):
+        # return first matching CRoute (table order) or None
+        candidates = list(self.exact.get(key, []))
+        self.walkTrie(self.prefixes, key, candidates)
+        self.walkTrie(self.suffixes, key[::-1], candidates)
+        for route in self.contains:
+            if route.key in key:
+                candidates.append(route)
+
+        candidates.sort(key=lambda route: route.order)
+        for route in candidates:
+            if route.check is None or route.check(key):
+                dprint(__name__, 2, "{0}: {1} -> {2}", self.name, key, route.name)
+                return route
+        return None
+
+
+
+"""
+record - hit/latency of a served request
+
+parameters:
+    name - route name, most specific known
+    duration - [s]
+"""
+def record(name, duration):
+    Stats.addTiming('request', duration, route=name)
+
+
+
+if __name__=="__main__":
+    router = CRouter('test', [
+        ('application', 'suffix', '/application.js', 'application.js'),
+        ('js', 'suffix', '.js', 'js', lambda key: key.startswith('/js/')),
+        ('play', 'prefix', 'Play:', 'play'),
+        ('preview', 'contains', 'SectionPreview', 'preview'),
+        ('settings', 'exact', 'Settings', 'settings'),
+        ])
+    for key in ('/js/application.js', '/js/utils.js', '/other/utils.js', 'Play:Single:1', 'MovieSectionPreview', 'Settings', 'Unknown'):
+        route = router.match(key)
+        print key, '->', route.target if route else None
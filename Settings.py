@@ -14,16 +14,37 @@ Global Settings...
 syntax: 'setting': ('default', 'regex to validate')
 
 PMS: plexgdm, ip_pms, port_pms
+PMS cache: pms_cache_size [MB] of parsed PMS XML (0: off), pms_cache_ttl - time-to-live [s] per path class, eg. "ondeck:10, listings:60".
+    Expired responses are revalidated with PMS (ETag, updatedAt) before they are fetched again.
+PMS connections: pms_connections - idle keep-alive connections kept per PMS/plex.tv (0: off), pms_connection_idle [s] until closed
+Discovery: discovery_interval [s] - PMS lists of all aTVs refreshed in the background, 0: only on the aTV's Discover
+Multiple PMS: multipms_deadline [s] - pages listing all servers (Library, shared...) wait this long, late servers are left out
 DNS: ip_dnsmaster - IP of Router, ISP's DNS, ... [dflt: google public DNS]
 IP_self: enable_plexconnect_autodetect, ip_plexconnect - manual override for VPN usage
 Intercept: Trailers-trailers.apple.com, WSJ-secure.marketwatch.com, iMovie-www.icloud.com
 HTTP: port_webserver - override when using webserver + forwarding to PlexConnect
 HTTPS: port_ssl, certfile, enable_webserver_ssl - configure SSL portion or webserver
+Frontend: webserver_frontend - threaded: worker thread per request, idle keep-alive connections parked, async: one event loop, workers for rendering only (HTTP)
+Workers: webserver_threads, webserver_queuesize - worker pool size and pending connections before "503 busy"
+Static assets: webserver_static_cachesize [MB] in memory, webserver_static_maxage [s] Cache-Control for the aTV
+Compression: webserver_compress_level (0-9, 0: off), webserver_compress_minsize [bytes] for gzip/deflate of XML, JSON
+KeepAlive: webserver_keepalive_timeout, webserver_keepalive_max - idle time [s] and requests per persistent connection
+Single process: enable_webserver_singleprocess - HTTP and HTTPS from one process, one set of caches
+  webserver_listeners - eg. "http:80,https:443", empty: port_webserver + port_ssl (if enabled)
+Deadline: webserver_request_deadline [s] - time budget of one aTV request, shared by all PMS requests made for it
+Processes: webserver_workers - WebServer processes per port (SO_REUSEPORT), restarted if they die
+Trace: trace_path - record aTV requests and PMS responses to this directory, for TraceReplay.py. empty: off
 """
 g_settings = [
     ('enable_plexgdm'  , ('True', '((True)|(False))')),
     ('ip_pms'          , ('192.168.178.10', '([0-9]{1,3}\.){3}[0-9]{1,3}')),
     ('port_pms'        , ('32400', '[0-9]{1,5}')),
+    ('pms_connections' , ('4', '[0-9]{1,2}')),
+    ('pms_cache_size'  , ('16', '[0-9]{1,4}')),
+    ('pms_cache_ttl'   , ('', '([a-z]+:[0-9]{1,6}(, *[a-z]+:[0-9]{1,6})*)?')),
+    ('pms_connection_idle'          , ('15', '[1-9][0-9]{0,2}')),
+    ('discovery_interval'           , ('300', '[0-9]{1,5}')),
+    ('multipms_deadline'            , ('5', '[0-9]{1,2}(\.[0-9])?')),
     \
     ('enable_dnsserver', ('True', '((True)|(False))')),
     ('port_dnsserver'  , ('53', '[0-9]{1,5}')),
@@ -38,9 +59,23 @@ g_settings = [
     ('enable_webserver_ssl'         , ('True', '((True)|(False))')),
     ('port_ssl'        , ('443', '[0-9]{1,5}')),
     ('certfile'        , ('./assets/certificates/trailers.pem', '.+.pem')),
+    ('webserver_frontend'           , ('threaded', '((threaded)|(async))')),
+    ('webserver_threads'            , ('32', '[1-9][0-9]{0,2}')),
+    ('webserver_queuesize'          , ('64', '[1-9][0-9]{0,3}')),
+    ('webserver_keepalive_timeout'  , ('15', '[1-9][0-9]{0,2}')),
+    ('webserver_keepalive_max'      , ('100', '[1-9][0-9]{0,4}')),
+    ('webserver_compress_level'     , ('6', '[0-9]')),
+    ('webserver_compress_minsize'   , ('1024', '[0-9]{1,8}')),
+    ('webserver_static_cachesize'   , ('32', '[1-9][0-9]{0,3}')),
+    ('webserver_static_maxage'      , ('3600', '[0-9]{1,8}')),
+    ('enable_webserver_singleprocess', ('False', '((True)|(False))')),
+    ('webserver_listeners'          , ('', '(https?:[0-9]{1,5}(, *https?:[0-9]{1,5})*)?')),
+    ('webserver_workers'            , ('1', '[1-9][0-9]?')),
+    ('webserver_request_deadline'   , ('20', '[1-9][0-9]{0,2}')),
     \
     ('loglevel'        , ('Normal', '((Off)|(Normal)|(High))')),
     ('logpath'         , ('.', '.+')),
+    ('trace_path'      , ('', '.*')),
     ]
 
 
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+SingleFlight
+
+Coalesce identical concurrent work: the first caller of a key does it, callers
+arriving while it is in flight wait and get the same result.
+Nothing is kept once the work is done - this is not a cache.
+Failures are not shared: if the first caller fails, the others do the work themselves.
+"""
+
+
+import threading
+
+import Stats
+from Debug import *  # dprint()
+
+
+
+"""
+CFlight - one piece of work in flight
+"""
+class CFlight():
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.result = None
+
+
+
+"""
+CSingleFlight
+
+parameters:
+    name - for stats and log output
+"""
+class CSingleFlight():
+    def __init__(self, name):
+        dprint(__name__, 1, "init class CSingleFlight {0}", name)
+        self.name = name
+        self.lock = threading.Lock()
+        self.flights = {}  # key -> CFlight
+
+    def join(self, key):
+        # result: (flight, leader) - leader: caller has to do the work and land() it
+        self.lock.acquire()
+        try:
+            flight = self.flights.get(key)
+            if flight:
+                return (flight, False)
+            flight = CFlight()
+            self.flights[key] = flight
+            return (flight, True)
+        finally:
+            self.lock.release()
+
+    def land(self, key, flight, ok, result=None):
+        # leader: publish result, release waiting callers
+        self.lock.acquire()
+        try:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        finally:
+            self.lock.release()
+        flight.ok = ok
+        flight.result = result
+        flight.done.set()
+
+    def wait(self, flight, timeout=None):
+        # follower: result: (True, result) - shared, (False, None) - leader failed or timeout passed
+        if not flight.done.wait(timeout):
+            return (False, None)
+        if flight.ok:
+            Stats.count('singleflight_shared', flight=self.name)
+        return (flight.ok, flight.result)
+
+    """
+    do - work on key, once for all concurrent callers
+
+    parameters:
+        key - identifies the work, hashable
+        fn - function() doing the work. result None: failed, not shared
+        timeout - [s], how long to wait for the leader, None: no limit
+    result:
+        result of fn() - own or shared, None if the leader didn't finish in time
+    """
+    def do(self, key, fn, timeout=None):
+        (flight, leader) = self.join(key)
+        if not leader:
+            (ok, result) = self.wait(flight, timeout)
+            if ok or not flight.done.isSet():
+                return result
+            return fn()  # leader failed - try ourselves
+
+        result = None
+        try:
+            result = fn()
+        finally:
+            self.land(key, flight, result is not None, result)
+        return result
+
+
+
+if __name__=="__main__":
+    import time
+    calls = []
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'result'
+
+    flight = CSingleFlight('test')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', work))) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    dprint('SingleFlight', 0, "calls: {0}, results: {1}", len(calls), results)
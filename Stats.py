@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+"""
+Stats
+
+Counters, gauges and timings of the WebServer process, thread safe.
+Every value has a name and optional labels, eg. addTiming('request', 0.2, route='js').
+Other modules can register a provider function for values they keep themselves.
+Written to the log when the WebServer shuts down, served as text by getPrometheusText() (/metrics).
+
+Sources:
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+
+import threading
+
+from Debug import *  # dprint()
+
+
+
+g_lock = threading.Lock()
+g_Counters = {}  # (name, labels) -> value
+g_Gauges = {}  # (name, labels) -> value
+g_Timings = {}  # (name, labels) -> CTiming
+g_Providers = []  # (function() -> list of (name, {label: value}, value), type: 'counter' or 'gauge')
+
+g_Buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # [s]
+
+g_Prefix = 'plexconnect_'  # metric name prefix
+
+
+
+"""
+CTiming - count, sum, max and histogram of durations
+
+parameters:
+    buckets - upper bounds [s], ascending
+"""
+class CTiming():
+    def __init__(self, buckets=g_Buckets):
+        self.buckets = buckets
+        self.bucketcounts = [0]*len(buckets)  # per bucket, not cumulative
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.sum += duration
+        if duration>self.max:
+            self.max = duration
+        for (ix, bound) in enumerate(self.buckets):
+            if duration<=bound:
+                self.bucketcounts[ix] += 1
+                break
+
+    def getStats(self):
+        return { 'count': self.count,
+                 'sum': self.sum,
+                 'avg': self.sum/self.count if self.count else 0.0,
+                 'max': self.max,
+                 'buckets': zip(self.buckets, self.bucketcounts) }
+
+
+
+def getKey(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def count(name, n=1, **labels):
+    key = getKey(name, labels)
+    g_lock.acquire()
+    try:
+        g_Counters[key] = g_Counters.get(key, 0) + n
+    finally:
+        g_lock.release()
+
+def gauge(name, delta, **labels):
+    # in flight, open connections... - up and down
+    key = getKey(name, labels)
+    g_lock.acquire()
+    try:
+        g_Gauges[key] = g_Gauges.get(key, 0) + delta
+    finally:
+        g_lock.release()
+
+def addTiming(name, duration, **labels):
+    key = getKey(name, labels)
+    g_lock.acquire()
+    try:
+        if not key in g_Timings:
+            g_Timings[key] = CTiming()
+        g_Timings[key].add(duration)
+    finally:
+        g_lock.release()
+
+def registerProvider(provider, type='gauge'):
+    # type 'counter': totals that only go up, exported as <name>_total
+    g_Providers.append((provider, type))
+
+
+
+"""
+getStats - snapshot of all values
+
+result:
+    counters - {(name, labels): value}, including provider counters
+    gauges - {(name, labels): value}, including provider gauges
+    timings - {(name, labels): CTiming.getStats()}
+    labels: tuple of (label, value), sorted
+"""
+def getStats():
+    g_lock.acquire()
+    try:
+        counters = dict(g_Counters)
+        gauges = dict(g_Gauges)
+        timings = dict((key, timing.getStats()) for (key, timing) in g_Timings.items())
+    finally:
+        g_lock.release()
+
+    for (provider, type) in g_Providers:
+        values = counters if type=='counter' else gauges
+        try:
+            for (name, labels, value) in provider():
+                values[getKey(name, labels)] = value
+        except Exception, e:
+            dprint(__name__, 0, "Stats provider failed: {0}", e)
+
+    return (counters, gauges, timings)
+
+def formatName(key):
+    (name, labels) = key
+    if labels:
+        name += '{' + ','.join('%s=%s' % label for label in labels) + '}'
+    return name
+
+def logStats():
+    (counters, gauges, timings) = getStats()
+    for key in sorted(counters):
+        dprint(__name__, 0, "{0}: {1}", formatName(key), counters[key])
+    for key in sorted(gauges):
+        dprint(__name__, 0, "{0}: {1}", formatName(key), gauges[key])
+    for key in sorted(timings):
+        timing = timings[key]
+        dprint(__name__, 0, "{0}: count {1}, avg {2:.1f}ms, max {3:.1f}ms", \
+               formatName(key), timing['count'], timing['avg']*1000, timing['max']*1000)
+
+
+
+"""
+getPrometheusText - all values in Prometheus text exposition format
+counters: <name>_total, gauges: <name>, timings: histogram <name>_seconds
+
+result:
+    text/plain; version=0.0.4
+"""
+def formatLabels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (label, escapeLabel(value)) for (label, value) in labels) + '}'
+
+def escapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatFloat(value):
+    return repr(float(value))
+
+def getPrometheusText():
+    (counters, gauges, timings) = getStats()
+    lines = []
+
+    def addFamily(values, suffix, type, format):
+        lastname = None
+        for key in sorted(values):
+            (name, labels) = key
+            metric = g_Prefix + name + suffix
+            if name!=lastname:
+                lines.append('# TYPE %s %s' % (metric, type))
+                lastname = name
+            format(metric, labels, values[key])
+
+    def formatValue(metric, labels, value):
+        lines.append(metric + formatLabels(labels) + ' ' + str(value))
+
+    def formatHistogram(metric, labels, timing):
+        cumulative = 0
+        for (bound, n) in timing['buckets']:
+            cumulative += n
+            lines.append(metric + '_bucket' + formatLabels(labels, [('le', formatFloat(bound))]) + ' ' + str(cumulative))
+        lines.append(metric + '_bucket' + formatLabels(labels, [('le', '+Inf')]) + ' ' + str(timing['count']))
+        lines.append(metric + '_sum' + formatLabels(labels) + ' ' + formatFloat(timing['sum']))
+        lines.append(metric + '_count' + formatLabels(labels) + ' ' + str(timing['count']))
+
+    addFamily(counters, '_total', 'counter', formatValue)
+    addFamily(gauges, '', 'gauge', formatValue)
+    addFamily(timings, '_seconds', 'histogram', formatHistogram)
+    return '\n'.join(lines) + '\n'
+
+
+
+if __name__=="__main__":
+    count('requests')
+    count('requests')
+    count('pms_errors', pms='http://192.168.178.10:32400')
+    gauge('requests_in_flight', 1)
+    addTiming('ssl_handshake', 0.012)
+    addTiming('request', 0.3, route='js')
+    registerProvider(lambda: [('provided', {'source': 'test'}, 42)])
+    registerProvider(lambda: [('provided_events', {'source': 'test'}, 7)], 'counter')
+    logStats()
+    print getPrometheusText()
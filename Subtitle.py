@@ -13,6 +13,7 @@ import json
 
 from Debug import *  # dprint(), prettyXML()
 import PlexAPI
+import HTTPPool
 
 
 
@@ -25,6 +26,7 @@ parameters:
     options - dict() of PlexConnect-options as received from aTV, None for no std. X-Plex-Args
 result:
     aTV subtitle JSON or 'False' in case of error
+    raises PlexAPI.DeadlineExceeded if the aTV request is out of time
 """
 def getSubtitleJSON(PMS_address, path, options):
     """
@@ -52,9 +54,10 @@ def getSubtitleJSON(PMS_address, path, options):
     dprint(__name__, 1, "subtitle URL: {0}{1}", PMS_baseURL, path)
     dprint(__name__, 1, "xargs: {0}", xargs)
     
+    timeout = PlexAPI.getTimeout(options)
     request = urllib2.Request(PMS_baseURL+path , None, xargs)
     try:
-        response = urllib2.urlopen(request, timeout=20)
+        response = HTTPPool.urlopen(request, timeout=timeout)
     except urllib2.URLError as e:
         dprint(__name__, 0, 'No Response from Plex Media Server')
         if hasattr(e, 'reason'):
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""
+ThreadPool
+
+Fixed number of worker threads, fed by a bounded job queue.
+Used by the WebServer to work on aTV requests - instead of one thread per request.
+"""
+
+
+import sys
+import threading
+import Queue
+import traceback
+
+from Debug import *  # dprint()
+
+
+
+class CThreadPool():
+    def __init__(self, name, threads, queuesize):
+        dprint(__name__, 1, "init class CThreadPool {0}: {1} threads, queue {2}", name, threads, queuesize)
+        self.name = name
+        self.queue = Queue.Queue(queuesize)
+        self.threads = []
+        for i in range(threads):
+            t = threading.Thread(target=self.worker, name=name+'-'+str(i))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, func, *args):
+        # queue job, False if queue is full
+        try:
+            self.queue.put_nowait((func, args))
+        except Queue.Full:
+            return False
+        return True
+
+    def worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:  # shutdown
+                break
+
+            (func, args) = job
+            try:
+                func(*args)
+            except:
+                dprint(__name__, 0, "{0} - Error in job\n{1}", self.name, traceback.format_exc())
+
+    def shutdown(self):
+        # let the workers finish queued jobs, then stop
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+
+
+if __name__=="__main__":
+    import time
+
+    def job(i):
+        time.sleep(0.1)
+        dprint('ThreadPool', 0, "job {0} done", i)
+
+    pool = CThreadPool('test', 2, 4)
+    for i in range(8):
+        if not pool.submit(job, i):
+            dprint('ThreadPool', 0, "job {0} rejected - queue full", i)
+    pool.shutdown()
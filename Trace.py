@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""
+Trace
+
+Recorder for aTV traffic - input to TraceReplay.py.
+Enabled by 'trace_path' in Settings.cfg, every WebServer process appends to
+    <trace_path>/trace-<pid>.jsonl - one JSON object per line:
+        {"type": "request", "time", "path", "query", "PMSaddress", "options", "headers", "route"}
+        {"type": "pms", "time", "url", "file"} - PMS response seen by PlexAPI.getXMLFromPMS()
+        {"type": "registry", "time", "udid", "PMS"} - known PMS of an aTV, written when changed
+    <trace_path>/pms/<sha1>.xml - PMS response bodies, stored once per content
+Access tokens and MyPlex credentials are masked.
+
+Replay: setReplay() loads a trace, PlexAPI.getXMLFromPMS() then answers from replayPMS().
+"""
+
+
+import os
+import re
+import time
+import json
+import hashlib
+import threading
+import urllib2
+
+import Registry
+from Debug import *  # dprint()
+
+
+
+g_lock = threading.Lock()
+g_TracePath = None  # recording if set
+g_TraceFile = None
+g_Registry = {}  # udid -> PMS list as last written
+
+g_Replay = None  # replaying if set: url -> PMS response
+
+g_Mask = 'TRACE'
+g_MaskedOptions = ('PlexConnectCredentials',)
+g_TokenInURL = re.compile(r'(X-Plex-Token=)[^&]*')
+
+
+
+"""
+setPath - start recording
+
+parameters:
+    path - trace directory, '': off
+"""
+def setPath(path):
+    global g_TracePath, g_TraceFile
+    if not path:
+        return
+
+    try:
+        if not os.path.isdir(path + os.sep + 'pms'):
+            os.makedirs(path + os.sep + 'pms')
+        g_TraceFile = open(path + os.sep + 'trace-%d.jsonl' % os.getpid(), 'a')
+    except (IOError, OSError), e:
+        dprint(__name__, 0, "Failed to open trace in {0}: {1}", path, e)
+        return
+    g_TracePath = path
+    dprint(__name__, 0, "Recording aTV requests to {0}", path)
+
+def isRecording():
+    return g_TracePath is not None
+
+def write(record):
+    record['time'] = time.time()
+    g_lock.acquire()
+    try:
+        g_TraceFile.write(json.dumps(record) + '\n')
+        g_TraceFile.flush()  # a killed worker keeps its trace
+    except (IOError, ValueError), e:
+        dprint(__name__, 0, "Failed to write trace: {0}", e)
+    finally:
+        g_lock.release()
+
+
+
+"""
+recordRequest - aTV request, as seen by WebServer.handleRequest()
+
+parameters:
+    path, query, PMSaddress, options - parsed request
+    headers - request headers
+    route - name of the route that serves it
+"""
+def recordRequest(path, query, PMSaddress, options, headers, route):
+    if not isRecording():
+        return
+
+    opts = {}
+    for (key, value) in options.items():
+        if key in g_MaskedOptions:
+            opts[key] = g_Mask
+        elif isinstance(value, basestring):
+            opts[key] = value  # skip internal objects, eg. aTVDeadline
+
+    write({ 'type': 'request',
+            'path': path,
+            'query': maskURL(query),
+            'PMSaddress': PMSaddress,
+            'options': opts,
+            'headers': dict(headers.items()),
+            'route': route })
+
+    if 'PlexConnectUDID' in options:
+        recordRegistry(options['PlexConnectUDID'])
+
+def recordRegistry(udid):
+    PMS_list = Registry.g_Registry.getPMSList(udid)
+    for uuid in PMS_list:
+        if PMS_list[uuid].get('accesstoken'):
+            PMS_list[uuid]['accesstoken'] = g_Mask
+
+    g_lock.acquire()
+    try:
+        changed = g_Registry.get(udid)!=PMS_list
+        g_Registry[udid] = PMS_list
+    finally:
+        g_lock.release()
+    if changed:
+        write({ 'type': 'registry',
+                'udid': udid,
+                'PMS': PMS_list })
+
+"""
+recordPMS - response body of a PMS request
+
+parameters:
+    url - baseURL + path
+    data - response body
+"""
+def recordPMS(url, data):
+    if not isRecording():
+        return
+
+    file = 'pms/' + hashlib.sha1(data).hexdigest() + '.xml'
+    filename = g_TracePath + os.sep + file
+    if not os.path.exists(filename):
+        tmpname = filename + '.%d.%d' % (os.getpid(), threading.current_thread().ident)
+        try:
+            f = open(tmpname, 'wb')
+            f.write(data)
+            f.close()
+            os.rename(tmpname, filename)  # complete or not there, even with several writers
+        except (IOError, OSError), e:
+            dprint(__name__, 0, "Failed to write trace: {0}", e)
+            return
+
+    write({ 'type': 'pms',
+            'url': maskURL(url),
+            'file': file })
+
+def maskURL(url):
+    return g_TokenInURL.sub(r'\g<1>' + g_Mask, url)
+
+
+
+"""
+setReplay - load trace, answer PMS requests from it
+
+parameters:
+    path - trace directory
+result:
+    all records of all trace files, by time
+"""
+def setReplay(path):
+    global g_Replay
+    records = []
+    for filename in sorted(os.listdir(path)):
+        if filename.startswith('trace-') and filename.endswith('.jsonl'):
+            f = open(path + os.sep + filename, 'r')
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+            f.close()
+    records.sort(key=lambda record: record['time'])
+
+    replay = {}
+    data = {}
+    for record in records:
+        if record['type']=='pms':
+            if not record['file'] in data:
+                f = open(path + os.sep + record['file'], 'rb')
+                data[record['file']] = f.read()
+                f.close()
+            replay[record['url']] = data[record['file']]  # latest response per URL
+    g_Replay = replay
+
+    dprint(__name__, 0, "Replaying {0} records, {1} PMS responses from {2}", len(records), len(data), path)
+    return records
+
+def isReplaying():
+    return g_Replay is not None
+
+def replayPMS(url):
+    url = maskURL(url)
+    if not url in g_Replay:
+        raise urllib2.URLError("not in trace: " + url)
+    return g_Replay[url]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+TraceReplay
+
+Replay aTV requests recorded by Trace.py (trace_path in Settings.cfg) through XMLConverter.XML_PMS2aTV(),
+offline - PMS requests are answered with the recorded responses. Same trace, same work: compare
+throughput and latency before and after a change, with real household traffic.
+Requests changing state (settings, MyPlex login, discovery) are skipped.
+
+usage:
+python TraceReplay.py <trace_path> [--concurrency 4] [--repeat 1]
+"""
+
+
+import sys
+import time
+import threading
+import Queue
+import traceback
+import argparse
+
+import Settings, ATVSettings
+import XMLConverter
+import Registry
+import Trace
+from Debug import *  # dprint()
+from Benchmark import percentile
+
+
+
+g_SkipCmds = ('SaveSettings', 'SettingsToggle', 'MyPlexLogin', 'MyPlexLogout', 'Discover')
+
+
+
+def getRequests(records):
+    requests = []
+    for record in records:
+        if record['type']=='registry':
+            Registry.g_Registry.setPMSList(record['udid'], record['PMS'])  # latest wins
+        elif record['type']=='request' and record['route']=='xml':
+            if not record['options'].get('PlexConnect', '').startswith(g_SkipCmds):
+                requests.append(record)
+    return requests
+
+
+
+def runWorker(queue, results):
+    while True:
+        try:
+            record = queue.get_nowait()
+        except Queue.Empty:
+            break
+
+        options = dict(record['options'])
+        start = time.time()
+        try:
+            XML = XMLConverter.XML_PMS2aTV(record['PMSaddress'], record['path'] + record['query'], options)
+            if not isinstance(XML, basestring):
+                XML = ''.join(XML)  # streamed
+            error = False
+        except:
+            dprint(__name__, 0, "Error replaying {0}\n{1}", record['path'], traceback.format_exc())
+            error = True
+        duration = time.time()-start
+
+        name = options.get('PlexConnectTemplate', options.get('PlexConnectRoute', '-'))
+        results.append((name, duration, error))
+
+
+
+def runReplay(requests, args):
+    queue = Queue.Queue()
+    for i in range(args.repeat):
+        for record in requests:
+            queue.put(record)
+
+    results = []
+    workers = [threading.Thread(target=runWorker, args=(queue, results)) for i in range(args.concurrency)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    duration = time.time()-start
+
+    return (results, duration)
+
+
+
+def printReport(results, duration, args):
+    byName = {}
+    for (name, latency, error) in results:
+        (latencies, errors) = byName.setdefault(name, ([], []))
+        latencies.append(latency)
+        if error:
+            errors.append(latency)
+
+    print
+    print "requests: %d, concurrency: %d, repeat: %d, duration: %.1fs, req/s: %.1f" % \
+          (len(results), args.concurrency, args.repeat, duration, len(results)/duration if duration else 0.0)
+    print "%-36s %8s %7s %9s %9s %9s %9s" % ('template', 'requests', 'errors', 'req/s', 'p50[ms]', 'p95[ms]', 'p99[ms]')
+    for name in sorted(byName, key=lambda name: -len(byName[name][0])):
+        (latencies, errors) = byName[name]
+        print "%-36s %8d %7d %9.1f %9.2f %9.2f %9.2f" % \
+              (name, len(latencies), len(errors), len(latencies)/duration if duration else 0.0, \
+               percentile(latencies, 50)*1000, percentile(latencies, 95)*1000, percentile(latencies, 99)*1000)
+
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='PlexConnect trace replay.')
+    parser.add_argument('trace_path', help='directory recorded with trace_path in Settings.cfg')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests worked on in parallel')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the trace this many times')
+    args = parser.parse_args()
+
+    cfg = Settings.CSettings()
+    param = {}
+    param['CSettings'] = cfg
+    param['CATVSettings'] = ATVSettings.CATVSettings()
+    param['IP_self'] = '127.0.0.1'
+    param['baseURL'] = 'http://127.0.0.1'
+    param['HostToIntercept'] = cfg.getSetting('hosttointercept')
+
+    XMLConverter.setParams(param)
+    XMLConverter.setATVSettings(param['CATVSettings'])
+
+    requests = getRequests(Trace.setReplay(args.trace_path))
+    (results, duration) = runReplay(requests, args)
+    printReport(results, duration, args)
@@ -14,11 +14,19 @@ Thanks to reaperhulk for showing this solution!
 
 
 import sys
+import os
 import string, cgi, time
+import traceback
 from os import sep, path
+import hashlib
+import itertools
+import zlib
+from email.utils import formatdate, parsedate_tz, mktime_tz
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
-from SocketServer import ThreadingMixIn
+import socket
 import ssl
+import threading
+import select, errno
 from multiprocessing import Pipe  # inter process communication
 import urllib
 import signal
@@ -26,9 +34,19 @@ import signal
 import Settings, ATVSettings
 from Debug import *  # dprint()
 import XMLConverter  # XML_PMS2aTV, XML_PlayVideo
+import PlexAPI  # CDeadline
 import re
 import Localize
 import Subtitle
+from ThreadPool import CThreadPool
+from Cache import CCache
+import AsyncWebServer
+import Stats
+import Router
+import Registry
+import Trace
+import HTTPPool
+import Discovery
 
 
 
@@ -36,6 +54,40 @@ g_param = {}
 def setParams(param):
     global g_param
     g_param = param
+    
+    # persistent connections: idle timeout, requests per connection
+    MyHandler.timeout = int(param['CSettings'].getSetting('webserver_keepalive_timeout'))
+    MyHandler.max_requests = int(param['CSettings'].getSetting('webserver_keepalive_max'))
+    
+    # static assets: memory budget, browser cache time
+    global g_StaticMaxAge
+    g_StaticCache.maxsize = int(param['CSettings'].getSetting('webserver_static_cachesize'))*1024*1024
+    g_StaticMaxAge = int(param['CSettings'].getSetting('webserver_static_maxage'))
+    
+    # response compression
+    global g_CompressLevel, g_CompressMinSize
+    g_CompressLevel = int(param['CSettings'].getSetting('webserver_compress_level'))
+    g_CompressMinSize = int(param['CSettings'].getSetting('webserver_compress_minsize'))
+    
+    # record aTV requests and PMS responses for TraceReplay.py
+    cfg_tracepath = param['CSettings'].getSetting('trace_path')
+    if cfg_tracepath.startswith('.'):
+        # relative to current path
+        cfg_tracepath = sys.path[0] + sep + cfg_tracepath
+    Trace.setPath(cfg_tracepath)
+    
+    # time budget per aTV request
+    global g_RequestDeadline
+    g_RequestDeadline = int(param['CSettings'].getSetting('webserver_request_deadline'))
+    
+    # keep-alive connections to PMS, plex.tv
+    HTTPPool.setParams(param)
+    
+    # PMS XML cache
+    PlexAPI.setParams(param)
+    
+    # PMS discovery in the background
+    Discovery.setParams(param)
 
 
 
@@ -55,8 +107,491 @@ def JSConverter(file, options):
 
 
 
+"""
+converted .js, per file, aTV language and baseURL - re-done if the file's mtime changes
+"""
+g_JSCache = CCache('js', 8*1024*1024)
+
+def getJS(file, options):
+    # returns (JS, etag, mtime)
+    filename = sys.path[0] + "/assets/js/" + file
+    try:
+        mtime = os.stat(filename).st_mtime
+    except OSError as e:
+        raise IOError(e.errno, e.strerror, filename)
+    
+    key = (file, options['aTVLanguage'], g_param['baseURL'])
+    entry = g_JSCache.get(key, lambda entry: entry[2]==mtime)
+    if entry is None:
+        JS = JSConverter(file, options)
+        entry = (JS, '"' + hashlib.md5(JS).hexdigest() + '"', mtime)
+        g_JSCache.set(key, entry, len(JS))
+    return entry
+
+
+
+"""
+handleRequest - decode aTV request, serve certificate, .js, images, subtitles and aTV XML
+shared by MyHandler (threaded) and AsyncWebServer (asyncore) front end
+
+parameters:
+    reqpath - path as received, including /PMS(...) address and query
+    headers - http request header (mimetools.Message)
+    client_address
+result:
+    (code, headers, data) - http status, list of (header, value), response body
+    code >= 400: data is the error message
+"""
+def handleRequest(reqpath, headers, client_address):
+    start = time.time()
+    try:
+        dprint(__name__, 2, "http request header:\n{0}", headers)
+        dprint(__name__, 2, "http request path:\n{0}", reqpath)
+        
+        # check for PMS address
+        PMSaddress = ''
+        pms_end = reqpath.find(')')
+        if reqpath.startswith('/PMS(') and pms_end>-1:
+            PMSaddress = urllib.unquote_plus(reqpath[5:pms_end])
+            reqpath = reqpath[pms_end+1:]
+        
+        # break up path, separate PlexConnect options
+        # clean path needed for filetype decoding
+        parts = re.split(r'[?&]', reqpath, 1)  # should be '?' only, but we do some things different :-)
+        if len(parts)==1:
+            reqpath = parts[0]
+            options = {}
+            query = ''
+        else:
+            reqpath = parts[0]
+            
+            # break up query string
+            options = {}
+            query = ''
+            parts = parts[1].split('&')
+            for part in parts:
+                if part.startswith('PlexConnect'):
+                    # get options[]
+                    opt = part.split('=', 1)
+                    if len(opt)==1:
+                        options[opt[0]] = ''
+                    else:
+                        options[opt[0]] = urllib.unquote(opt[1])
+                else:
+                    # recreate query string (non-PlexConnect) - has to be merged back when forwarded
+                    if query=='':
+                        query = '?' + part
+                    else:
+                        query += '&' + part
+        
+        # get aTV language setting
+        options['aTVLanguage'] = Localize.pickLanguage(headers.get('Accept-Language', 'en'))
+        
+        # add client address - to be used in case UDID is unknown
+        if 'X-Forwarded-For' in headers:
+            options['aTVAddress'] = headers['X-Forwarded-For'].split(',', 1)[0]
+        else:
+            options['aTVAddress'] = client_address[0]
+        
+        # get aTV hard-/software parameters
+        options['aTVFirmwareVersion'] = headers.get('X-Apple-TV-Version', '5.1')
+        options['aTVScreenResolution'] = headers.get('X-Apple-TV-Resolution', '720')
+        
+        # time budget - every PMS request only gets what is left, see PlexAPI.getTimeout()
+        options['aTVDeadline'] = PlexAPI.CDeadline(g_RequestDeadline, start)
+        
+        dprint(__name__, 2, "pms address:\n{0}", PMSaddress)
+        dprint(__name__, 2, "cleaned path:\n{0}", reqpath)
+        dprint(__name__, 2, "PlexConnect options:\n{0}", options)
+        dprint(__name__, 2, "additional arguments:\n{0}", query)
+        
+        # monitoring - any client, but only from the local network
+        if reqpath=='/metrics':
+            return serveMetrics(headers, client_address)
+        
+        if 'User-Agent' in headers and \
+           'AppleTV' in headers['User-Agent']:
+            
+            # recieve simple logging messages from the ATV
+            if 'PlexConnectATVLogLevel' in options:
+                dprint('ATVLogger', int(options['PlexConnectATVLogLevel']), options['PlexConnectLog'])
+                return (200, [('Content-type', 'text/plain')], '')
+                
+            # file type by route table, subtitles and everything else by PlexConnect command
+            route = g_Router.match(reqpath)
+            if route:
+                (name, serve) = (route.name, route.target)
+            elif options.get('PlexConnect')=='Subtitle':
+                (name, serve) = ('subtitle', serveSubtitle)
+            else:
+                (name, serve) = ('xml', serveXML)
+            
+            Trace.recordRequest(reqpath, query, PMSaddress, options, headers, name)
+            
+            Stats.gauge('requests_in_flight', 1)
+            try:
+                (code, resheaders, data) = serve(reqpath, query, PMSaddress, options, headers)
+            except:
+                Stats.gauge('requests_in_flight', -1)
+                raise
+            name = options.get('PlexConnectRoute', name)  # XMLConverter knows better
+            if isinstance(data, basestring):
+                Router.record(name, time.time()-start)
+                Stats.gauge('requests_in_flight', -1)
+            else:
+                data = recordStream(data, name, start)  # streamed - done when the last chunk is out
+            return (code, resheaders, data)
+        
+        else:
+            return (403, [], "Not Serving Client %s" % client_address[0])
+    except IOError:
+        return (404, [], "File Not Found: %s" % reqpath)
+
+
+
+"""
+serve* - route targets of handleRequest()
+
+parameters:
+    reqpath - cleaned path, PMS address and query removed
+    query - non-PlexConnect query string, to be forwarded to PMS
+    PMSaddress - from /PMS(...), '' if none
+    options - PlexConnect options
+    headers - request headers
+result:
+    (code, headers, data) - see handleRequest()
+"""
+def serveCER(reqpath, query, PMSaddress, options, headers):
+    # serve "*.cer" - Serve up certificate file to atv
+    dprint(__name__, 1, "serving *.cer: "+reqpath)
+    if g_param['CSettings'].getSetting('certfile').startswith('.'):
+        # relative to current path
+        cfg_certfile = sys.path[0] + sep + g_param['CSettings'].getSetting('certfile')
+    else:
+        # absolute path
+        cfg_certfile = g_param['CSettings'].getSetting('certfile')
+    cfg_certfile = path.normpath(cfg_certfile)
+    
+    cfg_certfile = path.splitext(cfg_certfile)[0] + '.cer'
+    try:
+        return serveStaticFile(cfg_certfile, 'text/xml', headers)
+    except IOError:
+        dprint(__name__, 0, "Failed to access certificate: {0}", cfg_certfile)
+        return (404, [], "File Not Found: %s" % reqpath)
+
+def serveJS(reqpath, query, PMSaddress, options, headers):
+    # serve .js files to aTV
+    # application, main: ignore path, send /assets/js/application.js
+    # otherwise: path should be '/js', send /assets/js/*.js
+    basename = path.basename(reqpath)
+    if basename in ("main.js", "javascript-packed.js", "bootstrap.js"):
+        basename = "application.js"
+    dprint(__name__, 1, "serving /js/{0}", basename)
+    (JS, etag, mtime) = getJS(basename, options)
+    return serveCached(JS, etag, mtime, 'text/javascript', headers, [('Cache-Control', 'no-cache'), ('Vary', 'Accept-Language')])
+
+def serveJPG(reqpath, query, PMSaddress, options, headers):
+    # serve "*.jpg" - thumbnails for old-style mainpage
+    dprint(__name__, 1, "serving *.jpg: "+reqpath)
+    return serveStaticFile(sys.path[0] + sep + "assets" + reqpath, 'image/jpeg', headers)
+
+def servePNG(reqpath, query, PMSaddress, options, headers):
+    # serve "*.png" - only png's support transparent colors
+    dprint(__name__, 1, "serving *.png: "+reqpath)
+    return serveStaticFile(sys.path[0] + sep + "assets" + reqpath, 'image/png', headers)
+
+def serveSubtitle(reqpath, query, PMSaddress, options, headers):
+    # serve subtitle file - transcoded to aTV subtitle json
+    dprint(__name__, 1, "serving subtitle: "+reqpath)
+    try:
+        XML = Subtitle.getSubtitleJSON(PMSaddress, reqpath + query, options)
+    except PlexAPI.DeadlineExceeded:
+        return (504, [], "Subtitle Timed Out: %s" % reqpath)
+    if XML==False:
+        return (404, [], "Subtitle Not Found: %s" % reqpath)
+    return compressResponse(headers, 200, [('Content-type', 'application/json')], XML)
+
+def serveXML(reqpath, query, PMSaddress, options, headers):
+    # get everything else from XMLConverter - formerly limited to trailing "/" and &PlexConnect Cmds
+    dprint(__name__, 1, "serving .xml: "+reqpath)
+    try:
+        XML = XMLConverter.XML_PMS2aTV(PMSaddress, reqpath + query, options)
+        if not isinstance(XML, basestring):
+            # streamed, see XMLConverter.XML_StreamTree()
+            # 1st chunk rendered before anything is sent - out of time up to here: still XML_Error
+            chunks = joinChunks(XML, g_StreamChunkSize)
+            first = next(chunks, '')
+            XML = itertools.chain([first], chunks)
+    except PlexAPI.DeadlineExceeded:
+        dprint(__name__, 0, "Out of time after {0}s: {1}", g_RequestDeadline, reqpath)
+        XML = XMLConverter.XML_Error('PlexConnect', 'No timely response from Plex Media Server')
+    return compressResponse(headers, 200, [('Content-type', 'text/xml')], XML)
+
+def serveMetrics(headers, client_address):
+    # Prometheus text format, see Stats.getPrometheusText()
+    if not isLANAddress(client_address[0]):
+        return (403, [], "Not Serving Client %s" % client_address[0])
+    return compressResponse(headers, 200, [('Content-type', 'text/plain; version=0.0.4'), ('Cache-Control', 'no-cache')], \
+                            Stats.getPrometheusText())
+
+def isLANAddress(ip):
+    # loopback, private (RFC 1918), link-local
+    try:
+        parts = [int(part) for part in ip.split('.')]
+    except ValueError:
+        return ip=='::1'
+    if len(parts)!=4:
+        return False
+    return parts[0] in (10, 127) or \
+           parts[0]==172 and 16<=parts[1]<=31 or \
+           parts[0]==192 and parts[1]==168 or \
+           parts[0]==169 and parts[1]==254
+
+g_Router = Router.CRouter('WebServer', [
+    ('cer'                  , 'suffix', '.cer'                  , serveCER),
+    ('application.js'       , 'suffix', '/application.js'       , serveJS),
+    ('main.js'              , 'suffix', '/main.js'              , serveJS),
+    ('javascript-packed.js' , 'suffix', '/javascript-packed.js' , serveJS),
+    ('bootstrap.js'         , 'suffix', '/bootstrap.js'         , serveJS),
+    ('js'                   , 'suffix', '.js'                   , serveJS, lambda reqpath: path.dirname(reqpath)=='/js'),
+    ('jpg'                  , 'suffix', '.jpg'                  , serveJPG),
+    ('png'                  , 'suffix', '.png'                  , servePNG),
+    ])
+
+
+
+"""
+Streamed responses - data is a generator of strings instead of a string
+sent with "Transfer-Encoding: chunked", see MyHandler.sendResponse()
+"""
+g_RequestDeadline = 20  # [s]
+
+g_StreamChunkSize = 16384  # [bytes], collect small pieces of XML into chunks of this size
+
+def joinChunks(pieces, size):
+    buf = []
+    buflen = 0
+    for piece in pieces:
+        buf.append(piece)
+        buflen += len(piece)
+        if buflen>=size:
+            yield ''.join(buf)
+            buf = []
+            buflen = 0
+    if buf:
+        yield ''.join(buf)
+
+def recordStream(chunks, name, start):
+    try:
+        for chunk in chunks:
+            yield chunk
+        Router.record(name, time.time()-start)
+    finally:
+        Stats.gauge('requests_in_flight', -1)
+
+
+
+"""
+Static assets - certificate, thumbnails, fanart
+kept in memory, re-read if the file's mtime/size changes
+answered with ETag, Last-Modified - and 304 Not Modified if the aTV already has it
+"""
+g_StaticCache = CCache('static', 32*1024*1024)
+g_StaticMaxAge = 3600
+
+def getStaticFile(filename):
+    # returns (data, etag, mtime)
+    try:
+        st = os.stat(filename)
+    except OSError as e:
+        raise IOError(e.errno, e.strerror, filename)
+    
+    entry = g_StaticCache.get(filename, lambda entry: entry[2]==st.st_mtime and len(entry[0])==st.st_size)
+    if entry is None:
+        f = open(filename, "rb")
+        data = f.read()
+        f.close()
+        entry = (data, '"' + hashlib.md5(data).hexdigest() + '"', st.st_mtime)
+        g_StaticCache.set(filename, entry, len(data))
+    return entry
+
+def isNotModified(headers, etag, mtime):
+    # If-None-Match takes precedence over If-Modified-Since
+    tags = headers.get('If-None-Match')
+    if tags is not None:
+        tags = [tag.strip() for tag in tags.split(',')]
+        return '*' in tags or etag in tags or 'W/'+etag in tags
+    
+    since = headers.get('If-Modified-Since')
+    if since:
+        since = parsedate_tz(since)
+        if since:
+            return mktime_tz(since) >= int(mtime)
+    return False
+
+def serveCached(data, etag, mtime, contenttype, headers, resheaders):
+    # 200 with validators or 304 Not Modified
+    resheaders = [('ETag', etag),
+                  ('Last-Modified', formatdate(mtime, usegmt=True))] + resheaders
+    if isNotModified(headers, etag, mtime):
+        return (304, resheaders, '')
+    return (200, [('Content-type', contenttype)] + resheaders, data)
+
+def serveStaticFile(filename, contenttype, headers):
+    (data, etag, mtime) = getStaticFile(filename)
+    return serveCached(data, etag, mtime, contenttype, headers, [('Cache-Control', 'max-age=%d' % g_StaticMaxAge)])
+
+
+
+"""
+Response compression - gzip/deflate for generated XML and JSON
+picked from the aTV's Accept-Encoding, identity if nothing suitable is advertised
+"""
+g_CompressLevel = 6  # 0: off
+g_CompressMinSize = 1024  # [bytes], smaller responses are sent as they are
+g_CompressChunkSize = 65536
+
+def pickEncoding(headers):
+    accepted = {}
+    for part in headers.get('Accept-Encoding', '').split(','):
+        parts = part.strip().split(';')
+        coding = parts[0].strip().lower()
+        q = 1.0
+        for param in parts[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if coding:
+            accepted[coding] = q
+    
+    for coding in ('gzip', 'deflate'):
+        if accepted.get(coding, accepted.get('*', 0.0)) > 0.0:
+            return coding
+    return ''  # identity
+
+def compressChunks(chunks, encoding, level, flush=False):
+    # streaming compressor - never holds a compressed and uncompressed copy of the full response
+    # flush: pass on every chunk right away (streamed response) instead of filling zlib's buffer
+    if encoding=='gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16+zlib.MAX_WBITS)  # gzip header/trailer
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)  # zlib format, HTTP 'deflate'
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if flush:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def splitChunks(data):
+    for pos in xrange(0, len(data), g_CompressChunkSize):
+        yield data[pos:pos+g_CompressChunkSize]
+
+def compressResponse(headers, code, resheaders, data):
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    
+    encoding = pickEncoding(headers)
+    streamed = not isinstance(data, str)
+    if g_CompressLevel==0 or \
+       not streamed and len(data)<g_CompressMinSize:  # size of streamed data unknown, compress anyway
+        encoding = ''
+    
+    resheaders = resheaders + [('Vary', 'Accept-Encoding')]
+    if encoding=='':
+        return (code, resheaders, data)
+    
+    if streamed:
+        data = compressChunks(data, encoding, g_CompressLevel, flush=True)
+    else:
+        data = ''.join(compressChunks(splitChunks(data), encoding, g_CompressLevel))
+    return (code, resheaders + [('Content-Encoding', encoding)], data)
+
+
+
 class MyHandler(BaseHTTPRequestHandler):
     
+    # HTTP/1.1 - keep connections to the aTV alive, every response sized by Content-Length
+    protocol_version = 'HTTP/1.1'
+    timeout = 15  # idle time on a persistent connection [s]
+    max_requests = 100  # requests served on one connection
+    wbufsize = -1  # buffer header and body, flushed after each request - no Nagle/delayed ACK stall
+    
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.requests_served = 0
+        self.parked = False
+    
+    def handle(self):
+        # like BaseHTTPRequestHandler.handle(), but return the worker between requests:
+        # connection kept alive and nothing pending - park it, see CKeepAlive
+        self.parked = False
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection and self.pending():
+            self.handle_one_request()  # pipelined, already read from the socket
+        self.parked = not self.close_connection
+    
+    def pending(self):
+        # request data buffered in rfile or the TLS layer - select() won't see it
+        if self.rfile._rbuf.tell()>0:
+            return True
+        return isinstance(self.connection, ssl.SSLSocket) and self.connection.pending()>0
+    
+    def finish(self):
+        pass  # connection closed by ThreadedHTTPServer.release_request() - or parked for the next request
+    
+    def close(self):
+        BaseHTTPRequestHandler.finish(self)
+    
+    def sendResponse(self, code, headers, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        
+        chunked = not isinstance(data, str)  # streamed
+        if chunked and self.request_version<'HTTP/1.1':
+            data = ''.join(data)  # no chunked transfer coding in HTTP/1.0
+            chunked = False
+        
+        self.requests_served += 1
+        
+        self.send_response(code)
+        for (keyword, value) in headers:
+            self.send_header(keyword, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        elif code!=304:  # Not Modified: no body
+            self.send_header('Content-Length', str(len(data)))
+        if self.requests_served>=self.max_requests:
+            self.send_header('Connection', 'close')  # sets close_connection
+        else:
+            self.send_header('Keep-Alive', 'timeout=%d, max=%d' % (self.timeout, self.max_requests-self.requests_served))
+        self.end_headers()
+        if chunked:
+            self.sendChunks(data)
+        else:
+            self.wfile.write(data)
+    
+    def sendChunks(self, chunks):
+        # every chunk goes out as soon as it is rendered
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+                    self.wfile.flush()
+        except socket.error:
+            raise
+        except:
+            dprint(__name__, 0, "Error while streaming response\n{0}", traceback.format_exc())
+            self.close_connection = 1  # response incomplete, status already sent - drop connection
+            return
+        self.wfile.write('0\r\n\r\n')
+    
     # Fixes slow serving speed under Windows
     def address_string(self):
       host, port = self.client_address[:2]
@@ -67,175 +602,370 @@ class MyHandler(BaseHTTPRequestHandler):
       pass
     
     def do_GET(self):
-        global g_param
+        (code, headers, data) = handleRequest(self.path, self.headers, self.client_address)
+        if code>=400:
+            self.send_error(code, data)
+        else:
+            self.sendResponse(code, headers, data)
+
+
+
+class CKeepAlive():
+    """Idle keep-alive connections of a ThreadedHTTPServer, watched by one thread.
+    A connection gets a worker again when its next request arrives - idle aTVs don't hold the pool."""
+    
+    def __init__(self, server):
+        self.server = server
+        self.lock = threading.Lock()
+        self.parked = {}  # fileno: (handler, parked since)
+        # wakeup for select() when a connection is parked - UDP, as socketpair() isn't there on Windows
+        self.wakeup = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.wakeup.bind(('127.0.0.1', 0))
+        self.wakeup.setblocking(0)
+        self.thread = threading.Thread(target=self.run, name='KeepAlive')
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def park(self, handler):
+        self.lock.acquire()
         try:
-            dprint(__name__, 2, "http request header:\n{0}", self.headers)
-            dprint(__name__, 2, "http request path:\n{0}", self.path)
-            
-            # check for PMS address
-            PMSaddress = ''
-            pms_end = self.path.find(')')
-            if self.path.startswith('/PMS(') and pms_end>-1:
-                PMSaddress = urllib.unquote_plus(self.path[5:pms_end])
-                self.path = self.path[pms_end+1:]
-            
-            # break up path, separate PlexConnect options
-            # clean path needed for filetype decoding
-            parts = re.split(r'[?&]', self.path, 1)  # should be '?' only, but we do some things different :-)
-            if len(parts)==1:
-                self.path = parts[0]
-                options = {}
-                query = ''
-            else:
-                self.path = parts[0]
-                
-                # break up query string
-                options = {}
-                query = ''
-                parts = parts[1].split('&')
-                for part in parts:
-                    if part.startswith('PlexConnect'):
-                        # get options[]
-                        opt = part.split('=', 1)
-                        if len(opt)==1:
-                            options[opt[0]] = ''
-                        else:
-                            options[opt[0]] = urllib.unquote(opt[1])
-                    else:
-                        # recreate query string (non-PlexConnect) - has to be merged back when forwarded
-                        if query=='':
-                            query = '?' + part
-                        else:
-                            query += '&' + part
-            
-            # get aTV language setting
-            options['aTVLanguage'] = Localize.pickLanguage(self.headers.get('Accept-Language', 'en'))
-            
-            # add client address - to be used in case UDID is unknown
-            if 'X-Forwarded-For' in self.headers:
-                options['aTVAddress'] = self.headers['X-Forwarded-For'].split(',', 1)[0]
-            else:
-                options['aTVAddress'] = self.client_address[0]
+            self.parked[handler.connection.fileno()] = (handler, time.time())
+        finally:
+            self.lock.release()
+        Stats.gauge('keepalive_parked', 1)
+        self.wakeup.sendto('!', self.wakeup.getsockname())
+    
+    def run(self):
+        while True:
+            self.lock.acquire()
+            try:
+                rlist = self.parked.keys()
+                oldest = min([since for (handler, since) in self.parked.values()] or [time.time()])
+            finally:
+                self.lock.release()
             
-            # get aTV hard-/software parameters
-            options['aTVFirmwareVersion'] = self.headers.get('X-Apple-TV-Version', '5.1')
-            options['aTVScreenResolution'] = self.headers.get('X-Apple-TV-Resolution', '720')
+            timeout = max(0.0, oldest+MyHandler.timeout-time.time()) if len(rlist) else None
+            try:
+                readable, writable, exceptional = select.select(rlist + [self.wakeup], [], [], timeout)
+            except select.error as e:
+                if e.args[0]==errno.EINTR:
+                    continue
+                raise
             
-            dprint(__name__, 2, "pms address:\n{0}", PMSaddress)
-            dprint(__name__, 2, "cleaned path:\n{0}", self.path)
-            dprint(__name__, 2, "PlexConnect options:\n{0}", options)
-            dprint(__name__, 2, "additional arguments:\n{0}", query)
+            if self.wakeup in readable:
+                try:
+                    while True:
+                        self.wakeup.recv(16)
+                except socket.error:
+                    pass  # drained
             
-            if 'User-Agent' in self.headers and \
-               'AppleTV' in self.headers['User-Agent']:
-                
-                # recieve simple logging messages from the ATV
-                if 'PlexConnectATVLogLevel' in options:
-                    dprint('ATVLogger', int(options['PlexConnectATVLogLevel']), options['PlexConnectLog'])
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/plain')
-                    self.end_headers()
-                    return
-                    
-                # serve "*.cer" - Serve up certificate file to atv
-                if self.path.endswith(".cer"):
-                    dprint(__name__, 1, "serving *.cer: "+self.path)
-                    if g_param['CSettings'].getSetting('certfile').startswith('.'):
-                        # relative to current path
-                        cfg_certfile = sys.path[0] + sep + g_param['CSettings'].getSetting('certfile')
+            # next request (or the aTV closed) - back to the pool. idle too long - close
+            resume = []
+            expired = []
+            now = time.time()
+            self.lock.acquire()
+            try:
+                for (fd, (handler, since)) in self.parked.items():
+                    if fd in readable:
+                        resume.append(handler)
+                    elif now-since>=MyHandler.timeout:
+                        expired.append(handler)
                     else:
-                        # absolute path
-                        cfg_certfile = g_param['CSettings'].getSetting('certfile')
-                    cfg_certfile = path.normpath(cfg_certfile)
-                    
-                    cfg_certfile = path.splitext(cfg_certfile)[0] + '.cer'
-                    try:
-                        f = open(cfg_certfile, "rb")
-                    except:
-                        dprint(__name__, 0, "Failed to access certificate: {0}", cfg_certfile)
-                        return
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/xml')
-                    self.end_headers()
-                    self.wfile.write(f.read())
-                    f.close()
-                    return 
-                
-                # serve .js files to aTV
-                # application, main: ignore path, send /assets/js/application.js
-                # otherwise: path should be '/js', send /assets/js/*.js
-                dirname = path.dirname(self.path)
-                basename = path.basename(self.path)
-                if basename in ("application.js", "main.js", "javascript-packed.js", "bootstrap.js") or \
-                   basename.endswith(".js") and dirname == '/js':
-                    if basename in ("main.js", "javascript-packed.js", "bootstrap.js"):
-                        basename = "application.js"
-                    dprint(__name__, 1, "serving /js/{0}", basename)
-                    JS = JSConverter(basename, options)
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/javascript')
-                    self.end_headers()
-                    self.wfile.write(JS)
-                    return
-                
-                # serve "*.jpg" - thumbnails for old-style mainpage
-                if self.path.endswith(".jpg"):
-                    dprint(__name__, 1, "serving *.jpg: "+self.path)
-                    f = open(sys.path[0] + sep + "assets" + self.path, "rb")
-                    self.send_response(200)
-                    self.send_header('Content-type', 'image/jpeg')
-                    self.end_headers()
-                    self.wfile.write(f.read())
-                    f.close()
-                    return
-                
-                # serve "*.png" - only png's support transparent colors
-                if self.path.endswith(".png"):
-                    dprint(__name__, 1, "serving *.png: "+self.path)
-                    f = open(sys.path[0] + sep + "assets" + self.path, "rb")
-                    self.send_response(200)
-                    self.send_header('Content-type', 'image/png')
-                    self.end_headers()
-                    self.wfile.write(f.read())
-                    f.close()
-                    return
-                
-                # serve subtitle file - transcoded to aTV subtitle json
-                if 'PlexConnect' in options and \
-                   options['PlexConnect']=='Subtitle':
-                    dprint(__name__, 1, "serving subtitle: "+self.path)
-                    XML = Subtitle.getSubtitleJSON(PMSaddress, self.path + query, options)
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(XML)
-                    return
-                
-                # get everything else from XMLConverter - formerly limited to trailing "/" and &PlexConnect Cmds
-                if True:
-                    dprint(__name__, 1, "serving .xml: "+self.path)
-                    XML = XMLConverter.XML_PMS2aTV(PMSaddress, self.path + query, options)
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/xml')
-                    self.end_headers()
-                    self.wfile.write(XML)
-                    return
-                
-                """
-                # unexpected request
-                self.send_error(403,"Access denied: %s" % self.path)
-                """
+                        continue
+                    del self.parked[fd]
+            finally:
+                self.lock.release()
+            Stats.gauge('keepalive_parked', -len(resume)-len(expired))
             
-            else:
-                self.send_error(403,"Not Serving Client %s" % self.client_address[0])
-        except IOError:
-            self.send_error(404,"File Not Found: %s" % self.path)
+            for handler in resume:
+                if not self.server.pool.submit(self.server.resume_request, handler):
+                    handler.close()
+                    self.server.reject_request(handler.request, handler.client_address)
+            for handler in expired:
+                self.server.release_request(handler, keepalive=False)
 
 
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    """Handle requests in a separate thread."""
+class ThreadedHTTPServer(HTTPServer):
+    """Handle requests in a fixed pool of worker threads, reject if the queue is full.
+    Between requests, keep-alive connections wait in CKeepAlive - not in a worker."""
+    
+    sslcontext = None  # HTTPS: ssl.SSLContext (or CLegacySSLContext), handshake done by the worker
+    
+    def __init__(self, server_address, RequestHandlerClass, pool, sockopts=[]):
+        self.sockopts = sockopts  # needed by server_bind(), called from HTTPServer.__init__()
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        self.pool = pool
+        self.keepalive = CKeepAlive(self)
+    
+    def server_bind(self):
+        for (level, option, value) in self.sockopts:
+            self.socket.setsockopt(level, option, value)
+        HTTPServer.server_bind(self)
+    
+    def process_request(self, request, client_address):
+        if not self.pool.submit(self.process_request_thread, request, client_address):
+            self.reject_request(request, client_address)
+    
+    def process_request_thread(self, request, client_address):
+        if self.sslcontext:
+            request = self.handshake(request, client_address)
+            if request is None:
+                return
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        self.release_request(handler)
+    
+    def resume_request(self, handler):
+        # next request on a parked keep-alive connection
+        try:
+            handler.handle()
+        except:
+            handler.parked = False
+            self.handle_error(handler.request, handler.client_address)
+        self.release_request(handler)
+    
+    def release_request(self, handler, keepalive=True):
+        # worker done with the connection - park it until the next request, or close
+        if keepalive and handler.parked:
+            self.keepalive.park(handler)
+            return
+        handler.close()
+        self.shutdown_request(handler.request)
+    
+    def reject_request(self, request, client_address):
+        dprint(__name__, 0, "Overload - worker queue full, rejecting {0}", client_address[0])
+        body = 'PlexConnect busy - please retry'
+        try:
+            request.sendall('HTTP/1.1 503 Service Unavailable\r\n' + \
+                            'Content-Type: text/plain\r\n' + \
+                            'Content-Length: ' + str(len(body)) + '\r\n' + \
+                            'Retry-After: 1\r\n' + \
+                            'Connection: close\r\n\r\n' + body)
+        except socket.error:
+            pass
+        self.shutdown_request(request)
+    
+    def handshake(self, request, client_address):
+        # TLS handshake in the worker thread - a stalled aTV doesn't hold up the accept loop
+        # one SSLContext for all connections: its session cache/tickets let aTVs resume
+        start = time.time()
+        try:
+            request.settimeout(MyHandler.timeout)
+            conn = self.sslcontext.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, socket.error), e:
+            dprint(__name__, 0, "TLS handshake failed with {0}: {1}", client_address[0], e)
+            Stats.count('ssl_handshake_errors')
+            self.shutdown_request(request)
+            return None
+        
+        Stats.addTiming('ssl_handshake', time.time()-start)
+        return conn
+
+
+
+"""
+SO_REUSEPORT - several WebServer workers listen on the same port, the kernel spreads connections
+not in Python 2's socket module on every platform - Linux: 15, None: not supported
+"""
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15 if sys.platform.startswith('linux') else None)
+
+def getSockOpts(param):
+    # socket options of the listening sockets
+    if param.get('WebServerWorkers', 1)>1:
+        return [(socket.SOL_SOCKET, SO_REUSEPORT, 1)]
+    return []
+
+
+
+def createPool(param):
+    cfg_threads = int(param['CSettings'].getSetting('webserver_threads'))
+    cfg_queuesize = int(param['CSettings'].getSetting('webserver_queuesize'))
+    return CThreadPool('WebServer', cfg_threads, cfg_queuesize)
+
+
+
+"""
+createServer, createSSLServer, createAsyncServer - listening socket for one port
+
+parameters:
+    param - PlexConnect parameters
+    port - port to listen on
+    pool - CThreadPool, shared by all listeners of one process. None: create own pool
+    map - asyncore channel map, shared by all async listeners of one loop (async only)
+result:
+    ThreadedHTTPServer or CAsyncHTTPServer
+"""
+def createServer(param, port, pool=None):
+    cfg_IP_WebServer = param['IP_self']
+    if pool is None:
+        pool = createPool(param)
+    return ThreadedHTTPServer((cfg_IP_WebServer,int(port)), MyHandler, pool, getSockOpts(param))
+
+def createSSLServer(param, port, pool=None):
+    if param['CSettings'].getSetting('certfile').startswith('.'):
+        # relative to current path
+        cfg_certfile = sys.path[0] + sep + param['CSettings'].getSetting('certfile')
+    else:
+        # absolute path
+        cfg_certfile = param['CSettings'].getSetting('certfile')
+    cfg_certfile = path.normpath(cfg_certfile)
+    
+    try:
+        certfile = open(cfg_certfile, 'r')
+    except:
+        raise IOError("Failed to access certificate: " + cfg_certfile)
+    certfile.close()
+    
+    if hasattr(ssl, 'SSLContext'):
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.load_cert_chain(cfg_certfile)
+        Stats.registerProvider(lambda: getSSLStats(context))
+        Stats.registerProvider(lambda: getSSLCounters(context), 'counter')
+    else:
+        dprint(__name__, 0, "Python {0}: no TLS session resumption, every aTV connection does a full handshake. Python 2.7.9 or later recommended.", sys.version.split()[0])
+        context = CLegacySSLContext(cfg_certfile)
+    
+    server = createServer(param, port, pool)
+    server.sslcontext = context  # listening socket stays plain, see ThreadedHTTPServer.handshake()
+    return server
+
+"""
+CLegacySSLContext - stand-in for ssl.SSLContext, not there before Python 2.7.9
+wrap_socket() like SSLContext's - one ssl.wrap_socket() per connection, no session cache
+"""
+class CLegacySSLContext():
+    def __init__(self, certfile):
+        self.certfile = certfile
+    
+    def wrap_socket(self, sock, server_side=False):
+        return ssl.wrap_socket(sock, server_side=server_side, certfile=self.certfile, ssl_version=ssl.PROTOCOL_SSLv23)
+
+def getSSLStats(context):
+    stats = context.session_stats()
+    return [ ('ssl_sessions_cached', {}, stats['number']) ]
+
+def getSSLCounters(context):
+    stats = context.session_stats()
+    return [ ('ssl_sessions_accepted', {}, stats['accept_good']),
+             ('ssl_sessions_resumed', {}, stats['hits']) ]
+
+def createAsyncServer(param, port, pool=None, map=None):
+    cfg_IP_WebServer = param['IP_self']
+    cfg_timeout = int(param['CSettings'].getSetting('webserver_keepalive_timeout'))
+    cfg_max_requests = int(param['CSettings'].getSetting('webserver_keepalive_max'))
+    if pool is None:
+        pool = createPool(param)
+    return AsyncWebServer.CAsyncHTTPServer((cfg_IP_WebServer,int(port)), handleRequest, pool, cfg_timeout, cfg_max_requests, map, getSockOpts(param))
+
+
+
+"""
+getListeners - listeners of the single process WebServer
+
+parameters:
+    cfg - CSettings
+result:
+    list of (scheme, port) - scheme: 'http' or 'https'
+"""
+def getListeners(cfg):
+    listeners = []
+    cfg_listeners = cfg.getSetting('webserver_listeners')
+    if cfg_listeners:
+        for listener in cfg_listeners.split(','):
+            (scheme, port) = listener.strip().split(':')
+            listeners.append((scheme, port))
+    else:
+        listeners.append(('http', cfg.getSetting('port_webserver')))
+        if cfg.getSetting('enable_webserver_ssl')=='True':
+            listeners.append(('https', cfg.getSetting('port_ssl')))
+    return listeners
+
+
+
+"""
+serve - event loop of the WebServer process
+
+wait for listening sockets and command pipe together,
+accept every pending connection per wakeup, leave immediately on 'shutdown'
+
+parameters:
+    servers - list of ThreadedHTTPServer
+    cmdPipe - connection to PlexConnect main process
+"""
+def serve(servers, cmdPipe):
+    listeners = {}
+    for server in servers:
+        server.socket.setblocking(0)
+        listeners[server.socket.fileno()] = server
+    
+    rlist = listeners.keys()
+    if sys.platform=='win32':
+        timeout = 1.0  # select() doesn't work on pipes, check cmdPipe once a second
+    else:
+        rlist.append(cmdPipe.fileno())
+        timeout = None
+    
+    while True:
+        # check commands - all of them, registry updates come in bursts
+        shutdown = False
+        while cmdPipe.poll():
+            cmd = cmdPipe.recv()
+            if cmd=='shutdown':
+                shutdown = True
+                break
+            Registry.receive(cmd)  # replica update
+        if shutdown:
+            break
+        
+        try:
+            readable, writable, exceptional = select.select(rlist, [], [], timeout)
+        except select.error as e:
+            if e.args[0]==errno.EINTR:
+                continue
+            raise
+        
+        for fd in readable:
+            if fd in listeners:
+                acceptAll(listeners[fd])
+
+def acceptAll(server):
+    # drain the listen queue, hand every connection to the worker pool
+    while True:
+        try:
+            request, client_address = server.get_request()
+        except socket.error as e:
+            if not e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                dprint(__name__, 0, "Failed to accept connection: {0}", e)
+            break
+        
+        request.setblocking(1)  # some platforms pass O_NONBLOCK on from the listening socket
+        if server.verify_request(request, client_address):
+            server.process_request(request, client_address)
+        else:
+            server.shutdown_request(request)
+
+
+
+"""
+initRegistry - PMS/aTVs known to PlexConnect (or before the restart), refreshed in the background
+
+parameters:
+    param - 'RegistrySnapshot', 'RegistryPipe': master copy, started by PlexConnect. otherwise: on its own, Registry.json
+    revalidate - look for the known aTVs' PMS again. one process is enough
+"""
+def initRegistry(param, revalidate):
+    if 'RegistrySnapshot' in param:
+        Registry.setReplica(param['RegistrySnapshot'], param['RegistryPipe'])
+    else:
+        Registry.g_Registry.load(Registry.getRegistryFile())
+    if revalidate:
+        for udid in Registry.g_Registry.getATVs():
+            Discovery.g_Discovery.request(udid, param['CATVSettings'].getSetting(udid, 'myplex_auth'))
 
 
 
@@ -247,9 +977,12 @@ def Run(cmdPipe, param):
     
     cfg_IP_WebServer = param['IP_self']
     cfg_Port_WebServer = param['CSettings'].getSetting('port_webserver')
+    cfg_frontend = param['CSettings'].getSetting('webserver_frontend')
     try:
-        server = ThreadedHTTPServer((cfg_IP_WebServer,int(cfg_Port_WebServer)), MyHandler)
-        server.timeout = 1
+        if cfg_frontend=='async':
+            server = createAsyncServer(param, cfg_Port_WebServer)
+        else:
+            server = createServer(param, cfg_Port_WebServer)
     except Exception, e:
         dprint(__name__, 0, "Failed to connect to HTTP on {0} port {1}: {2}", cfg_IP_WebServer, cfg_Port_WebServer, e)
         sys.exit(1)
@@ -257,29 +990,26 @@ def Run(cmdPipe, param):
     socketinfo = server.socket.getsockname()
     
     dprint(__name__, 0, "***")
-    dprint(__name__, 0, "WebServer: Serving HTTP on {0} port {1}.", socketinfo[0], socketinfo[1])
+    dprint(__name__, 0, "WebServer: Serving HTTP on {0} port {1} ({2}).", socketinfo[0], socketinfo[1], cfg_frontend)
     dprint(__name__, 0, "***")
     
     setParams(param)
     XMLConverter.setParams(param)
     XMLConverter.setATVSettings(param['CATVSettings'])
+    initRegistry(param, revalidate=True)
     
     try:
-        while True:
-            # check command
-            if cmdPipe.poll():
-                cmd = cmdPipe.recv()
-                if cmd=='shutdown':
-                    break
-            
-            # do your work (with timeout)
-            server.handle_request()
+        if cfg_frontend=='async':
+            AsyncWebServer.serve([server], cmdPipe)
+        else:
+            serve([server], cmdPipe)
     
     except KeyboardInterrupt:
         signal.signal(signal.SIGINT, signal.SIG_IGN)  # we heard you!
         dprint(__name__, 0,"^C received.")
     finally:
         dprint(__name__, 0, "Shutting down (HTTP).")
+        Stats.logStats()
         server.socket.close()
 
 
@@ -293,25 +1023,8 @@ def Run_SSL(cmdPipe, param):
     cfg_IP_WebServer = param['IP_self']
     cfg_Port_SSL = param['CSettings'].getSetting('port_ssl')
     
-    if param['CSettings'].getSetting('certfile').startswith('.'):
-        # relative to current path
-        cfg_certfile = sys.path[0] + sep + param['CSettings'].getSetting('certfile')
-    else:
-        # absolute path
-        cfg_certfile = param['CSettings'].getSetting('certfile')
-    cfg_certfile = path.normpath(cfg_certfile)
-    
-    try:
-        certfile = open(cfg_certfile, 'r')
-    except:
-        dprint(__name__, 0, "Failed to access certificate: {0}", cfg_certfile)
-        sys.exit(1)
-    certfile.close()
-    
     try:
-        server = ThreadedHTTPServer((cfg_IP_WebServer,int(cfg_Port_SSL)), MyHandler)
-        server.socket = ssl.wrap_socket(server.socket, certfile=cfg_certfile, server_side=True)
-        server.timeout = 1
+        server = createSSLServer(param, cfg_Port_SSL)
     except Exception, e:
         dprint(__name__, 0, "Failed to connect to HTTPS on {0} port {1}: {2}", cfg_IP_WebServer, cfg_Port_SSL, e)
         sys.exit(1)
@@ -325,27 +1038,84 @@ def Run_SSL(cmdPipe, param):
     setParams(param)
     XMLConverter.setParams(param)
     XMLConverter.setATVSettings(param['CATVSettings'])
+    initRegistry(param, revalidate=False)  # done by the HTTP process
     
     try:
-        while True:
-            # check command
-            if cmdPipe.poll():
-                cmd = cmdPipe.recv()
-                if cmd=='shutdown':
-                    break
-            
-            # do your work (with timeout)
-            server.handle_request()
+        serve([server], cmdPipe)
     
     except KeyboardInterrupt:
         signal.signal(signal.SIGINT, signal.SIG_IGN)  # we heard you!
         dprint(__name__, 0,"^C received.")
     finally:
         dprint(__name__, 0, "Shutting down (HTTPS).")
+        Stats.logStats()
         server.socket.close()
 
 
 
+def Run_Multi(cmdPipe, param):
+    if not __name__ == '__main__':
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    dinit(__name__, param)  # init logging, WebServer process
+    
+    cfg_IP_WebServer = param['IP_self']
+    cfg_frontend = param['CSettings'].getSetting('webserver_frontend')
+    
+    # one worker pool, one set of caches for all listeners
+    pool = createPool(param)
+    map = {}
+    servers = []  # (scheme, server)
+    for (scheme, port) in getListeners(param['CSettings']):
+        try:
+            if scheme=='https':
+                server = createSSLServer(param, port, pool)
+            elif cfg_frontend=='async':
+                server = createAsyncServer(param, port, pool, map)
+            else:
+                server = createServer(param, port, pool)
+        except Exception, e:
+            dprint(__name__, 0, "Failed to connect to {0} on {1} port {2}: {3}", scheme.upper(), cfg_IP_WebServer, port, e)
+            for (scheme, server) in servers:
+                server.socket.close()
+            sys.exit(1)
+        servers.append((scheme, server))
+    
+    dprint(__name__, 0, "***")
+    for (scheme, server) in servers:
+        socketinfo = server.socket.getsockname()
+        dprint(__name__, 0, "WebServer: Serving {0} on {1} port {2} ({3}).", scheme.upper(), socketinfo[0], socketinfo[1], \
+               cfg_frontend if scheme=='http' else 'threaded')
+    dprint(__name__, 0, "***")
+    
+    setParams(param)
+    XMLConverter.setParams(param)
+    XMLConverter.setATVSettings(param['CATVSettings'])
+    initRegistry(param, revalidate=True)
+    
+    asyncServers = [server for (scheme, server) in servers if isinstance(server, AsyncWebServer.CAsyncHTTPServer)]
+    threadedServers = [server for (scheme, server) in servers if not server in asyncServers]
+    try:
+        if asyncServers:
+            # HTTPS stays with the threaded handler, its listener is watched by the asyncore loop
+            for server in threadedServers:
+                server.socket.setblocking(0)
+                AsyncWebServer.CListener(server.socket, lambda server=server: acceptAll(server), map)
+            AsyncWebServer.serve(asyncServers, cmdPipe)
+        else:
+            serve(threadedServers, cmdPipe)
+    
+    except KeyboardInterrupt:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # we heard you!
+        dprint(__name__, 0,"^C received.")
+    finally:
+        dprint(__name__, 0, "Shutting down (single process).")
+        Stats.logStats()
+        for (scheme, server) in servers:
+            server.socket.close()
+
+
+
 if __name__=="__main__":
     cmdPipe = Pipe()
     
@@ -362,3 +1132,5 @@ if __name__=="__main__":
         Run(cmdPipe[1], param)
     elif len(sys.argv)==2 and sys.argv[1]=='SSL':
         Run_SSL(cmdPipe[1], param)
+    elif len(sys.argv)==2 and sys.argv[1]=='Multi':
+        Run_Multi(cmdPipe[1], param)
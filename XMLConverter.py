@@ -36,8 +36,14 @@ import urlparse
 from Version import __VERSION__  # for {{EVAL()}}, display in settings page
 import Settings, ATVSettings
 import PlexAPI
+import Registry
 from Debug import *  # dprint(), prettyXML()
 import Localize
+import Router
+import Stats
+import SingleFlight
+import HTTPPool
+import Discovery
 
 import PILBackgrounds
 from PILBackgrounds import isPILinstalled
@@ -111,26 +117,220 @@ def XML_PlayVideo_ChannelsV1(baseURL, path):
 
 """
 global list of known aTVs - to look up UDID by IP if needed
+kept in Registry.g_Registry, shared by all WebServer workers
 
 parameters:
     udid - from options['PlexConnectUDID']
     ip - from client_address btw options['aTVAddress']
 """
-g_ATVList = {}
-
 def declareATV(udid, ip):
-    global g_ATVList
-    if udid in g_ATVList:
-        g_ATVList[udid]['ip'] = ip
-    else:
-        g_ATVList[udid] = {'ip': ip}
+    Registry.g_Registry.declareATV(udid, ip)
 
 def getATVFromIP(ip):
     # find aTV by IP, return UDID
-    for udid in g_ATVList:
-        if ip==g_ATVList[udid].get('ip', None):
-            return udid
-    return None  # IP not found
+    return Registry.g_Registry.getATVFromIP(ip)
+
+
+
+"""
+Route tables - XMLtemplate selection by PlexConnect Cmd, then by path
+compiled into hash/trie lookups by Router.CRouter, first match in table order wins
+
+route: (name, kind, key, (target, clearpath)[, check])
+    target - XMLtemplate or function(cmd, path, options, PMS_uuid, PMS_baseURL) -> (XMLtemplate, XML)
+             XML: complete answer to the aTV, no template to render
+    clearpath - True: we don't need PMS-XML
+"""
+def cmd_Play(cmd, path, options, PMS_uuid, PMS_baseURL):
+    opt = cmd[len('Play:'):]  # cut command:
+    parts = opt.split(':',1)
+    if len(parts)==2:
+        options['PlexConnectPlayType'] = parts[0]  # Single, Continuous # decoded in PlayVideo.xml, COPY_PLAYLIST
+        options['PlexConnectRatingKey'] = parts[1]  # ratingKey # decoded in PlayVideo.xml
+    else:
+        return ('', XML_Error('PlexConnect','Unexpected "Play" command syntax'))
+    return ('PlayVideo.xml', None)
+
+def cmd_PlayAudio(cmd, path, options, PMS_uuid, PMS_baseURL):
+    # PlayAudio: or PlayAudio_plist:
+    parts = cmd.split(':',3)
+    if len(parts)==4:
+        options['PlexConnectPlayType'] = parts[1]  # Single, Continuous # decoded in PlayAudio.xml
+        options['PlexConnectRatingKey'] = parts[2]  # ratingKey
+        options['PlexConnectCopyIx'] = parts[3]  # copy_ix
+    else:
+        return ('', XML_Error('PlexConnect','Unexpected "PlayAudio" command syntax'))
+    return (parts[0] + '.xml', None)
+
+def cmd_PlayVideo_ChannelsV1(cmd, path, options, PMS_uuid, PMS_baseURL):
+    dprint(__name__, 1, "playing Channels XML Version 1: {0}".format(path))
+    auth_token = PlexAPI.getPMSProperty(options['PlexConnectUDID'], PMS_uuid, 'accesstoken')
+    path = PlexAPI.getDirectVideoPath(path, auth_token)
+    return ('', XML_PlayVideo_ChannelsV1(PMS_baseURL, path))  # direct link, no PMS XML available
+
+def cmd_PlayTrailer(cmd, path, options, PMS_uuid, PMS_baseURL):
+    trailerID = options['PlexConnectTrailerID']
+    info = HTTPPool.urlopen("http://youtube.com/get_video_info?video_id=" + trailerID).read()
+    parsed = urlparse.parse_qs(info)
+    
+    key = 'url_encoded_fmt_stream_map'
+    if not key in parsed:
+        return ('', XML_Error('PlexConnect', 'Youtube: No Trailer Info available'))
+    streams = parsed[key][0].split(',')
+    
+    url = ''
+    for i in range(len(streams)):
+        stream = urlparse.parse_qs(streams[i])
+        if stream['itag'][0] == '18':
+            url = stream['url'][0]
+    if url == '':
+        return ('', XML_Error('PlexConnect','Youtube: ATV compatible Trailer not available'))
+    
+    return ('', XML_PlayVideo_ChannelsV1('', url.replace('&','&amp;')))
+
+def useFanart(options, setting):
+    return g_ATVSettings.getSetting(options['PlexConnectUDID'], setting) == 'Show' and \
+           isPILinstalled() and \
+           options['aTVFirmwareVersion'] >= '6.0'  # watch out: this will make trouble with iOS10
+
+def cmd_MoviePrePlay(cmd, path, options, PMS_uuid, PMS_baseURL):
+    if useFanart(options, 'moviefanart'):
+        return ('MoviePrePlay_Fanart.xml', None)
+    return ('MoviePrePlay.xml', None)
+
+def cmd_EpisodePrePlay(cmd, path, options, PMS_uuid, PMS_baseURL):
+    if useFanart(options, 'tvshowfanart'):
+        return ('EpisodePrePlay_Fanart.xml', None)
+    return ('EpisodePrePlay.xml', None)
+
+def cmd_SectionPreview(cmd, path, options, PMS_uuid, PMS_baseURL):
+    return (cmd + '.xml', None)
+
+def cmd_AllMovies(cmd, path, options, PMS_uuid, PMS_baseURL):
+    return ('Movie_'+g_ATVSettings.getSetting(options['PlexConnectUDID'], 'movieview').replace(' ','')+'.xml', None)
+
+def cmd_AllHomeVideos(cmd, path, options, PMS_uuid, PMS_baseURL):
+    return ('HomeVideo_'+g_ATVSettings.getSetting(options['PlexConnectUDID'], 'homevideoview').replace(' ','')+'.xml', None)
+
+def cmd_AllShows(cmd, path, options, PMS_uuid, PMS_baseURL):
+    return ('Show_'+g_ATVSettings.getSetting(options['PlexConnectUDID'], 'showview').replace(' ','')+'.xml', None)
+
+def cmd_SaveSettings(cmd, path, options, PMS_uuid, PMS_baseURL):
+    g_ATVSettings.saveSettings();
+    return ('', XML_Error('PlexConnect', 'SaveSettings!'))  # not an error - but aTV won't care anyways.
+
+def cmd_SettingsToggle(cmd, path, options, PMS_uuid, PMS_baseURL):
+    opt = cmd[len('SettingsToggle:'):]  # cut command:
+    parts = opt.split('+')
+    g_ATVSettings.toggleSetting(options['PlexConnectUDID'], parts[0].lower())
+    dprint(__name__, 2, "ATVSettings->Toggle: {0} in template: {1}", parts[0], parts[1])
+    return (parts[1] + ".xml", None)
+
+def cmd_MyPlexLogin(cmd, path, options, PMS_uuid, PMS_baseURL):
+    dprint(__name__, 2, "MyPlex->Logging In...")
+    if not 'PlexConnectCredentials' in options:
+        return ('', XML_Error('PlexConnect', 'MyPlex Sign In called without Credentials.'))
+    
+    UDID = options['PlexConnectUDID']
+    parts = options['PlexConnectCredentials'].split(':',1)        
+    (username, auth_token) = PlexAPI.MyPlexSignIn(parts[0], parts[1], options)
+    
+    g_ATVSettings.setSetting(UDID, 'myplex_user', username)
+    g_ATVSettings.setSetting(UDID, 'myplex_auth', auth_token)
+    return ('Settings.xml', None)
+
+def cmd_MyPlexLogout(cmd, path, options, PMS_uuid, PMS_baseURL):
+    dprint(__name__, 2, "MyPlex->Logging Out...")
+    
+    UDID = options['PlexConnectUDID']
+    auth_token = g_ATVSettings.getSetting(UDID, 'myplex_auth')
+    PlexAPI.MyPlexSignOut(auth_token)
+    
+    g_ATVSettings.setSetting(UDID, 'myplex_user', '')
+    g_ATVSettings.setSetting(UDID, 'myplex_auth', '')
+    return ('Settings.xml', None)
+
+def cmd_Discover(cmd, path, options, PMS_uuid, PMS_baseURL):
+    UDID = options['PlexConnectUDID']
+    auth_token = g_ATVSettings.getSetting(UDID, 'myplex_auth')
+    # done in the background - wait only if there is no usable list yet
+    Discovery.g_Discovery.request(UDID, auth_token, PlexAPI.getTimeout(options))
+    
+    return ('', XML_Error('PlexConnect', 'Discover!'))  # not an error - but aTV won't care anyways.
+
+def path_Channels(cmd, path, options, PMS_uuid, PMS_baseURL):
+    return ('Channel_'+g_ATVSettings.getSetting(options['PlexConnectUDID'], 'channelview')+'.xml', None)
+
+g_CmdRouter = Router.CRouter('cmd', [
+    ('ChannelsSearch'       , 'exact' , 'ChannelsSearch'        , ('ChannelsSearch.xml', True)),
+    ('Play'                 , 'prefix', 'Play:'                 , (cmd_Play, False)),
+    ('PlayAudio'            , 'prefix', 'PlayAudio'             , (cmd_PlayAudio, False)),
+    ('PlayVideo_ChannelsV1' , 'exact' , 'PlayVideo_ChannelsV1'  , (cmd_PlayVideo_ChannelsV1, False)),
+    ('PlayTrailer'          , 'exact' , 'PlayTrailer'           , (cmd_PlayTrailer, False)),
+    ('Plex_Video_Files_Scanner', 'exact', 'Plex_Video_Files_Scanner', ('HomeVideoSectionTopLevel.xml', False)),
+    ('Plex_Movie_Scanner'   , 'exact' , 'Plex_Movie_Scanner'    , ('MovieSectionTopLevel.xml', False)),
+    ('Plex_Series_Scanner'  , 'exact' , 'Plex_Series_Scanner'   , ('TVSectionTopLevel.xml', False)),
+    ('Plex_Photo_Scanner'   , 'exact' , 'Plex_Photo_Scanner'    , ('PhotoSectionTopLevel.xml', False)),
+    ('Plex_Music_Scanner'   , 'exact' , 'Plex_Music_Scanner'    , ('MusicSectionTopLevel.xml', False)),
+    ('ScrobbleMenu'         , 'exact' , 'ScrobbleMenu'          , ('ScrobbleMenu.xml', False)),
+    ('ScrobbleMenuVideo'    , 'exact' , 'ScrobbleMenuVideo'     , ('ScrobbleMenuVideo.xml', False)),
+    ('ScrobbleMenuTVOnDeck' , 'exact' , 'ScrobbleMenuTVOnDeck'  , ('ScrobbleMenuTVOnDeck.xml', False)),
+    ('ChangeShowArtwork'    , 'exact' , 'ChangeShowArtwork'     , ('ChangeShowArtwork.xml', False)),
+    ('ChangeSingleArtwork'  , 'exact' , 'ChangeSingleArtwork'   , ('ChangeSingleArtwork.xml', False)),
+    ('ChangeSingleArtworkVideo', 'exact', 'ChangeSingleArtworkVideo', ('ChangeSingleArtworkVideo.xml', False)),
+    ('ChangeFanart'         , 'exact' , 'ChangeFanart'          , ('ChangeFanArt.xml', False)),
+    ('ChangeFanartVideo'    , 'exact' , 'ChangeFanartVideo'     , ('ChangeFanArtVideo.xml', False)),
+    ('PhotoBrowser'         , 'exact' , 'PhotoBrowser'          , ('Photo_Browser.xml', False)),
+    ('MoviePreview'         , 'exact' , 'MoviePreview'          , ('MoviePreview.xml', False)),
+    ('HomeVideoPrePlay'     , 'exact' , 'HomeVideoPrePlay'      , ('HomeVideoPrePlay.xml', False)),
+    ('MoviePrePlay'         , 'exact' , 'MoviePrePlay'          , (cmd_MoviePrePlay, False)),
+    ('EpisodePrePlay'       , 'exact' , 'EpisodePrePlay'        , (cmd_EpisodePrePlay, False)),
+    ('ChannelPrePlay'       , 'exact' , 'ChannelPrePlay'        , ('ChannelPrePlay.xml', False)),
+    ('ChannelsVideo'        , 'exact' , 'ChannelsVideo'         , ('ChannelsVideo.xml', False)),
+    ('ShowByFolder'         , 'exact' , 'ShowByFolder'          , ('ShowByFolder.xml', False)),
+    ('HomeVideoByFolder'    , 'exact' , 'HomeVideoByFolder'     , ('HomeVideoByFolder.xml', False)),
+    ('HomeVideoDirectory'   , 'exact' , 'HomeVideoDirectory'    , ('HomeVideoDirectory.xml', False)),
+    ('MovieByFolder'        , 'exact' , 'MovieByFolder'         , ('MovieByFolder.xml', False)),
+    ('MovieDirectory'       , 'exact' , 'MovieDirectory'        , ('MovieDirectory.xml', False)),
+    ('MovieSection'         , 'exact' , 'MovieSection'          , ('MovieSection.xml', False)),
+    ('HomeVideoSection'     , 'exact' , 'HomeVideoSection'      , ('HomeVideoSection.xml', False)),
+    ('TVSection'            , 'exact' , 'TVSection'             , ('TVSection.xml', False)),
+    ('SectionPreview'       , 'contains', 'SectionPreview'      , (cmd_SectionPreview, False)),
+    ('AllMovies'            , 'exact' , 'AllMovies'             , (cmd_AllMovies, False)),
+    ('AllHomeVideos'        , 'exact' , 'AllHomeVideos'         , (cmd_AllHomeVideos, False)),
+    ('MovieSecondary'       , 'exact' , 'MovieSecondary'        , ('MovieSecondary.xml', False)),
+    ('AllShows'             , 'exact' , 'AllShows'              , (cmd_AllShows, False)),
+    ('TVSecondary'          , 'exact' , 'TVSecondary'           , ('TVSecondary.xml', False)),
+    ('PhotoSecondary'       , 'exact' , 'PhotoSecondary'        , ('PhotoSecondary.xml', False)),
+    ('MusicSecondary'       , 'exact' , 'MusicSecondary'        , ('MusicSecondary.xml', False)),
+    ('Directory'            , 'exact' , 'Directory'             , ('Directory.xml', False)),
+    ('DirectoryWithPreview' , 'exact' , 'DirectoryWithPreview'  , ('DirectoryWithPreview.xml', False)),
+    ('DirectoryWithPreviewActors', 'exact', 'DirectoryWithPreviewActors', ('DirectoryWithPreviewActors.xml', False)),
+    ('Playlists'            , 'exact' , 'Playlists'             , ('Playlists.xml', False)),
+    ('Playlist_Video'       , 'exact' , 'Playlist_Video'        , ('Playlist_Video.xml', False)),
+    ('Playlist_Audio'       , 'exact' , 'Playlist_Audio'        , ('Playlist_Audio.xml', False)),
+    ('Settings'             , 'exact' , 'Settings'              , ('Settings.xml', True)),
+    ('SettingsVideoOSD'     , 'exact' , 'SettingsVideoOSD'      , ('Settings_VideoOSD.xml', True)),
+    ('SettingsMovies'       , 'exact' , 'SettingsMovies'        , ('Settings_Movies.xml', True)),
+    ('SettingsTVShows'      , 'exact' , 'SettingsTVShows'       , ('Settings_TVShows.xml', True)),
+    ('SettingsHomeVideos'   , 'exact' , 'SettingsHomeVideos'    , ('Settings_HomeVideos.xml', True)),
+    ('SettingsMusic'        , 'exact' , 'SettingsMusic'         , ('Settings_Music.xml', True)),
+    ('SettingsTopLevel'     , 'exact' , 'SettingsTopLevel'      , ('Settings_TopLevel.xml', True)),
+    ('SaveSettings'         , 'exact' , 'SaveSettings'          , (cmd_SaveSettings, False)),
+    ('SettingsToggle'       , 'prefix', 'SettingsToggle:'       , (cmd_SettingsToggle, True)),
+    ('MyPlexLogin'          , 'exact' , 'MyPlexLogin'           , (cmd_MyPlexLogin, True)),
+    ('MyPlexLogout'         , 'exact' , 'MyPlexLogout'          , (cmd_MyPlexLogout, True)),
+    ('Discover'             , 'prefix', 'Discover'              , (cmd_Discover, False)),
+    ])
+
+g_PathRouter = Router.CRouter('path', [
+    ('search'               , 'prefix', '/search?'              , ('Search_Results.xml', False)),
+    ('serviceSearch'        , 'contains', 'serviceSearch'       , ('ChannelsVideoSearchResults.xml', False)),
+    ('videoSearch'          , 'contains', 'video'               , ('ChannelsVideoSearchResults.xml', False), lambda path: path.lower().find('search') != -1),
+    ('SearchResults'        , 'contains', 'SearchResults'       , ('ChannelsVideoSearchResults.xml', False)),
+    ('sections'             , 'exact' , '/library/sections'     , ('Library.xml', False)),  # from PlexConnect.xml -> for //local, //myplex
+    ('channels'             , 'exact' , '/channels/all'         , (path_Channels, True)),
+    ])
 
 
 
@@ -140,6 +340,8 @@ def getATVFromIP(ip):
 # - receive reply from PMS
 # - select XML template
 # - translate to aTV XML
+# all PMS requests (incl. ADDXML, indirect VIDEOURL) share options['aTVDeadline']
+# out of time: PlexAPI.DeadlineExceeded, see WebServer.serveXML()
 """
 def XML_PMS2aTV(PMS_address, path, options):
     # double check aTV UDID, redo from client IP if needed/possible
@@ -185,283 +387,31 @@ def XML_PMS2aTV(PMS_address, path, options):
     PMSroot = None
     
     # XML direct request or
-    # XMLtemplate defined by solely PlexConnect Cmd
+    # XMLtemplate defined by PlexConnect Cmd or path - see g_CmdRouter, g_PathRouter
     if path.endswith(".xml"):
         XMLtemplate = path.lstrip('/')
         path = ''  # clear path - we don't need PMS-XML
+        options['PlexConnectRoute'] = 'template'
     
-    elif cmd=='ChannelsSearch':
-        XMLtemplate = 'ChannelsSearch.xml'
-        path = ''
-        
-    elif cmd.startswith('Play:'):
-        opt = cmd[len('Play:'):]  # cut command:
-        parts = opt.split(':',1)
-        if len(parts)==2:
-            options['PlexConnectPlayType'] = parts[0]  # Single, Continuous # decoded in PlayVideo.xml, COPY_PLAYLIST
-            options['PlexConnectRatingKey'] = parts[1]  # ratingKey # decoded in PlayVideo.xml
-        else:
-            return XML_Error('PlexConnect','Unexpected "Play" command syntax')
-        XMLtemplate = 'PlayVideo.xml'
-    
-    elif cmd.startswith('PlayAudio'):  # PlayAudio: or PlayAudio_plist:
-        parts = cmd.split(':',3)
-        if len(parts)==4:
-            XMLtemplate = parts[0] + '.xml'
-            options['PlexConnectPlayType'] = parts[1]  # Single, Continuous # decoded in PlayAudio.xml
-            options['PlexConnectRatingKey'] = parts[2]  # ratingKey
-            options['PlexConnectCopyIx'] = parts[3]  # copy_ix
+    else:
+        route = g_CmdRouter.match(cmd)
+        if route:
+            options['PlexConnectRoute'] = 'cmd/' + route.name
         else:
-            return XML_Error('PlexConnect','Unexpected "PlayAudio" command syntax')
-    
-    elif cmd=='PlayVideo_ChannelsV1':
-        dprint(__name__, 1, "playing Channels XML Version 1: {0}".format(path))
-        auth_token = PlexAPI.getPMSProperty(UDID, PMS_uuid, 'accesstoken')
-        path = PlexAPI.getDirectVideoPath(path, auth_token)
-        return XML_PlayVideo_ChannelsV1(PMS_baseURL, path)  # direct link, no PMS XML available
-    
-    elif cmd=='PlayTrailer':
-        trailerID = options['PlexConnectTrailerID']
-        info = urllib2.urlopen("http://youtube.com/get_video_info?video_id=" + trailerID).read()
-        parsed = urlparse.parse_qs(info)
-        
-        key = 'url_encoded_fmt_stream_map'
-        if not key in parsed:
-            return XML_Error('PlexConnect', 'Youtube: No Trailer Info available')
-        streams = parsed[key][0].split(',')
-        
-        url = ''
-        for i in range(len(streams)):
-            stream = urlparse.parse_qs(streams[i])
-            if stream['itag'][0] == '18':
-                url = stream['url'][0]
-        if url == '':
-            return XML_Error('PlexConnect','Youtube: ATV compatible Trailer not available')
-        
-        return XML_PlayVideo_ChannelsV1('', url.replace('&','&amp;'))
-
-    elif cmd=='Plex_Video_Files_Scanner':
-        XMLtemplate = 'HomeVideoSectionTopLevel.xml'
-
-    elif cmd=='Plex_Movie_Scanner':
-        XMLtemplate = 'MovieSectionTopLevel.xml'
-    
-    elif cmd=='Plex_Series_Scanner':
-        XMLtemplate = 'TVSectionTopLevel.xml'
-        
-    elif cmd=='Plex_Photo_Scanner':
-        XMLtemplate = 'PhotoSectionTopLevel.xml'
-
-    elif cmd=='Plex_Music_Scanner':
-        XMLtemplate = 'MusicSectionTopLevel.xml'
-    
-    elif cmd=='ScrobbleMenu':
-        XMLtemplate = 'ScrobbleMenu.xml'
-
-    elif cmd=='ScrobbleMenuVideo':
-        XMLtemplate = 'ScrobbleMenuVideo.xml'
-
-    elif cmd=='ScrobbleMenuTVOnDeck':
-        XMLtemplate = 'ScrobbleMenuTVOnDeck.xml'
-        
-    elif cmd=='ChangeShowArtwork':
-        XMLtemplate = 'ChangeShowArtwork.xml'
-
-    elif cmd=='ChangeSingleArtwork':
-        XMLtemplate = 'ChangeSingleArtwork.xml'
-
-    elif cmd=='ChangeSingleArtworkVideo':
-        XMLtemplate = 'ChangeSingleArtworkVideo.xml'
-
-    elif cmd=='ChangeFanart':
-        XMLtemplate = 'ChangeFanArt.xml'
-        
-    elif cmd=='ChangeFanartVideo':
-        XMLtemplate = 'ChangeFanArtVideo.xml'
-        
-    elif cmd=='PhotoBrowser':
-        XMLtemplate = 'Photo_Browser.xml'
-        
-    elif cmd=='MoviePreview':
-        XMLtemplate = 'MoviePreview.xml'
-    
-    elif cmd=='HomeVideoPrePlay':
-        XMLtemplate = 'HomeVideoPrePlay.xml'
-        
-    elif cmd=='MoviePrePlay':
-        XMLtemplate = "MoviePrePlay.xml"
-        if g_ATVSettings.getSetting(options['PlexConnectUDID'], 'moviefanart') == 'Show' and \
-           isPILinstalled() and \
-           options['aTVFirmwareVersion'] >= '6.0':  # watch out: this will make trouble with iOS10
-            XMLtemplate = 'MoviePrePlay_Fanart.xml'
-
-    elif cmd=='EpisodePrePlay':
-        XMLtemplate = 'EpisodePrePlay.xml'
-        if g_ATVSettings.getSetting(options['PlexConnectUDID'], 'tvshowfanart') == 'Show' and \
-           isPILinstalled() and \
-           options['aTVFirmwareVersion'] >= '6.0':  # watch out: this will make trouble with iOS10
-            XMLtemplate = 'EpisodePrePlay_Fanart.xml'
-        
-    elif cmd=='ChannelPrePlay':
-        XMLtemplate = 'ChannelPrePlay.xml'
-    
-    elif cmd=='ChannelsVideo':
-        XMLtemplate = 'ChannelsVideo.xml'
-
-    elif cmd=='ShowByFolder':
-        XMLtemplate = 'ShowByFolder.xml'
-
-    elif cmd=='HomeVideoByFolder':
-        XMLtemplate = 'HomeVideoByFolder.xml'
-
-    elif cmd == 'HomeVideoDirectory':
-        XMLtemplate = 'HomeVideoDirectory.xml'
-
-    elif cmd=='MovieByFolder':
-        XMLtemplate = 'MovieByFolder.xml'
-
-    elif cmd == 'MovieDirectory':
-        XMLtemplate = 'MovieDirectory.xml'
-
-    elif cmd == 'MovieSection':
-        XMLtemplate = 'MovieSection.xml'
-    
-    elif cmd == 'HomeVideoSection':
-        XMLtemplate = 'HomeVideoSection.xml'
-        
-    elif cmd == 'TVSection':
-        XMLtemplate = 'TVSection.xml'
-    
-    elif cmd.find('SectionPreview') != -1:
-        XMLtemplate = cmd + '.xml'
-    
-    elif cmd == 'AllMovies':
-        XMLtemplate = 'Movie_'+g_ATVSettings.getSetting(options['PlexConnectUDID'], 'movieview').replace(' ','')+'.xml'  
-    
-    elif cmd == 'AllHomeVideos':
-        XMLtemplate = 'HomeVideo_'+g_ATVSettings.getSetting(options['PlexConnectUDID'], 'homevideoview').replace(' ','')+'.xml'  
-        
-    elif cmd == 'MovieSecondary':
-        XMLtemplate = 'MovieSecondary.xml'
-    
-    elif cmd == 'AllShows':
-        XMLtemplate = 'Show_'+g_ATVSettings.getSetting(options['PlexConnectUDID'], 'showview').replace(' ','')+'.xml'  
-          
-    elif cmd == 'TVSecondary':
-        XMLtemplate = 'TVSecondary.xml'
-        
-    elif cmd == 'PhotoSecondary':
-        XMLtemplate = 'PhotoSecondary.xml'
-        
-    elif cmd == 'MusicSecondary':
-        XMLtemplate = 'MusicSecondary.xml'
-        
-    elif cmd == 'Directory':
-        XMLtemplate = 'Directory.xml'
-    
-    elif cmd == 'DirectoryWithPreview':
-        XMLtemplate = 'DirectoryWithPreview.xml'
-
-    elif cmd == 'DirectoryWithPreviewActors':
-        XMLtemplate = 'DirectoryWithPreviewActors.xml'
-    
-    elif cmd=='Playlists':
-        XMLtemplate = 'Playlists.xml'
-    
-    elif cmd=='Playlist_Video':
-        XMLtemplate = 'Playlist_Video.xml'
-    
-    elif cmd=='Playlist_Audio':
-        XMLtemplate = 'Playlist_Audio.xml'
-    
-    elif cmd=='Settings':
-        XMLtemplate = 'Settings.xml'
-        path = ''  # clear path - we don't need PMS-XML
-    
-    elif cmd=='SettingsVideoOSD':
-        XMLtemplate = 'Settings_VideoOSD.xml'
-        path = ''  # clear path - we don't need PMS-XML
-    
-    elif cmd=='SettingsMovies':
-        XMLtemplate = 'Settings_Movies.xml'
-        path = ''  # clear path - we don't need PMS-XML
-        
-    elif cmd=='SettingsTVShows':
-        XMLtemplate = 'Settings_TVShows.xml'
-        path = ''  # clear path - we don't need PMS-XML
- 
-    elif cmd=='SettingsHomeVideos':
-        XMLtemplate = 'Settings_HomeVideos.xml'
-        path = ''  # clear path - we don't need PMS-XML
-
-    elif cmd=='SettingsMusic':
-        XMLtemplate = 'Settings_Music.xml'
-        path = ''  # clear path - we don't need PMS-XML
-
-    elif cmd=='SettingsTopLevel':
-        XMLtemplate = 'Settings_TopLevel.xml'
-        path = ''  # clear path - we don't need PMS-XML
-        
-    elif cmd=='SaveSettings':
-        g_ATVSettings.saveSettings();
-        return XML_Error('PlexConnect', 'SaveSettings!')  # not an error - but aTV won't care anyways.
-        
-    elif cmd.startswith('SettingsToggle:'):
-        opt = cmd[len('SettingsToggle:'):]  # cut command:
-        parts = opt.split('+')
-        g_ATVSettings.toggleSetting(options['PlexConnectUDID'], parts[0].lower())
-        XMLtemplate = parts[1] + ".xml"
-        dprint(__name__, 2, "ATVSettings->Toggle: {0} in template: {1}", parts[0], parts[1])
-        
-        path = ''  # clear path - we don't need PMS-XML
-        
-    elif cmd==('MyPlexLogin'):
-        dprint(__name__, 2, "MyPlex->Logging In...")
-        if not 'PlexConnectCredentials' in options:
-            return XML_Error('PlexConnect', 'MyPlex Sign In called without Credentials.')
-        
-        parts = options['PlexConnectCredentials'].split(':',1)        
-        (username, auth_token) = PlexAPI.MyPlexSignIn(parts[0], parts[1], options)
-        
-        g_ATVSettings.setSetting(UDID, 'myplex_user', username)
-        g_ATVSettings.setSetting(UDID, 'myplex_auth', auth_token)
-        
-        XMLtemplate = 'Settings.xml'
-        path = ''  # clear path - we don't need PMS-XML
-    
-    elif cmd=='MyPlexLogout':
-        dprint(__name__, 2, "MyPlex->Logging Out...")
-        
-        auth_token = g_ATVSettings.getSetting(UDID, 'myplex_auth')
-        PlexAPI.MyPlexSignOut(auth_token)
-        
-        g_ATVSettings.setSetting(UDID, 'myplex_user', '')
-        g_ATVSettings.setSetting(UDID, 'myplex_auth', '')
-        
-        XMLtemplate = 'Settings.xml'
-        path = ''  # clear path - we don't need PMS-XML
-    
-    elif cmd.startswith('Discover'):
-        auth_token = g_ATVSettings.getSetting(UDID, 'myplex_auth')
-        PlexAPI.discoverPMS(UDID, g_param['CSettings'], auth_token)
-        
-        return XML_Error('PlexConnect', 'Discover!')  # not an error - but aTV won't care anyways.
-    
-    elif path.startswith('/search?'):
-        XMLtemplate = 'Search_Results.xml'
-    
-    elif path.find('serviceSearch') != -1 or (path.find('video') != -1 and path.lower().find('search') != -1):
-        XMLtemplate = 'ChannelsVideoSearchResults.xml'
-    
-    elif path.find('SearchResults') != -1:
-        XMLtemplate = 'ChannelsVideoSearchResults.xml'
-        
-    elif path=='/library/sections':  # from PlexConnect.xml -> for //local, //myplex
-        XMLtemplate = 'Library.xml'
-    
-    elif path=='/channels/all':
-        XMLtemplate = 'Channel_'+g_ATVSettings.getSetting(options['PlexConnectUDID'], 'channelview')+'.xml'
-        path = ''
+            route = g_PathRouter.match(path)
+            if route:
+                options['PlexConnectRoute'] = 'path/' + route.name
+        
+        if route:
+            (target, clearpath) = route.target
+            if isinstance(target, basestring):
+                XMLtemplate = target
+            else:
+                (XMLtemplate, XML) = target(cmd, path, options, PMS_uuid, PMS_baseURL)
+                if XML:
+                    return XML  # answered directly, no template
+            if clearpath:
+                path = ''  # clear path - we don't need PMS-XML
     
     # request PMS XML
     if not path=='':
@@ -478,6 +428,8 @@ def XML_PMS2aTV(PMS_address, path, options):
         PMSroot = PMS.getroot()
         
         dprint(__name__, 1, "viewGroup: "+PMSroot.get('viewGroup','None'))
+        if not 'PlexConnectRoute' in options:
+            options['PlexConnectRoute'] = 'viewGroup/' + PMSroot.get('viewGroup','None')
     
     # XMLtemplate defined by PMS XML content
     if path=='':
@@ -552,15 +504,55 @@ def XML_PMS2aTV(PMS_address, path, options):
         XMLtemplate = 'Directory.xml'
     
     dprint(__name__, 1, "XMLTemplate: "+XMLtemplate)
+    options['PlexConnectTemplate'] = XMLtemplate  # for TraceReplay.py
+
+    # identical render requests in flight (navbar preloads, retries): render once
+    key = getRenderKey(XMLtemplate, PMS_address, path, options)
+    (flight, leader) = g_RenderFlight.join(key)
+    if not leader:
+        deadline = options.get('aTVDeadline')
+        (ok, XML) = g_RenderFlight.wait(flight, deadline.remaining() if deadline else None)
+        if ok:
+            return XML
+        PlexAPI.getTimeout(options)  # timed out for good? - else leader failed, render ourselves
+        return XML_Render(XMLtemplate, cmd, channelsearchURL, options, PMSroot, PMS_address, path)
+    
+    try:
+        XML = XML_Render(XMLtemplate, cmd, channelsearchURL, options, PMSroot, PMS_address, path)
+    except:
+        g_RenderFlight.land(key, flight, False)
+        raise
+    if isinstance(XML, basestring):
+        g_RenderFlight.land(key, flight, True, XML)
+        return XML
+    return CSharedStream(XML, key, flight)
+
 
+
+"""
+render aTV XML from template and PMS XML
+
+result:
+    aTV XML - string, or generator of string parts if streamed (see isStreamable())
+"""
+def XML_Render(XMLtemplate, cmd, channelsearchURL, options, PMSroot, PMS_address, path):
     # get XMLtemplate
+    start = time.time()
     aTVTree = etree.parse(sys.path[0]+'/assets/templates/'+XMLtemplate)
     aTVroot = aTVTree.getroot()
+    Stats.addTiming('render', time.time()-start, phase='parse')
     
     # convert PMS XML to aTV XML using provided XMLtemplate
     CommandCollection = CCommandCollection(options, PMSroot, PMS_address, path)
+    
+    if not cmd=='ChannelsSearch' and isStreamable(XMLtemplate):
+        # send finished parts while the rest is expanded
+        return XML_TimedStream(CommandCollection, XML_StreamTree(CommandCollection, aTVroot, PMSroot, 'main'))
+    
+    start = time.time()
     XML_ExpandTree(CommandCollection, aTVroot, PMSroot, 'main')
     XML_ExpandAllAttrib(CommandCollection, aTVroot, PMSroot, 'main')
+    Stats.addTiming('render', time.time()-start, phase='expand')
     del CommandCollection
     
     if cmd=='ChannelsSearch':
@@ -574,7 +566,100 @@ def XML_PMS2aTV(PMS_address, path, options):
     dprint(__name__, 1, aTVroot)
     dprint(__name__, 1, "====== aTV-XML finished ======")
     
-    return etree.tostring(aTVroot)
+    start = time.time()
+    XML = etree.tostring(aTVroot)
+    Stats.addTiming('render', time.time()-start, phase='serialize')
+    return XML
+
+
+
+"""
+render request coalescing
+
+key: only what the aTV XML depends on - aTVs with the same settings and servers share the render
+- template, PMS, path (incl. query)
+- request options: aTV language/firmware/resolution, PlexConnect commands from the URL
+- aTV settings
+- the aTV's PMS list: baseURL, access token - PMS XML, image URLs, multi PMS pages
+- transcoder templates only: aTV UDID, name - session and device info in the URL, see isDeviceSpecific()
+PMS XML: fetched for the same path, see PlexAPI.g_PMSFlight.
+streamed: the first request streams, the others get the complete XML when done.
+"""
+g_RenderFlight = SingleFlight.CSingleFlight('render')
+
+g_RenderOptions = ('aTVLanguage', 'aTVFirmwareVersion', 'aTVScreenResolution')
+g_DeviceOptions = ('PlexConnectUDID', 'PlexConnectATVName')
+
+def getRenderKey(XMLtemplate, PMS_address, path, options):
+    UDID = options['PlexConnectUDID']
+    opts = tuple(sorted((key, value) for (key, value) in options.items() \
+                        if key in g_RenderOptions or \
+                           key.startswith('PlexConnect') and not key in g_DeviceOptions and isinstance(value, basestring)))
+    settings = tuple(sorted(g_ATVSettings.getSettings(UDID).items()))
+    servers = tuple(sorted((PMS_uuid, PMS.get('baseURL'), PMS.get('accesstoken')) for (PMS_uuid, PMS) in Registry.g_Registry.getPMSList(UDID).items()))
+    device = tuple(options.get(key) for key in g_DeviceOptions) if isDeviceSpecific(XMLtemplate) else None
+    return (XMLtemplate, PMS_address, path, opts, settings, servers, device)
+
+"""
+isDeviceSpecific - template builds transcoder URLs: session, X-Plex-Client-Identifier of the aTV
+
+parameters:
+    XMLtemplate - file name in assets/templates
+result:
+    True/False
+"""
+g_DeviceSpecific = {}  # XMLtemplate -> True/False
+
+def isDeviceSpecific(XMLtemplate):
+    if not XMLtemplate in g_DeviceSpecific:
+        try:
+            f = open(sys.path[0]+'/assets/templates/'+XMLtemplate, 'r')
+            template = f.read()
+            f.close()
+        except IOError:
+            return True
+        g_DeviceSpecific[XMLtemplate] = 'VIDEOURL(' in template or 'MUSICURL(' in template
+    return g_DeviceSpecific[XMLtemplate]
+
+class CSharedStream():
+    """Streamed render, shared with identical requests when complete.
+    The flight lands however the stream ends - done, failed, closed or dropped before it started
+    (a generator's finally doesn't run if it never started)."""
+    
+    def __init__(self, stream, key, flight):
+        self.stream = stream
+        self.key = key
+        self.flight = flight
+        self.parts = []
+        self.landed = False
+    
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        try:
+            part = self.stream.next()
+        except StopIteration:
+            self.land(True)
+            raise
+        except:
+            self.land(False)
+            raise
+        self.parts.append(part)
+        return part
+    
+    def close(self):
+        # aTV gone before the end: not shared, waiting requests render themselves
+        self.land(False)
+        self.stream.close()
+    
+    def __del__(self):
+        self.close()
+    
+    def land(self, ok):
+        if not self.landed:
+            self.landed = True
+            g_RenderFlight.land(self.key, self.flight, ok, ''.join(self.parts) if ok else None)
 
 
 
@@ -643,6 +728,8 @@ def XML_ExpandNode(CommandCollection, elem, child, src, srcXML, text_tail):
             try:
                 param = XML_ExpandLine(CommandCollection, src, srcXML, param)  # expand any attributes in the parameter
                 res = getattr(CommandCollection, 'TREE_'+cmd)(elem, child, src, srcXML, param)
+            except PlexAPI.DeadlineExceeded:
+                raise  # out of time - page fails as a whole, see WebServer.serveXML()
             except:
                 dprint(__name__, 0, "XML_ExpandNode - Error in cmd {0}, line {1}\n{2}", cmd, line, traceback.format_exc())
             
@@ -666,6 +753,15 @@ def XML_ExpandNode(CommandCollection, elem, child, src, srcXML, text_tail):
 
 
 def XML_ExpandAllAttrib(CommandCollection, elem, src, srcXML):
+    XML_ExpandAttrib(CommandCollection, elem, src, srcXML)
+    
+    # recurse into children
+    for el in elem:
+        XML_ExpandAllAttrib(CommandCollection, el, src, srcXML)
+
+
+
+def XML_ExpandAttrib(CommandCollection, elem, src, srcXML):
     # unpack template commands in elem.text
     line = elem.text
     if line!=None:
@@ -680,10 +776,140 @@ def XML_ExpandAllAttrib(CommandCollection, elem, src, srcXML):
     for attrib in elem.attrib:
         line = elem.get(attrib)
         elem.set(attrib, XML_ExpandLine(CommandCollection, src, srcXML, line.strip()))
-    
-    # recurse into children
-    for el in elem:
-        XML_ExpandAllAttrib(CommandCollection, el, src, srcXML)
+
+
+
+"""
+Streaming - serialize the aTV XML while it is expanded
+
+Children are expanded in order, each finished child is serialized and removed from the tree.
+Elements with children are "opened" (start tag sent), their children are streamed the same way.
+COPY into the streamed element is lazy: the copies are made one by one while they are sent.
+Output is identical to etree.tostring() of the fully expanded tree, as long as
+- the template doesn't use VAR, ADDXML or copy_* - they change what ATTRIB commands see
+  after the fact, in the non-streaming path attributes are expanded at the very end
+- tails of opened elements don't hold commands - they could remove an already sent element
+
+isStreamable - check template
+parameters:
+    XMLtemplate - file name in assets/templates
+result:
+    True/False
+"""
+g_Streamable = {}  # XMLtemplate -> True/False
+
+def isStreamable(XMLtemplate):
+    if not XMLtemplate in g_Streamable:
+        try:
+            f = open(sys.path[0]+'/assets/templates/'+XMLtemplate, 'r')
+            template = f.read()
+            f.close()
+        except IOError:
+            return False
+        g_Streamable[XMLtemplate] = not ('VAR(' in template or 'ADDXML(' in template or 'copy_' in template)
+    return g_Streamable[XMLtemplate]
+
+
+
+"""
+XML_StreamTree - expand and serialize aTV XML
+
+parameters:
+    CommandCollection, elem, src, srcXML - see XML_ExpandTree()
+    depth - levels of elements to open, below: expand and send as a whole
+result:
+    generator of XML strings
+"""
+def XML_StreamTree(CommandCollection, elem, src, srcXML, depth=8):
+    XML_ExpandAttrib(CommandCollection, elem, src, srcXML)
+    start = XML_StartTag(elem)
+    opened = False
+    if elem.text:
+        yield start
+        opened = True
+    for XML in XML_StreamChildren(CommandCollection, elem, src, srcXML, depth):
+        if not opened:
+            yield start
+            opened = True
+        yield XML
+    if opened:
+        yield '</' + elem.tag + '>' + XML_Escape(elem.tail)
+    else:
+        yield start[:-1] + ' />' + XML_Escape(elem.tail)  # empty after all, like etree.tostring()
+
+def XML_StreamChildren(CommandCollection, elem, src, srcXML, depth):
+    while len(elem):
+        child = elem[0]
+        
+        # lazy COPY: make, send and forget one copy after the other
+        if child.tag=='__STREAMCOPY__':
+            for el in CommandCollection.streamCopies.pop(id(child)):
+                if el.tag=='__COPY__':
+                    for el_child in el:
+                        yield XML_Serialize(CommandCollection, el_child)
+                else:
+                    yield XML_Serialize(CommandCollection, el)
+            elem.remove(child)
+            continue
+        
+        # like XML_ExpandTree() - but 1st child only, finished children are gone
+        CommandCollection.streamElem = elem
+        res = XML_ExpandNode(CommandCollection, elem, child, src, srcXML, 'TEXT')
+        CommandCollection.streamElem = None
+        if res==True:  # tree modified: restart from 1st elem
+            continue
+        
+        if depth>0 and len(child) and not '{{' in (child.tail or ''):
+            for XML in XML_StreamTree(CommandCollection, child, src, srcXML, depth-1):
+                yield XML
+            elem.remove(child)
+            continue
+        
+        XML_ExpandTree(CommandCollection, child, src, srcXML)
+        
+        res = XML_ExpandNode(CommandCollection, elem, child, src, srcXML, 'TAIL')
+        if res==True:  # tree modified: restart from 1st elem
+            continue
+        
+        XML_ExpandAllAttrib(CommandCollection, child, src, srcXML)
+        yield XML_Serialize(CommandCollection, child)
+        elem.remove(child)
+
+def XML_Serialize(CommandCollection, elem):
+    start = time.time()
+    XML = etree.tostring(elem)
+    CommandCollection.serializeTime += time.time()-start
+    return XML
+
+def XML_TimedStream(CommandCollection, pieces):
+    # render time = time spent in the generator, not waiting for the aTV to take the data
+    busy = 0.0
+    while True:
+        start = time.time()
+        try:
+            XML = pieces.next()
+        except StopIteration:
+            break
+        busy += time.time()-start
+        yield XML
+    busy += time.time()-start
+    Stats.addTiming('render', busy-CommandCollection.serializeTime, phase='expand')
+    Stats.addTiming('render', CommandCollection.serializeTime, phase='serialize')
+
+def XML_StartTag(elem):
+    # serialize start tag and text, same escaping as etree.tostring()
+    el = etree.Element(elem.tag, elem.attrib)
+    el.text = elem.text
+    etree.SubElement(el, '_')
+    XML = etree.tostring(el)
+    return XML[:XML.rfind('<_ />')]
+
+def XML_Escape(text):
+    if not text:
+        return ''
+    el = etree.Element('_')
+    el.text = text
+    return etree.tostring(el)[len('<_>'):-len('</_>')]
 
 
 
@@ -717,6 +943,8 @@ def XML_ExpandLine(CommandCollection, src, srcXML, line):
                 res = getattr(CommandCollection, 'ATTRIB_'+cmd)(src, srcXML, param)
                 line = line[:cmd_start] + res + line[cmd_end+2:]
                 pos = cmd_start+len(res)
+            except PlexAPI.DeadlineExceeded:
+                raise  # out of time - page fails as a whole, see WebServer.serveXML()
             except:
                 dprint(__name__, 0, "XML_ExpandLine - Error in {0}\n{1}", line, traceback.format_exc())
                 line = line[:cmd_start] + "((ERROR:"+cmd+"))" + line[cmd_end+2:]
@@ -751,10 +979,20 @@ class CCommandHelper():
         
         self.ATV_udid = options['PlexConnectUDID']
         self.PMS_uuid = PlexAPI.getPMSFromAddress(self.ATV_udid, PMS_address)
-        self.PMS_baseURL = PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, 'baseURL')
+        self.PMS = PlexAPI.getPMSProperties(self.ATV_udid, self.PMS_uuid)  # snapshot for this request
+        self.PMS_baseURL = self.getPMSProperty('baseURL')
         self.variables = {}
+        
+        # streaming, see XML_StreamTree()
+        self.streamElem = None  # element currently streamed - COPY into it is done lazily
+        self.streamCopies = {}  # id(placeholder) -> generator of copies
+        self.serializeTime = 0.0  # [s], part of the stream's render time spent in etree.tostring()
     
     # internal helper functions
+    def getPMSProperty(self, tag):
+        # property of the default PMS
+        return self.PMS.get(tag, '')
+    
     def getParam(self, src, param):
         parts = param.split(':',1)
         param = parts[0]
@@ -789,7 +1027,7 @@ class CCommandHelper():
             elif parts[0].startswith('$'):  # setting
                 el = el.find(g_ATVSettings.getSetting(self.ATV_udid, parts[0][1:]))
             elif parts[0].startswith('%'):  # PMS property
-                el = el.find(PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, parts[0][1:]))
+                el = el.find(self.getPMSProperty(parts[0][1:]))
             else:
                 el = el.find(parts[0])
             attrib = parts[1]
@@ -802,7 +1040,7 @@ class CCommandHelper():
             res = g_ATVSettings.getSetting(self.ATV_udid, attrib[1:])
             dfltd = False
         elif attrib.startswith('%'):  # PMS property
-            res = PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, attrib[1:])
+            res = self.getPMSProperty(attrib[1:])
             dfltd = False
         elif attrib.startswith('^') and attrib[1:] in self.options:  # aTV property, http request options
             res = self.options[attrib[1:]]
@@ -912,35 +1150,8 @@ class CCommandCollection(CCommandHelper):
             if el==child:
                 break
         
-        # duplicate child and add to tree
-        cnt = 0
-        for elemSRC in src.findall(tag):
-            key = 'COPY'
-            if param_enbl!='':
-                key, leftover, dfltd = self.getKey(elemSRC, srcXML, param_enbl)
-                conv, leftover = self.getConversion(elemSRC, leftover)
-                if not dfltd:
-                    key = self.applyConversion(key, conv)
-            
-            if key:
-                self.PMSroot['copy_'+tag] = elemSRC
-                self.variables['copy_ix'] = str(cnt)
-                cnt = cnt+1
-                el = copy.deepcopy(child)
-                XML_ExpandTree(self, el, elemSRC, srcXML)
-                XML_ExpandAllAttrib(self, el, elemSRC, srcXML)
-                
-                if el.tag=='__COPY__':
-                    for el_child in list(el):
-                        elem.insert(ix, el_child)
-                        ix += 1
-                else:
-                    elem.insert(ix, el)
-                    ix += 1
-        
-        # remove template child
-        elem.remove(child)
-        return True  # tree modified, nodes updated: restart from 1st elem
+        copies = self.iterCopies(child, self.filterCopies(src.findall(tag), srcXML, param_enbl), tag, srcXML)
+        return self.insertCopies(elem, child, ix, copies)
     
     #syntax: Video, playType (Single|Continuous), key to match (^PlexConnectRatingKey), ratingKey
     def TREE_COPY_PLAYLIST(self, elem, child, src, srcXML, param):
@@ -987,16 +1198,43 @@ class CCommandCollection(CCommandHelper):
                 random.shuffle(elems)
                 elemsSRC = [elemsSRC[0]] + elems
         
-        # duplicate child and add to tree
+        copies = self.iterCopies(child, elemsSRC, tag, srcXML)
+        return self.insertCopies(elem, child, ix, copies)
+    
+    # COPY helpers
+    def filterCopies(self, elemsSRC, srcXML, param_enbl):
+        for elemSRC in elemsSRC:
+            key = 'COPY'
+            if param_enbl!='':
+                key, leftover, dfltd = self.getKey(elemSRC, srcXML, param_enbl)
+                conv, leftover = self.getConversion(elemSRC, leftover)
+                if not dfltd:
+                    key = self.applyConversion(key, conv)
+            
+            if key:
+                yield elemSRC
+    
+    def iterCopies(self, child, elemsSRC, tag, srcXML):
+        # duplicate child, expand each copy
         cnt = 0
         for elemSRC in elemsSRC:
-                self.PMSroot['copy_'+tag] = elemSRC
-                self.variables['copy_ix'] = str(cnt)
-                cnt = cnt+1
-                el = copy.deepcopy(child)
-                XML_ExpandTree(self, el, elemSRC, srcXML)
-                XML_ExpandAllAttrib(self, el, elemSRC, srcXML)
-                
+            self.PMSroot['copy_'+tag] = elemSRC
+            self.variables['copy_ix'] = str(cnt)
+            cnt = cnt+1
+            el = copy.deepcopy(child)
+            XML_ExpandTree(self, el, elemSRC, srcXML)
+            XML_ExpandAllAttrib(self, el, elemSRC, srcXML)
+            yield el
+    
+    def insertCopies(self, elem, child, ix, copies):
+        if elem is self.streamElem and not '{{' in (child.tail or ''):
+            # streaming: leave a placeholder, copies are made while they are sent
+            placeholder = etree.Element('__STREAMCOPY__')
+            self.streamCopies[id(placeholder)] = copies
+            elem.insert(ix, placeholder)
+        else:
+            # add to tree
+            for el in copies:
                 if el.tag=='__COPY__':
                     for el_child in list(el):
                         elem.insert(ix, el_child)
@@ -1043,7 +1281,7 @@ class CCommandCollection(CCommandHelper):
             type = self.PMS_address
             PMS = PlexAPI.getXMLFromMultiplePMS(self.ATV_udid, path, type, self.options)
         else:  # IP
-            auth_token = PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, 'accesstoken')
+            auth_token = self.getPMSProperty('accesstoken')
             PMS = PlexAPI.getXMLFromPMS(self.PMS_baseURL, path, self.options, auth_token)
         
         self.PMSroot[tag] = PMS.getroot()  # store additional PMS XML
@@ -1104,16 +1342,16 @@ class CCommandCollection(CCommandHelper):
         
         PMS_uuid = self.PMS_uuid
         PMS_baseURL = self.PMS_baseURL
+        AuthToken = self.getPMSProperty('accesstoken')
         cmd_start = key.find('PMS(')
         cmd_end = key.find(')', cmd_start)
         if cmd_start>-1 and cmd_end>-1 and cmd_end>cmd_start:
             PMS_address = key[cmd_start+4:cmd_end]
             PMS_uuid = PlexAPI.getPMSFromAddress(self.ATV_udid, PMS_address)
             PMS_baseURL = PlexAPI.getPMSProperty(self.ATV_udid, PMS_uuid, 'baseURL')
+            AuthToken = PlexAPI.getPMSProperty(self.ATV_udid, PMS_uuid, 'accesstoken')
             key = key[cmd_end+1:]
         
-        AuthToken = PlexAPI.getPMSProperty(self.ATV_udid, PMS_uuid, 'accesstoken')
-        
         # transcoder action
         transcoderAction = g_ATVSettings.getSetting(self.ATV_udid, 'phototranscoderaction')
         
@@ -1148,7 +1386,7 @@ class CCommandCollection(CCommandHelper):
     def ATTRIB_MUSICURL(self, src, srcXML, param):
         Track, leftover = self.getElement(src, srcXML, param)
         
-        AuthToken = PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, 'accesstoken')
+        AuthToken = self.getPMSProperty('accesstoken')
         
         if not Track:
             # not a complete audio/track structure - take key directly and build direct-play path
@@ -1195,7 +1433,7 @@ class CCommandCollection(CCommandHelper):
         key, leftover, dfltd = self.getKey(src, srcXML, param)
         
         # compare PMS_mark in PlexAPI/getXMLFromMultiplePMS()
-        PMS_mark = '/PMS(' + PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, 'ip') + ')'
+        PMS_mark = '/PMS(' + self.getPMSProperty('ip') + ')'
         
         # overwrite with URL embedded PMS address
         cmd_start = key.find('PMS(')
@@ -1231,7 +1469,7 @@ class CCommandCollection(CCommandHelper):
         partIndex, leftover, dfltd = self.getKey(src, srcXML, leftover)
         partIndex = int(partIndex) if partIndex else 0
         
-        AuthToken = PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, 'accesstoken')
+        AuthToken = self.getPMSProperty('accesstoken')
         
         if not Video:
             dprint(__name__, 0, "VIDEOURL - VIDEO element not found: {0}", param)
@@ -1275,7 +1513,7 @@ class CCommandCollection(CCommandHelper):
                         '1080p 12.0Mbps' :('1920x1080', '90', '12000'), \
                         '1080p 20.0Mbps' :('1920x1080', '100', '20000'), \
                         '1080p 40.0Mbps' :('1920x1080', '100', '40000') }
-            if PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, 'local')=='1':
+            if self.getPMSProperty('local')=='1':
                 qLimits = qLookup[g_ATVSettings.getSetting(self.ATV_udid, 'transcodequality')]
             else:
                 qLimits = qLookup[g_ATVSettings.getSetting(self.ATV_udid, 'remotebitrate')]
@@ -1415,7 +1653,7 @@ class CCommandCollection(CCommandHelper):
         return str(PlexAPI.getPMSCount(self.ATV_udid))
     
     def ATTRIB_PMSNAME(self, src, srcXML, param):
-        PMS_name = PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, 'name')
+        PMS_name = self.getPMSProperty('name')
         if PMS_name=='':
             return "No Server in Proximity"
         else:
@@ -1431,7 +1669,7 @@ class CCommandCollection(CCommandHelper):
         else:  # internal path, add-on
             key = self.PMS_baseURL + self.path[srcXML] + key
         
-        auth_token = PlexAPI.getPMSProperty(self.ATV_udid, self.PMS_uuid, 'accesstoken')
+        auth_token = self.getPMSProperty('accesstoken')
         
         dprint(__name__, 0, "Background (Source): {0}", key)
         res = g_param['baseURL']  # base address to PlexConnect